@@ -1,15 +1,104 @@
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
-from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from flask import Flask, render_template, request, redirect, session, url_for, flash, abort
+from flask import (Flask, Response, render_template, request, redirect, session, url_for, flash, abort, g,
+                   get_flashed_messages, has_app_context, has_request_context, make_response, send_from_directory,
+                   stream_template, stream_with_context)
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
 import logging
+import math
+import queue
+import random
+import re
+import select
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+from urllib.parse import quote
+
+from matching import LostMatcher
+from metrics import COUNT_BUCKETS, QUERY_BUCKETS, Metrics, normalize_sql
+from ratelimit import RateLimiter, open_store
+from repository import (LOST_SUMMARY_COLUMNS, MARKET_DETAIL_COLUMNS, MARKET_SORTS, MARKET_SUMMARY_COLUMNS,
+                        PostgresRepository, SqliteRepository, parse_price)
+from sqlite_backend import SqlitePool, sqlite_path
+
+# gunicorn's gevent worker monkey-patches the stdlib before loading the app;
+# with --preload, gunicorn.conf.py patches the master before it imports this
+# module. psycopg2 additionally needs a wait callback so a query yields to
+# other greenlets instead of blocking them all.
+# Only look at gevent if something already imported it: importing it here just
+# to find out it isn't in use would cost every other process ~20 ms.
+gevent_monkey = sys.modules.get('gevent.monkey')
+ASYNC_WORKER = gevent_monkey is not None and gevent_monkey.is_module_patched('socket')
+if ASYNC_WORKER:
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+
+def run_cpu_bound(func, *args):
+    """Call func(*args), on one of gevent's native threads under an async worker.
+
+    Monkey-patched threads are greenlets, so CPU work such as decoding and
+    resizing an image would block every other greenlet on the worker (live
+    streams included) until it finished. The hub's thread pool runs it on a
+    real OS thread while the calling greenlet waits. func must not log or
+    take patched locks. Elsewhere it runs inline.
+    """
+    if ASYNC_WORKER:
+        import gevent
+        # Hand exceptions back rather than raising them in the pool, which would print each one to stderr
+        result, error = gevent.get_hub().threadpool.apply(_call_capturing, (func, args))
+        if error is not None:
+            raise error
+        return result
+    return func(*args)
+
+
+def _call_capturing(func, args):
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, e
+
+
+# Optional speedups for the JSON API: stdlib json and gzip are used without them.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 # Load secrets from environment for production readiness
@@ -20,39 +109,343 @@ app.config['SESSION_COOKIE_SECURE'] = os.environ.get('SESSION_COOKIE_SECURE', 'F
 app.config['SESSION_COOKIE_HTTPONLY'] = os.environ.get('SESSION_COOKIE_HTTPONLY', 'True') == 'True'
 app.config['SESSION_COOKIE_SAMESITE'] = os.environ.get('SESSION_COOKIE_SAMESITE', 'Lax')
 
+# Trust this many X-Forwarded-For/-Proto hops so request.remote_addr is the client, not the
+# proxy; the per-IP rate limits key on it. The default of 1 matches Render, which puts every
+# request behind one proxy. Set 0 where clients connect directly, or they could pick their own IP.
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 1))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT, x_proto=TRUSTED_PROXY_COUNT)
+
 # Upload limits and allowed extensions
 app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 4 * 1024 * 1024))  # 4 MB default
-ALLOWED_EXTENSIONS = set(os.environ.get('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,gif').split(','))
+ALLOWED_EXTENSIONS = set(os.environ.get('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,gif,webp').split(','))
 
 # Admin credentials from env vars (never hardcode in production)
 ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'changeme')
+# Pending claims shown on the admin dashboard at once (oldest beyond this wait for the next page load)
+ADMIN_QUEUE_LIMIT = int(os.environ.get('ADMIN_QUEUE_LIMIT', 50))
+# Most ids one bulk moderation request may act on
+ADMIN_BULK_LIMIT = int(os.environ.get('ADMIN_BULK_LIMIT', 500))
 
 # Supabase Credentials
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
-if SUPABASE_URL and SUPABASE_KEY:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-else:
-    # We still allow the app to run without it, but uploads will fail
-    supabase = None
-    logging.warning("Missing SUPABASE_URL or SUPABASE_KEY. Image uploads will fail.")
+_supabase = None
+_supabase_lock = threading.Lock()
+
+
+def get_supabase():
+    """The Supabase client, created on first use (None without credentials).
+
+    Importing the SDK pulls in httpx, postgrest and storage3 and takes most of
+    a second, so it happens in the first upload or storage sweep rather than
+    at import. Only the storage backend and its background threads need it.
+    """
+    global _supabase
+    if _supabase is None and SUPABASE_URL and SUPABASE_KEY:
+        with _supabase_lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
+
+
+def lazy_service(build):
+    """Decorator for a process-wide object that is built on the first call and reused after.
+
+    Used for everything the app needs at runtime (storage backend, upload
+    queue, rate limiter...), so importing app.py builds none of them.
+    create_app() calls each once, and a --preload master then shares them
+    with the workers it forks. None of them opens a connection or starts a
+    thread when built, so sharing across a fork is safe.
+    """
+    lock = threading.Lock()
+    built = []
+
+    @functools.wraps(build)
+    def get():
+        if not built:
+            with lock:
+                if not built:
+                    built.append(build())
+        return built[0]
+    return get
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# --- DATABASE CONNECTION POOL ---
+# Each gunicorn worker keeps its own small pool; size it so that
+# workers * DB_POOL_MAX stays under the Postgres connection limit.
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_AFTER = float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', 30))  # ping connections idle this long
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection became free within the borrow timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe, per-process pool of psycopg2 connections.
+
+    Idle connections are reused most-recently-returned first, and any that sat
+    idle longer than ``healthcheck_after`` seconds are pinged before being
+    handed out. The pool records the pid that opened its connections: after a
+    fork (gunicorn --preload) the child starts with an empty pool and never
+    touches the parent's sockets.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=5, timeout=10, healthcheck_after=30):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self._cond = threading.Condition()
+        self._reset(os.getpid())
+        # Connections inherited across a fork are kept referenced so they are
+        # never garbage collected (and closed) from the child.
+        self._inherited = []
+
+    def _reset(self, pid):
+        self._pid = pid
+        self._idle = []  # (conn, returned_at) pairs, most recent last
+        self._in_use = set()
+        self._size = 0  # idle + in use + being opened
+        self._filled = False
+        self._counters = dict(borrows=0, created=0, discarded=0, waits=0, timeouts=0)
+
+    def _check_pid(self):
+        # Caller holds self._cond.
+        if self._pid != os.getpid():
+            self._inherited.extend(conn for conn, _ in self._idle)
+            self._inherited.extend(self._in_use)
+            self._reset(os.getpid())
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = False
+        return conn
+
+    def _fill(self):
+        """Open connections up to ``minconn`` the first time a process borrows."""
+        with self._cond:
+            self._check_pid()
+            if self._filled:
+                return
+            self._filled = True
+            missing = max(self.minconn - self._size - 1, 0)
+            self._size += missing
+        for _ in range(missing):
+            try:
+                conn = self._connect()
+            except psycopg2.Error:
+                with self._cond:
+                    self._size -= 1
+                continue
+            with self._cond:
+                self._counters['created'] += 1
+                self._idle.insert(0, (conn, time.monotonic()))
+                self._cond.notify()
+
+    def _reserve(self, deadline):
+        """Take an idle connection, or a slot to open a new one (returns None)."""
+        with self._cond:
+            self._check_pid()
+            waited = False
+            while True:
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._in_use.add(conn)
+                    return conn, returned_at
+                if self._size < self.maxconn:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available within {self.timeout}s "
+                                      f"(pool max is {self.maxconn}).")
+                if not waited:
+                    self._counters['waits'] += 1
+                    waited = True
+                self._cond.wait(remaining)
+
+    def _healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.healthcheck_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            if conn in self._in_use:
+                self._in_use.discard(conn)
+                self._size -= 1
+                self._counters['discarded'] += 1
+                self._cond.notify()
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """Borrow a connection, waiting up to ``timeout`` seconds for one to free up."""
+        if not self._filled or self._pid != os.getpid():
+            self._fill()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, returned_at = self._reserve(deadline)
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._in_use.add(conn)
+                    self._counters['created'] += 1
+                    self._counters['borrows'] += 1
+                return conn
+            if self._healthy(conn, returned_at):
+                with self._cond:
+                    self._counters['borrows'] += 1
+                return conn
+            logging.warning("Discarding broken pooled database connection.")
+            self._discard(conn)
+
+    def putconn(self, conn, close=False):
+        """Return a borrowed connection, rolling back any transaction left open."""
+        if self._pid != os.getpid():
+            return
+        if not conn.closed and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close or conn.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            if conn not in self._in_use:
+                return
+            self._in_use.discard(conn)
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._check_pid()
+            conns = [conn for conn, _ in self._idle] + list(self._in_use)
+            self._reset(self._pid)
+        for conn in conns:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def stats(self):
+        """Snapshot of pool usage for this worker process."""
+        with self._cond:
+            self._check_pid()
+            return dict(self._counters, pid=self._pid, size=self._size, idle=len(self._idle),
+                        in_use=len(self._in_use), min=self.minconn, max=self.maxconn)
+
+
+# DATABASE_URL=sqlite:///path.db (or sqlite:// for in-memory) runs the app on
+# SQLite instead, for offline development and benchmarking.
+USE_SQLITE = bool(DATABASE_URL) and DATABASE_URL.startswith('sqlite:')
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """This process's connection pool, created on first use (None without DATABASE_URL).
+
+    Nothing database-related happens at import, so a gunicorn --preload
+    master never holds a pool, and each worker builds its own (with its
+    locks already gevent-patched) on its first request.
+    """
+    global _db_pool
+    if _db_pool is None and DATABASE_URL:
+        with _db_pool_lock:
+            if _db_pool is None:
+                if USE_SQLITE:
+                    _db_pool = SqlitePool(sqlite_path(DATABASE_URL), DB_POOL_MAX, DB_POOL_TIMEOUT,
+                                          timeout_error=PoolTimeout)
+                else:
+                    _db_pool = ConnectionPool(DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT,
+                                              DB_POOL_HEALTHCHECK_AFTER)
+    return _db_pool
+
+
 def get_db_connection():
+    """Borrow a pooled connection.
+
+    Inside an app context the connection is shared by everything the request
+    does and handed back to the pool on teardown. Outside one (startup tasks,
+    scripts) the caller must return it with ``get_db_pool().putconn(conn)``.
+    """
     if not DATABASE_URL:
-        raise Exception("DATABASE_URL is not set. Please configure it in your environment.")
-    conn = psycopg2.connect(DATABASE_URL)
-    conn.autocommit = False
-    return conn
+        raise Exception("DATABASE_URL is not set. Configure a Postgres URL, or sqlite:///hustl.db to run offline.")
+    if not has_app_context():
+        return get_db_pool().getconn()
+    if 'db_conn' not in g:
+        g.db_conn = get_db_pool().getconn()
+    return g.db_conn
+
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        get_db_pool().putconn(conn)
+
+
+DB_ERRORS = (psycopg2.Error, sqlite3.Error)
+
+
+# Rows a streaming query (safe_execute(..., stream=True)) fetches per round trip
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 1000))
+
+
+def stream_rows(conn, sql, params=()):
+    """Yield rows from a server-side (named) cursor, STREAM_CHUNK_SIZE at a time.
+
+    The cursor stays open in the connection's transaction until the rows run
+    out or the generator is closed; the pool rolls that transaction back. A DB
+    error is logged and ends the stream early.
+    """
+    try:
+        with conn.cursor(name=f'stream_{uuid.uuid4().hex}', cursor_factory=RealDictCursor) as cur:
+            cur.itersize = STREAM_CHUNK_SIZE
+            cur.execute(sql, params)
+            yield from cur
+    except DB_ERRORS as e:
+        conn.rollback()
+        logging.exception('DB error streaming SQL: %s | params=%s | Error: %s', sql, params, e)
 
 
 # safe execute helper: wraps execute/commit and logs errors
-def safe_execute(conn, sql, params=(), commit=False, fetchone=False, fetchall=False):
+def safe_execute(conn, sql, params=(), commit=False, fetchone=False, fetchall=False, stream=False):
+    if stream:
+        return stream_rows(conn, sql, params)
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(sql, params)
@@ -63,91 +456,1742 @@ def safe_execute(conn, sql, params=(), commit=False, fetchone=False, fetchall=Fa
             if fetchall:
                 return cur.fetchall()
             return cur
-    except psycopg2.Error as e:
+    except DB_ERRORS as e:
         conn.rollback()
         logging.exception('DB error executing SQL: %s | params=%s | Error: %s', sql, params, e)
         return None
 
 
-def init_db():
-    if not DATABASE_URL:
-        logging.warning("DATABASE_URL not set, skipping DB init.")
-        return
+# --- QUERY INSTRUMENTATION ---
+# Off by default. With METRICS_ENABLED and SLOW_QUERY_MS both unset,
+# safe_execute is not wrapped and no request hooks are registered.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
+METRICS_DIR = os.environ.get('METRICS_DIR')  # shared snapshot dir so /metrics covers every gunicorn worker
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # if set, /metrics requires "Authorization: Bearer <token>"
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))  # 0 disables the slow-query log
+SLOW_QUERY_EXPLAIN_INTERVAL = 300  # seconds between EXPLAINs of the same query shape, per worker
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))  # same statement this often in one request
+
+
+
+@lazy_service
+def get_metrics():
+    metrics = Metrics(METRICS_DIR)
+    metrics.histogram('hustl_http_request_duration_seconds', 'Request latency by route.')
+    metrics.counter('hustl_http_requests_total', 'Requests by route and status code.')
+    metrics.histogram('hustl_db_queries_per_request', 'SQL statements run per request.', COUNT_BUCKETS)
+    metrics.histogram('hustl_db_time_per_request_seconds', 'Time spent in SQL per request.')
+    metrics.histogram('hustl_db_query_duration_seconds', 'Time per SQL statement.', QUERY_BUCKETS)
+    metrics.counter('hustl_db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.')
+    metrics.counter('hustl_db_n_plus_one_total', 'Requests that repeated one statement N_PLUS_ONE_THRESHOLD times.')
+    return metrics
+
+
+_explained_at = {}  # normalized SQL -> when it was last EXPLAINed
+
+
+def log_slow_query(conn, sql, params, elapsed):
+    """Log a slow statement with its normalized SQL and, now and then, its plan."""
+    shape = normalize_sql(sql)
+    plan = None
+    now = time.monotonic()
+    if now - _explained_at.get(shape, -SLOW_QUERY_EXPLAIN_INTERVAL) >= SLOW_QUERY_EXPLAIN_INTERVAL:
+        _explained_at[shape] = now
+        try:
+            plan = repo.explain(conn, sql, params)
+        except DB_ERRORS as e:
+            logging.debug("Could not EXPLAIN slow query: %s", e)
+    where = f"{request.method} {request.path}" if has_request_context() else 'background'
+    logging.warning("Slow query (%.1f ms, %s): %s%s", elapsed * 1000, where, shape, f"\n{plan}" if plan else '')
+    if METRICS_ENABLED:
+        get_metrics().inc('hustl_db_slow_queries_total')
+
+
+def record_query(conn, sql, params, elapsed):
+    """Count one statement's time in the request stats and log it if it was slow."""
+    if METRICS_ENABLED:
+        get_metrics().observe('hustl_db_query_duration_seconds', elapsed)
+        if has_request_context():
+            g.db_queries = g.get('db_queries', 0) + 1
+            g.db_time = g.get('db_time', 0.0) + elapsed
+            g.setdefault('db_statements', Counter())[sql] += 1
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        log_slow_query(conn, sql, params, elapsed)
+
+
+def timed_rows(rows, on_done):
+    """Yield from a streamed query, timing only its fetches; calls on_done(seconds) once it ends or is closed."""
+    elapsed = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            row = next(rows, None)
+            elapsed += time.perf_counter() - started
+            if row is None:
+                return
+            yield row
+    finally:
+        rows.close()
+        on_done(elapsed)
+
+
+def instrument_queries(execute):
+    """Wrap safe_execute to time each statement for request stats and the slow-query log.
+
+    A streamed statement (stream=True) returns before it runs, so it is timed
+    while the caller consumes its rows, and recorded when they run out.
+    """
+    @functools.wraps(execute)
+    def instrumented(conn, sql, *args, **kwargs):
+        params = args[0] if args else kwargs.get('params', ())
+        if kwargs.get('stream'):
+            rows = execute(conn, sql, *args, **kwargs)
+            return timed_rows(rows, lambda elapsed: record_query(conn, sql, params, elapsed))
+        started = time.perf_counter()
+        try:
+            return execute(conn, sql, *args, **kwargs)
+        finally:
+            record_query(conn, sql, params, time.perf_counter() - started)
+    return instrumented
+
+
+if METRICS_ENABLED or SLOW_QUERY_MS:
+    safe_execute = instrument_queries(safe_execute)
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        elapsed = time.perf_counter() - g.pop('request_started', time.perf_counter())
+        route = request.endpoint or 'unmatched'
+        labels = (('method', request.method), ('route', route))
+        get_metrics().observe('hustl_http_request_duration_seconds', elapsed, labels)
+        get_metrics().inc('hustl_http_requests_total', labels + (('status', str(response.status_code)),))
+        queries, db_time = g.get('db_queries', 0), g.get('db_time', 0.0)
+        get_metrics().observe('hustl_db_queries_per_request', queries, (('route', route),))
+        get_metrics().observe('hustl_db_time_per_request_seconds', db_time, (('route', route),))
+        if queries:
+            response.headers['X-DB-Queries'] = str(queries)
+            response.headers['Server-Timing'] = f'db;dur={db_time * 1000:.1f}'
+        repeated = [(count, sql) for sql, count in g.get('db_statements', {}).items() if count >= N_PLUS_ONE_THRESHOLD]
+        if repeated:
+            get_metrics().inc('hustl_db_n_plus_one_total', (('route', route),))
+            for count, sql in repeated:
+                logging.warning("Possible N+1 in %s %s: %d x %s", request.method, request.path, count,
+                                normalize_sql(sql))
+        get_metrics().maybe_flush()
+        return response
+
+    @app.route("/metrics")
+    def prometheus_metrics():
+        if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''),
+                                                     f'Bearer {METRICS_TOKEN}'):
+            abort(401)
+        return get_metrics().render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+# All queries go through the repository (see repository.py); it picks the SQL
+# dialect to match the database.
+STATS_LOCK_KEY = 4857_2027
+repo = (SqliteRepository if USE_SQLITE else PostgresRepository)(safe_execute, STATS_LOCK_KEY)
+
+
+# --- SCHEMA MIGRATIONS ---
+# Ordered and append-only: once a migration has shipped, never edit it, add a
+# new one instead. Applied versions are recorded in schema_version.
+MIGRATIONS = [
+    (1, 'base tables', '''
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            email TEXT UNIQUE, password_hash TEXT, reg_number TEXT, whatsapp TEXT,
+            display_name TEXT, legal_name TEXT, user_type TEXT,
+            id_proof_link TEXT, social_link TEXT,
+            role TEXT DEFAULT 'pending_verification',
+            is_verified INTEGER DEFAULT 0);
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS password_hash TEXT;
+
+        CREATE TABLE IF NOT EXISTS market_items (
+            id SERIAL PRIMARY KEY,
+            title TEXT, brand TEXT, price TEXT, whatsapp TEXT, image TEXT,
+            is_sold INTEGER DEFAULT 0,
+            seller_brand TEXT, user_id INTEGER);
+
+        CREATE TABLE IF NOT EXISTS lost_items (
+            id SERIAL PRIMARY KEY,
+            title TEXT, description TEXT, location TEXT, custody TEXT,
+            image TEXT, is_recovered INTEGER DEFAULT 0);
+        ALTER TABLE lost_items ADD COLUMN IF NOT EXISTS is_recovered INTEGER DEFAULT 0;
+
+        CREATE TABLE IF NOT EXISTS claim_requests (
+            id SERIAL PRIMARY KEY,
+            item_id INTEGER REFERENCES lost_items(id) ON DELETE CASCADE,
+            requester_email TEXT NOT NULL,
+            proof_details TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    '''),
+    # /market, /market/feed and index(): unsold listings newest first
+    (2, 'index market_items (is_sold, id)',
+     'CREATE INDEX IF NOT EXISTS market_items_is_sold_id_idx ON market_items (is_sold, id DESC)'),
+    # seller_dash(), seller_profile(), listing_detail() "more from this seller"
+    (3, 'index market_items (user_id)',
+     'CREATE INDEX IF NOT EXISTS market_items_user_id_idx ON market_items (user_id)'),
+    # lost(): open reports newest first
+    (4, 'index lost_items (is_recovered, id)',
+     'CREATE INDEX IF NOT EXISTS lost_items_is_recovered_id_idx ON lost_items (is_recovered, id DESC)'),
+    # admin_dashboard() pending claims and lost() weekly stats
+    (5, 'index claim_requests (status, created_at)',
+     'CREATE INDEX IF NOT EXISTS claim_requests_status_created_at_idx ON claim_requests (status, created_at)'),
+    # admin_dashboard() pending sellers, seller_profile()
+    (6, 'index users (is_verified)',
+     'CREATE INDEX IF NOT EXISTS users_is_verified_idx ON users (is_verified)'),
+    # Background uploads: 'pending' until the spooled image reaches storage
+    (7, 'image_status columns', '''
+        ALTER TABLE market_items ADD COLUMN IF NOT EXISTS image_status TEXT NOT NULL DEFAULT 'ready';
+        ALTER TABLE lost_items ADD COLUMN IF NOT EXISTS image_status TEXT NOT NULL DEFAULT 'ready';
+    '''),
+    # Counters for lost() and admin_dashboard(), maintained by the write routes
+    (8, 'site_stats counters', '''
+        ALTER TABLE claim_requests ADD COLUMN IF NOT EXISTS reviewed_at TIMESTAMP;
+        CREATE TABLE IF NOT EXISTS site_stats (
+            name TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE IF NOT EXISTS claim_approvals_daily (
+            day DATE PRIMARY KEY,
+            approvals INTEGER NOT NULL DEFAULT 0);
+    '''),
+    # /search: weighted full-text vectors kept current by Postgres itself
+    # (generated columns), plus trigram indexes on titles for typo matching
+    (9, 'full-text search', '''
+        ALTER TABLE market_items ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(brand, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(seller_brand, '')), 'C')) STORED;
+        CREATE INDEX IF NOT EXISTS market_items_search_idx ON market_items USING GIN (search_vector);
+        ALTER TABLE lost_items ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(location, '')), 'C')) STORED;
+        CREATE INDEX IF NOT EXISTS lost_items_search_idx ON lost_items USING GIN (search_vector);
+        -- Typo tolerance needs pg_trgm (bundled with Supabase); skip it where
+        -- the server doesn't ship the extension.
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                CREATE INDEX IF NOT EXISTS market_items_title_trgm_idx ON market_items USING GIN (title gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS lost_items_title_trgm_idx ON lost_items USING GIN (title gin_trgm_ops);
+            END IF;
+        END $$;
+    '''),
+    # Page cache: per-listing versions for cached cards, and the catalog_version counter
+    (10, 'listing row versions', '''
+        ALTER TABLE market_items ADD COLUMN IF NOT EXISTS row_version INTEGER NOT NULL DEFAULT 1;
+        CREATE OR REPLACE FUNCTION bump_row_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.row_version := OLD.row_version + 1;
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS market_items_row_version ON market_items;
+        CREATE TRIGGER market_items_row_version BEFORE UPDATE ON market_items
+            FOR EACH ROW EXECUTE FUNCTION bump_row_version();
+        INSERT INTO site_stats (name, value) VALUES ('catalog_version', 0) ON CONFLICT (name) DO NOTHING;
+    '''),
+    (11, 'storage_deletions queue and image indexes', '''
+        CREATE TABLE IF NOT EXISTS storage_deletions (
+            name TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at BIGINT NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE INDEX IF NOT EXISTS storage_deletions_next_attempt_at_idx ON storage_deletions (next_attempt_at);
+        CREATE INDEX IF NOT EXISTS market_items_image_idx ON market_items (image);
+        CREATE INDEX IF NOT EXISTS lost_items_image_idx ON lost_items (image);
+    '''),
+    (12, 'NOTIFY hustl_events on listing and claim changes', '''
+        CREATE OR REPLACE FUNCTION notify_market_item_change() RETURNS trigger AS $$
+        DECLARE
+            item market_items;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN item := OLD; ELSE item := NEW; END IF;
+            PERFORM pg_notify('hustl_events', json_build_object(
+                'table', TG_TABLE_NAME, 'op', lower(TG_OP), 'id', item.id,
+                'is_sold', item.is_sold, 'image_status', item.image_status)::text);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS market_items_notify ON market_items;
+        CREATE TRIGGER market_items_notify AFTER INSERT OR DELETE OR UPDATE OF is_sold, image_status ON market_items
+            FOR EACH ROW EXECUTE FUNCTION notify_market_item_change();
+
+        CREATE OR REPLACE FUNCTION notify_claim_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('hustl_events', json_build_object(
+                'table', TG_TABLE_NAME, 'op', lower(TG_OP), 'id', NEW.id,
+                'item_id', NEW.item_id, 'status', NEW.status)::text);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS claim_requests_notify ON claim_requests;
+        CREATE TRIGGER claim_requests_notify AFTER INSERT OR UPDATE OF status ON claim_requests
+            FOR EACH ROW EXECUTE FUNCTION notify_claim_change();
+    '''),
+    # seller_profile() and listing_detail() "more from this seller": newest unsold per seller
+    (13, 'index unsold market_items per seller',
+     'CREATE INDEX IF NOT EXISTS market_items_seller_unsold_idx ON market_items (user_id, id DESC) WHERE is_sold = 0'),
+    # market() price filter and sort: the first number in the price text (repository.parse_price)
+    (14, 'numeric market_items.price_value', '''
+        ALTER TABLE market_items ADD COLUMN IF NOT EXISTS price_value NUMERIC(12, 2);
+        UPDATE market_items SET price_value = CAST(parsed.amount AS NUMERIC(12, 2))
+        FROM (SELECT id, substring(replace(price, ',', '') FROM '[0-9]+(?:[.][0-9]+)?') AS amount
+              FROM market_items WHERE price_value IS NULL) AS parsed
+        WHERE market_items.id = parsed.id AND parsed.amount ~ '^[0-9]{1,10}([.]|$)';
+        CREATE INDEX IF NOT EXISTS market_items_is_sold_price_value_id_idx ON market_items (is_sold, price_value, id);
+    '''),
+    # stage_image_upload(): one row per stored image, counting the rows that use it, plus its
+    # perceptual hash with an index per 16-bit band (repository.PHASH_BAND_SQL). Existing images
+    # get their counts here; their pHash stays NULL, so only new uploads show up as near-duplicates.
+    (15, 'refcounted images with perceptual hash', '''
+        CREATE TABLE IF NOT EXISTS images (
+            name TEXT PRIMARY KEY,
+            phash BIGINT,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        INSERT INTO images (name, refcount, status)
+        SELECT image, COUNT(*), CASE WHEN MAX(CASE WHEN image_status = 'ready' THEN 1 ELSE 0 END) = 1
+                                     THEN 'ready' ELSE 'pending' END
+        FROM (SELECT image, image_status FROM market_items
+              UNION ALL
+              SELECT image, image_status FROM lost_items) AS used
+        WHERE image IS NOT NULL AND image <> 'default.png'
+        GROUP BY image
+        ON CONFLICT (name) DO NOTHING;
+        CREATE INDEX IF NOT EXISTS images_phash_band0_idx ON images (((phash >> 48) & 65535));
+        CREATE INDEX IF NOT EXISTS images_phash_band1_idx ON images (((phash >> 32) & 65535));
+        CREATE INDEX IF NOT EXISTS images_phash_band2_idx ON images (((phash >> 16) & 65535));
+        CREATE INDEX IF NOT EXISTS images_phash_band3_idx ON images ((phash & 65535));
+    '''),
+]
+
+# Key for pg_advisory_lock so only one process migrates at a time.
+MIGRATION_LOCK_KEY = 4857_2026
+
+
+def run_migrations():
+    """Apply pending migrations in order and return the versions applied.
+
+    Holds a session-level advisory lock for the whole run: a second process
+    started at the same time blocks until the first finishes, then finds
+    nothing left to do. Each migration commits together with its
+    schema_version row, so a failure leaves earlier ones in place.
+    """
     conn = get_db_connection()
+    if USE_SQLITE:
+        # SQLite keeps its own schema steps (sqlite_backend.SQLITE_MIGRATIONS).
+        try:
+            return get_db_pool().migrate(conn)
+        finally:
+            if not has_app_context():
+                get_db_pool().putconn(conn)
+    applied_now = []
     try:
-        # Create base tables if they don't exist
-        safe_execute(conn, '''CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        email TEXT UNIQUE, password_hash TEXT, reg_number TEXT, whatsapp TEXT,
-                        display_name TEXT, legal_name TEXT, user_type TEXT,
-                        id_proof_link TEXT, social_link TEXT,
-                        role TEXT DEFAULT 'pending_verification',
-                        is_verified INTEGER DEFAULT 0)''', commit=True)
-        # Migrate existing users
-        safe_execute(conn, 'ALTER TABLE users ADD COLUMN IF NOT EXISTS password_hash TEXT', commit=True)
-
-        safe_execute(conn, '''CREATE TABLE IF NOT EXISTS market_items (
-                        id SERIAL PRIMARY KEY,
-                        title TEXT, brand TEXT, price TEXT, whatsapp TEXT, image TEXT,
-                        is_sold INTEGER DEFAULT 0,
-                        seller_brand TEXT, user_id INTEGER)''', commit=True)
-
-        safe_execute(conn, '''CREATE TABLE IF NOT EXISTS lost_items (
-                        id SERIAL PRIMARY KEY,
-                        title TEXT, description TEXT, location TEXT, custody TEXT,
-                        image TEXT, is_recovered INTEGER DEFAULT 0)''', commit=True)
-        # Migrate existing lost_items
-        safe_execute(conn, 'ALTER TABLE lost_items ADD COLUMN IF NOT EXISTS is_recovered INTEGER DEFAULT 0', commit=True)
-
-        safe_execute(conn, '''CREATE TABLE IF NOT EXISTS claim_requests (
-                        id SERIAL PRIMARY KEY,
-                        item_id INTEGER REFERENCES lost_items(id) ON DELETE CASCADE,
-                        requester_email TEXT NOT NULL,
-                        proof_details TEXT NOT NULL,
-                        status TEXT DEFAULT 'pending',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''', commit=True)
+        conn.rollback()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_KEY,))
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                                   version INTEGER PRIMARY KEY,
+                                   name TEXT NOT NULL,
+                                   applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+                conn.commit()
+                cur.execute('SELECT version FROM schema_version')
+                done = {row[0] for row in cur.fetchall()}
+                conn.commit()
+                for version, name, sql in MIGRATIONS:
+                    if version in done:
+                        continue
+                    logging.info("Applying migration %s: %s", version, name)
+                    try:
+                        cur.execute(sql)
+                        cur.execute('INSERT INTO schema_version (version, name) VALUES (%s, %s)', (version, name))
+                        conn.commit()
+                    except psycopg2.Error:
+                        conn.rollback()
+                        logging.exception("Migration %s (%s) failed", version, name)
+                        raise
+                    applied_now.append(version)
+        finally:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_KEY,))
+            conn.autocommit = False
     finally:
-        conn.close()
+        if not has_app_context():
+            get_db_pool().putconn(conn)
+    return applied_now
 
-# Initialize database with error handling - don't crash deployment if DB is unreachable
-try:
-    init_db()
-except Exception as e:
-    logging.error(f"Failed to initialize database at startup: {e}. The app will continue but database operations may fail until the issue is resolved.")
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations (run once per deploy, before gunicorn starts)."""
+    applied = run_migrations()
+    if applied:
+        print(f"Applied migrations: {', '.join(map(str, applied))}")
+    else:
+        print("Database schema is up to date.")
 
 # --- HELPER: get public storage URL ---
-def get_image_url(filename):
-    if not filename or filename == 'default.png':
+IMAGE_BUCKET = 'market-images'
+IMAGE_URL_CACHE_SIZE = int(os.environ.get('IMAGE_URL_CACHE_SIZE', 4096))
+
+_public_image_base = None
+
+
+def get_public_image_base():
+    """Public URL prefix of the images bucket, built once per process."""
+    global _public_image_base
+    if _public_image_base is None and SUPABASE_URL:
+        # The same string the SDK's get_public_url() builds, without importing
+        # the SDK on a request that only renders images.
+        _public_image_base = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/public/{quote(IMAGE_BUCKET)}/"
+    return _public_image_base
+
+
+@functools.lru_cache(maxsize=IMAGE_URL_CACHE_SIZE)
+def public_image_url(filename):
+    return get_public_image_base() + quote(filename)
+
+
+def _resolve_image_url(filename, variant, status='ready'):
+    g.image_url_resolutions = g.get('image_url_resolutions', 0) + 1
+    if not filename or filename == 'default.png' or status == 'failed':
         return url_for('static', filename='images/default.png')
-    if supabase:
+    if status == 'pending':
+        # Still in the upload spool; served locally until the upload lands.
+        return url_for('pending_image', name=image_variant_name(filename, variant))
+    storage = get_storage()
+    if storage:
         try:
-            return supabase.storage.from_('market-images').get_public_url(filename)
+            return storage.public_url(image_variant_name(filename, variant))
         except Exception:
-            pass
+            logging.exception("Could not build public URL for %s", filename)
     # Fallback if unconfigured
     return url_for('static', filename=f'images/{filename}')
 
+
+def resolve_image_urls(*result_sets, key='image', variant='grid'):
+    """Resolve the image URL of every row in one pass before rendering.
+
+    Each distinct (filename, variant) is resolved once and kept for the rest
+    of the request, so the per-row get_image_url() calls in templates are
+    plain dictionary lookups. Rows whose upload is still queued resolve to
+    the spooled copy.
+    """
+    urls = g.setdefault('image_urls', {})
+    for rows in result_sets:
+        for row in rows or ():
+            cache_key = (row.get(key), variant)
+            if cache_key not in urls:
+                urls[cache_key] = _resolve_image_url(*cache_key, status=row.get('image_status', 'ready'))
+
+
+def get_image_url(filename, variant='grid'):
+    """URL of an image at one of the IMAGE_VARIANTS sizes ('thumb', 'grid', 'detail')."""
+    urls = g.setdefault('image_urls', {})
+    if (filename, variant) not in urls:
+        urls[(filename, variant)] = _resolve_image_url(filename, variant)
+    return urls[(filename, variant)]
+
+
+# --- IMAGE PROCESSING ---
+# Uploads are decoded and re-encoded server-side: the real format is checked
+# (allowed_file() only looks at the extension), EXIF/ICC metadata is dropped,
+# and each size in IMAGE_VARIANTS is stored as its own object named after the
+# SHA-256 of the original upload, e.g. <hash>_grid.webp. The row keeps the
+# base name <hash>.webp and get_image_url() maps it to the variant a view needs.
+UPLOAD_IMAGE_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+IMAGE_VARIANTS = {
+    'thumb': 160,    # admin tables, seller dashboard
+    'grid': 480,     # market, home and lost & found cards
+    'detail': 1200,  # listing page
+}
+IMAGE_VARIANT_FORMAT = os.environ.get('IMAGE_VARIANT_FORMAT', 'webp').lower()
+# Refuse decompression bombs long before they reach the resize step.
+Image.MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 40_000_000))
+
+_VARIANT_BASE_RE = re.compile(r'^([0-9a-f]{32})\.(webp|jpg)$')
+_VARIANT_OBJECT_RE = re.compile(r'^([0-9a-f]{32})_(%s)\.(webp|jpg)$' % '|'.join(IMAGE_VARIANTS))
+
+
+class InvalidImage(ValueError):
+    """The uploaded file is not an image we accept."""
+
+
+def image_variant_name(filename, variant):
+    """Storage object for one size of an image; legacy uploads only have their original."""
+    m = _VARIANT_BASE_RE.match(filename or '')
+    if not m:
+        return filename
+    return f'{m.group(1)}_{variant}.{m.group(2)}'
+
+
+def image_base_name(object_name):
+    """The image column value a storage object belongs to (inverse of image_variant_name)."""
+    m = _VARIANT_OBJECT_RE.match(object_name)
+    return f'{m.group(1)}.{m.group(3)}' if m else object_name
+
+
+def image_object_names(filename):
+    """Every storage object behind an image column value."""
+    if not _VARIANT_BASE_RE.match(filename or ''):
+        return [filename]
+    return [image_variant_name(filename, variant) for variant in IMAGE_VARIANTS]
+
+
+# The picture is shrunk to PHASH_SIZE x PHASH_SIZE greys; its 8x8 lowest DCT frequencies make the hash
+PHASH_SIZE = 32
+_PHASH_COS = [[math.cos((2 * x + 1) * u * math.pi / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)] for u in range(8)]
+
+
+def perceptual_hash(img):
+    """64-bit DCT perceptual hash as a signed BIGINT: one bit per low frequency, set if above the median.
+
+    Re-encoding, resizing or light edits flip only a few bits, so reposts of
+    one photo land a small Hamming distance apart (repository.phash_distance).
+    """
+    grey = img.convert('L').resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = grey.tobytes()  # one byte per grey pixel, row by row
+    # Separable DCT-II: each row against the 8 lowest cosines, then each of those columns likewise
+    rows = [[sum(p * c for p, c in zip(pixels[y * PHASH_SIZE:(y + 1) * PHASH_SIZE], cos)) for cos in _PHASH_COS]
+            for y in range(PHASH_SIZE)]
+    low = [sum(rows[y][u] * cos[y] for y in range(PHASH_SIZE)) for cos in _PHASH_COS for u in range(8)]
+    median = statistics.median(low)
+    bits = 0
+    for value in low:
+        bits = (bits << 1) | (value > median)
+    return bits - (1 << 64) if bits >= 1 << 63 else bits
+
+
+@lazy_service
+def image_variant_format():
+    """(Pillow format, file extension) of stored variants: IMAGE_VARIANT_FORMAT if this Pillow can write it."""
+    if IMAGE_VARIANT_FORMAT == 'webp' and not features.check('webp'):
+        logging.warning("Pillow was built without WebP support; storing JPEG image variants.")
+        return 'jpeg', 'jpg'
+    return IMAGE_VARIANT_FORMAT, 'webp' if IMAGE_VARIANT_FORMAT == 'webp' else 'jpg'
+
+
+def upload_base_name(data):
+    """The image column value for raw upload bytes: a prefix of their SHA-256."""
+    return f'{hashlib.sha256(data).hexdigest()[:32]}.{image_variant_format()[1]}'
+
+
+def check_upload_image(data):
+    """Raise InvalidImage unless the bytes are an image we accept; reads the headers, not the pixels."""
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            source_format = probe.format
+            probe.verify()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise InvalidImage("That file is not a valid image.") from e
+    if source_format not in UPLOAD_IMAGE_FORMATS:
+        raise InvalidImage(f"{source_format or 'Unknown'} images are not supported.")
+
+
+def process_upload_image(data):
+    """Validate raw upload bytes and render every size variant.
+
+    Returns (base_name, {object_name: (bytes, content_type)}, phash).
+    """
+    variant_format, variant_ext = image_variant_format()
+    check_upload_image(data)
+    try:
+        img = Image.open(io.BytesIO(data))
+        # Bake the camera orientation into the pixels before the EXIF goes.
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        if variant_format == 'webp' and has_alpha:
+            img = img.convert('RGBA')
+        else:
+            img = img.convert('RGB')
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise InvalidImage("That file is not a valid image.") from e
+
+    base_name = upload_base_name(data)
+    digest = base_name.split('.')[0]
+    content_type = f'image/{variant_format}'
+    variants = {}
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = img.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        # No exif=/icc_profile= arguments, so no metadata is written out.
+        if variant_format == 'webp':
+            resized.save(buf, format='WEBP', quality=80, method=4)
+        else:
+            resized.save(buf, format='JPEG', quality=82, optimize=True, progressive=True)
+        variants[f'{digest}_{variant}.{variant_ext}'] = (buf.getvalue(), content_type)
+    return base_name, variants, perceptual_hash(img)
+
+
+# --- STORAGE BACKENDS ---
+# Anything with upload(path, data, content_type) and public_url(path) works as
+# a backend; STORAGE_BACKEND=local swaps the bucket for a folder so uploads
+# can be exercised without Supabase.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'supabase')
+
+
+class SupabaseStorage:
+    """The Supabase Storage bucket images are served from in production.
+
+    ``get_client`` is called on first use, so the SDK is only loaded by the
+    upload and janitor threads that talk to the bucket.
+    """
+
+    def __init__(self, get_client, bucket):
+        self.get_client = get_client
+        self.bucket = bucket
+
+    @property
+    def client(self):
+        return self.get_client()
+
+    def upload(self, path, data, content_type):
+        # Names are content hashes, so re-uploading the same photo just rewrites identical bytes.
+        self.client.storage.from_(self.bucket).upload(
+            file=data, path=path, file_options={"content-type": content_type, "upsert": "true"})
+
+    def remove(self, paths):
+        self.client.storage.from_(self.bucket).remove(list(paths))
+
+    def list_objects(self, offset, limit):
+        """One page of (name, created_at epoch seconds) for the bucket's objects, by name."""
+        entries = self.client.storage.from_(self.bucket).list(
+            None, {"limit": limit, "offset": offset, "sortBy": {"column": "name", "order": "asc"}})
+        page = []
+        for entry in entries:
+            if entry.get('id') is None:
+                continue  # a folder placeholder
+            created = entry.get('created_at')
+            page.append((entry['name'], datetime.fromisoformat(created).timestamp() if created else None))
+        return page
+
+    def public_url(self, path):
+        return public_image_url(path)
+
+
+class LocalStorage:
+    """Writes objects under static/uploads, standing in for the bucket locally."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def upload(self, path, data, content_type):
+        target = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # object names are content hashes, so concurrent uploads of one image must not share a temp file
+        tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, target)
+
+    def remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(os.path.join(self.root, path))
+            except FileNotFoundError:
+                pass
+
+    def list_objects(self, offset, limit):
+        try:
+            names = sorted(name for name in os.listdir(self.root) if not name.endswith('.tmp'))
+        except FileNotFoundError:
+            return []
+        page = []
+        for name in names[offset:offset + limit]:
+            try:
+                page.append((name, os.path.getmtime(os.path.join(self.root, name))))
+            except FileNotFoundError:
+                continue
+        return page
+
+    def public_url(self, path):
+        return url_for('static', filename=f'uploads/{path}')
+
+
+@lazy_service
+def get_storage():
+    """The configured storage backend, or None when there is nowhere to put images."""
+    if STORAGE_BACKEND == 'local':
+        return LocalStorage(os.path.join(app.static_folder, 'uploads'))
+    if SUPABASE_URL and SUPABASE_KEY:
+        return SupabaseStorage(get_supabase, IMAGE_BUCKET)
+    return None
+
+
+# --- BACKGROUND UPLOADS ---
+# Handlers never wait on storage: they spool the processed variants to local
+# disk, insert the row with image_status = 'pending' and redirect. A small
+# thread pool per worker uploads the spool, retrying with exponential
+# backoff, then marks the row 'ready' (or 'failed' once retries run out).
+UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'hustl-upload-spool'))
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+UPLOAD_MAX_ATTEMPTS = int(os.environ.get('UPLOAD_MAX_ATTEMPTS', 5))
+UPLOAD_RETRY_BASE_DELAY = float(os.environ.get('UPLOAD_RETRY_BASE_DELAY', 2))  # seconds, doubled per retry
+UPLOAD_RECOVER_AFTER = 600  # seconds before another worker adopts a job nobody is touching
+UPLOAD_RECOVER_INTERVAL = 60  # seconds between looks for such jobs (and touches of this worker's own)
+
+IMAGE_TABLES = ('market_items', 'lost_items')
+
+
+class UploadQueue:
+    """Spool-backed background uploader.
+
+    Spool layout: objects/<name> holds the bytes to upload and jobs/<id>.json
+    describes one upload and the row (or rows) showing it. A job spooled
+    with spool_source() carries sources/<id>, raw bytes that a worker turns
+    into objects with ``process`` before uploading them; a bad source fails
+    the job without retries. Jobs are held in memory by the worker that
+    accepted them, which touch the job files they hold every
+    UPLOAD_RECOVER_INTERVAL seconds. A job file nobody has touched for
+    UPLOAD_RECOVER_AFTER seconds (its worker died) is adopted by whichever
+    worker looks next: each looks when it starts and then on that interval.
+    Threads start with start() (or the first submit()) in each process, so
+    the queue is safe under --preload.
+    """
+
+    def __init__(self, storage, spool_dir, workers=2, max_attempts=5, base_delay=2.0, on_finish=None, process=None):
+        self.storage = storage
+        self.objects_dir = os.path.join(spool_dir, 'objects')
+        self.sources_dir = os.path.join(spool_dir, 'sources')
+        self.jobs_dir = os.path.join(spool_dir, 'jobs')
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.on_finish = on_finish  # called as on_finish(job, ok)
+        # called as process(source bytes) -> ({name: (bytes, content_type)}, fields to add to the job);
+        # raises ValueError for a source that can never be processed
+        self.process = process
+        self._cond = threading.Condition()
+        self._heap = []  # (run_at, seq, job)
+        self._seq = itertools.count()
+        self._pid = None
+        self._active = 0
+        self._running = set()  # ids of the jobs being attempted now
+
+    def start(self):
+        """Start this process's upload threads, once, and adopt stale jobs (see start_background_threads())."""
+        self._ensure_started()
+
+    def spool(self, variants):
+        """Write processed variants to the spool; returns a job to submit once the row exists."""
+        os.makedirs(self.objects_dir, exist_ok=True)
+        for name, (data, _) in variants.items():
+            path = os.path.join(self.objects_dir, name)
+            tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return {'id': uuid.uuid4().hex, 'objects': {name: ct for name, (_, ct) in variants.items()}, 'attempt': 0}
+
+    def spool_source(self, data, **fields):
+        """Write raw bytes for a worker to process and upload; returns a job (with ``fields``) to submit."""
+        job = dict(fields, id=uuid.uuid4().hex, objects={}, source=True, attempt=0)
+        os.makedirs(self.sources_dir, exist_ok=True)
+        path = self._source_path(job['id'])
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        return job
+
+    def submit(self, job, table, row_id):
+        """Queue a spooled job; ``row_id`` is the row showing the image, or a list of rows."""
+        job.update(table=table, row_id=row_id)
+        self._save(job)
+        self._ensure_started()
+        self._schedule(job, delay=0)
+
+    def spooled_path(self, name):
+        path = os.path.join(self.objects_dir, name)
+        return path if os.path.isfile(path) else None
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap) + self._active
+
+    def drain(self, timeout=None):
+        """Block until every queued job has finished (for tests and benchmarks)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._heap or self._active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f'{job_id}.json')
+
+    def _source_path(self, job_id):
+        return os.path.join(self.sources_dir, job_id)
+
+    def _save(self, job):
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        path = self._job_path(job['id'])
+        with open(path + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(path + '.tmp', path)
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._heap = []
+            self._active = 0
+            self._running = set()
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f'upload-worker-{i}', daemon=True).start()
+            threading.Thread(target=self._watch, name='upload-recovery', daemon=True).start()
+        self._recover()
+
+    def _watch(self):
+        while True:
+            time.sleep(UPLOAD_RECOVER_INTERVAL)
+            try:
+                self._touch_held()
+                self._recover()
+            except Exception:
+                logging.exception("Upload recovery pass failed")
+
+    def _touch_held(self):
+        """Refresh the job files this process holds, so that no other worker adopts them while they wait."""
+        with self._cond:
+            held = self._running | {job['id'] for _, _, job in self._heap}
+        for job_id in held:
+            try:
+                os.utime(self._job_path(job_id))
+            except OSError:
+                pass
+
+    def _recover(self):
+        """Adopt jobs whose worker went away before finishing them."""
+        try:
+            names = os.listdir(self.jobs_dir)
+        except FileNotFoundError:
+            return
+        cutoff = time.time() - UPLOAD_RECOVER_AFTER
+        for name in names:
+            path = os.path.join(self.jobs_dir, name)
+            if not name.endswith('.json'):
+                continue
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+                # Renaming is atomic, so exactly one worker wins each stale job.
+                claimed = f'{path}.{os.getpid()}'
+                os.rename(path, claimed)
+                with open(claimed) as f:
+                    job = json.load(f)
+                os.replace(claimed, path)
+                os.utime(path)
+            except (OSError, ValueError):
+                continue
+            logging.info("Recovered spooled upload %s for %s %s", job['id'], job.get('table'), job.get('row_id'))
+            self._schedule(job, delay=0)
+
+    def _schedule(self, job, delay):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), job))
+            self._cond.notify()
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if self._heap:
+                    run_at = self._heap[0][0]
+                    wait = run_at - time.monotonic()
+                    if wait <= 0:
+                        self._active += 1
+                        job = heapq.heappop(self._heap)[2]
+                        self._running.add(job['id'])
+                        return job
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            try:
+                self._attempt(job)
+            except Exception:
+                logging.exception("Upload worker crashed on job %s", job.get('id'))
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._running.discard(job['id'])
+                    self._cond.notify_all()
+
+    def _attempt(self, job):
+        job['attempt'] += 1
+        try:
+            os.utime(self._job_path(job['id']))  # still alive: keep other workers from adopting it
+        except OSError:
+            pass
+        try:
+            if job.get('source') and not job['objects']:
+                try:
+                    self._process_source(job)
+                except ValueError as e:
+                    logging.error("Upload %s has an unusable source: %s", job['id'], e)
+                    self._finish(job, ok=False)
+                    return
+            for name, content_type in job['objects'].items():
+                path = self.spooled_path(name)
+                if path is None:
+                    continue  # an earlier job for the same content already uploaded and cleared it
+                with open(path, 'rb') as f:
+                    self.storage.upload(name, f.read(), content_type)
+        except Exception as e:
+            if job['attempt'] < self.max_attempts:
+                delay = min(self.base_delay * 2 ** (job['attempt'] - 1), 300) * random.uniform(0.8, 1.2)
+                logging.warning("Upload %s failed (attempt %d/%d), retrying in %.0fs: %s",
+                                job['id'], job['attempt'], self.max_attempts, delay, e)
+                self._save(job)
+                self._schedule(job, delay)
+                return
+            logging.error("Upload %s failed after %d attempts: %s", job['id'], job['attempt'], e)
+            self._finish(job, ok=False)
+            return
+        self._finish(job, ok=True)
+
+    def _process_source(self, job):
+        with open(self._source_path(job['id']), 'rb') as f:
+            data = f.read()
+        variants, fields = run_cpu_bound(self.process, data)
+        job.update(fields, objects=self.spool(variants)['objects'])
+        self._save(job)  # a worker that adopts the job from here on uploads these objects as they are
+
+    def _finish(self, job, ok):
+        if self.on_finish:
+            try:
+                self.on_finish(job, ok)
+            except Exception:
+                # Keep the spool so a recovering worker can try again.
+                logging.exception("Could not record the result of upload %s", job['id'])
+                return
+        for name in job['objects']:
+            try:
+                os.remove(os.path.join(self.objects_dir, name))
+            except FileNotFoundError:
+                pass
+        for path in (self._source_path(job['id']), self._job_path(job['id'])):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def record_upload_result(job, ok):
+    """Flip the rows' image_status once their upload has landed (or given up)."""
+    if job['table'] not in IMAGE_TABLES:
+        raise ValueError(f"Unexpected upload table {job['table']!r}")
+    row_ids = job['row_id'] if isinstance(job['row_id'], list) else [job['row_id']]
+    conn = get_db_connection()
+    try:
+        if ok:
+            name = job.get('image') or image_base_name(next(iter(job['objects'])))
+            if job.get('phash') is not None:
+                repo.images.set_phash(conn, name, job['phash'])
+            repo.images.mark_ready(conn, name)
+        repo.image_rows(job['table']).set_image_status(conn, row_ids, 'ready' if ok else 'failed')
+        bump_stats(conn, commit=True, catalog_version=1)
+    finally:
+        get_db_pool().putconn(conn)
+    invalidate_public_pages(*(row_ids if job['table'] == 'market_items' else []))
+
+
+def process_upload_source(data):
+    """UploadQueue.process for raw uploads spooled with spool_source(): the variants, plus the pHash."""
+    _, variants, phash = process_upload_image(data)
+    return variants, {'phash': phash}
+
+
+@lazy_service
+def get_upload_queue():
+    return UploadQueue(get_storage(), UPLOAD_SPOOL_DIR, UPLOAD_WORKERS, UPLOAD_MAX_ATTEMPTS,
+                       UPLOAD_RETRY_BASE_DELAY, on_finish=record_upload_result, process=process_upload_source)
+
+
+def stage_image_upload(conn, file_storage):
+    """Count an upload in the images table and spool its variants if the bucket lacks them; returns (base_name, job).
+
+    Runs in the caller's transaction, which must insert the row that uses
+    the image. Bytes already in the bucket (same SHA-256) skip decoding,
+    resizing and the upload: job is None and the row can go in as 'ready'.
+    Otherwise call get_upload_queue().submit(job, table, row_id) once it is committed.
+    Decoding and resizing run through run_cpu_bound(), off the gevent hub.
+    """
+    data = file_storage.read()
+    base_name = upload_base_name(data)
+    processed = None
+    if repo.images.status(conn, base_name) != 'ready':
+        processed = run_cpu_bound(process_upload_image, data)
+    if repo.images.acquire(conn, base_name, processed[2] if processed else None) == 'ready':
+        return base_name, None
+    if processed is None:
+        # The janitor deleted it after we looked; acquire() waited for that and counted a fresh row.
+        processed = run_cpu_bound(process_upload_image, data)
+        repo.images.set_phash(conn, base_name, processed[2])
+    return base_name, get_upload_queue().spool(processed[1])
+
+
+# --- STORAGE LIFECYCLE ---
+# Objects never leave the bucket inline. Whatever stops pointing at an image
+# (a deleted listing, a recovered lost item) queues its name in
+# storage_deletions in the same transaction, and a janitor thread per worker
+# removes queued objects in batches with backoff on failure. Names are
+# content hashes, so before removing, it checks that no other row has
+# started using the same image. Every STORAGE_SWEEP_INTERVAL one worker
+# also pages through the bucket and queues objects no row references (e.g.
+# an upload that landed after its row was deleted).
+STORAGE_DELETE_INTERVAL = float(os.environ.get('STORAGE_DELETE_INTERVAL', 30))  # seconds between queue polls
+STORAGE_DELETE_BATCH = 100  # image names per storage remove() call
+STORAGE_DELETE_BASE_DELAY = 60  # seconds before the first retry, doubled per attempt
+STORAGE_DELETE_MAX_DELAY = 3600
+STORAGE_DELETE_WARN_ATTEMPTS = 8  # log an error once an entry has failed this often
+STORAGE_SWEEP_INTERVAL = float(os.environ.get('STORAGE_SWEEP_INTERVAL', 86400))  # 0 disables the automatic sweep
+STORAGE_SWEEP_GRACE = float(os.environ.get('STORAGE_SWEEP_GRACE', 3600))  # never sweep objects younger than this
+STORAGE_SWEEP_PAGE = 1000  # bucket objects listed (and looked up) at a time
+
+
+class StorageJanitor:
+    """Drains the storage_deletions queue and sweeps the bucket for orphans.
+
+    One daemon thread per process, started lazily (safe under --preload).
+    """
+
+    def __init__(self, storage, poll_interval, sweep_interval, sweep_grace):
+        self.storage = storage
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.sweep_grace = sweep_grace
+        self._cond = threading.Condition()
+        self._pid = None
+        self._woken = False
+
+    def ensure_started(self):
+        if self._pid == os.getpid() or not self.storage or not DATABASE_URL:
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='storage-janitor', daemon=True).start()
+
+    def wake(self):
+        """Process the queue now rather than at the next poll (call after committing an enqueue)."""
+        self.ensure_started()
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._woken:
+                    self._cond.wait(self.poll_interval)
+                self._woken = False
+            conn = None
+            try:
+                conn = get_db_pool().getconn()
+                while self.process_batch(conn) == STORAGE_DELETE_BATCH:
+                    pass
+                if self.sweep_interval and repo.storage.claim_sweep(conn, time.time(), self.sweep_interval):
+                    self.sweep(conn)
+            except Exception:
+                logging.exception("Storage janitor pass failed")
+            finally:
+                if conn is not None:
+                    get_db_pool().putconn(conn)
+
+    def process_batch(self, conn):
+        """Remove one batch of due entries; returns how many entries it took."""
+        now = time.time()
+        rows = repo.storage.due(conn, now, STORAGE_DELETE_BATCH)
+        if not rows:
+            conn.rollback()
+            return 0
+        names = [row['name'] for row in rows]
+        # A listing created since (same photo, same hash) keeps its objects. The rest lose their
+        # images row too, locked until we commit so that an upload of the same bytes waits for us.
+        in_use = repo.storage.referenced(conn, names)
+        in_use |= repo.images.forget(conn, [name for name in names if name not in in_use])
+        objects = [obj for name in names if name not in in_use for obj in image_object_names(name)]
+        try:
+            if objects:
+                self.storage.remove(objects)
+        except Exception as e:
+            for attempts in sorted({row['attempts'] for row in rows}):
+                group = [row['name'] for row in rows if row['attempts'] == attempts]
+                delay = min(STORAGE_DELETE_BASE_DELAY * 2 ** attempts, STORAGE_DELETE_MAX_DELAY)
+                repo.storage.retry(conn, group, now + delay * random.uniform(0.8, 1.2), str(e))
+                if attempts + 1 == STORAGE_DELETE_WARN_ATTEMPTS:
+                    logging.error("Storage deletion of %d images has failed %d times: %s", len(group), attempts + 1, e)
+            conn.commit()
+            logging.warning("Removing %d storage objects failed, will retry: %s", len(objects), e)
+            return len(rows)
+        repo.storage.done(conn, names)
+        conn.commit()
+        logging.info("Removed %d storage objects (%d images still in use were kept)", len(objects), len(in_use))
+        return len(rows)
+
+    def sweep(self, conn):
+        """Queue every image in the bucket that no row references; returns how many were queued.
+
+        Lists STORAGE_SWEEP_PAGE objects at a time and checks each page with
+        one indexed lookup, so memory and query size stay flat however large
+        the bucket grows.
+        """
+        cutoff = time.time() - self.sweep_grace
+        offset = queued = scanned = 0
+        while True:
+            page = self.storage.list_objects(offset, STORAGE_SWEEP_PAGE)
+            scanned += len(page)
+            bases = {image_base_name(name) for name, created in page if created is not None and created < cutoff}
+            orphans = bases - repo.storage.referenced(conn, list(bases))
+            queued += repo.storage.enqueue(conn, list(orphans)) or 0
+            conn.commit()
+            if len(page) < STORAGE_SWEEP_PAGE:
+                break
+            offset += len(page)
+        logging.info("Storage sweep scanned %d objects and queued %d orphaned images", scanned, queued)
+        return queued
+
+
+@lazy_service
+def get_storage_janitor():
+    return StorageJanitor(get_storage(), STORAGE_DELETE_INTERVAL, STORAGE_SWEEP_INTERVAL, STORAGE_SWEEP_GRACE)
+
+
+@app.before_request
+def start_background_threads():
+    """Start this worker's upload and janitor threads, once per process.
+
+    gunicorn.conf.py calls it in each worker as soon as it is forked, so a
+    worker adopts the jobs a dead one left in the upload spool without
+    waiting for a request; the first request of any other process starts them.
+    """
+    if get_storage():
+        get_upload_queue().start()
+    get_storage_janitor().ensure_started()
+
+
+def release_images(conn, images):
+    """Queue images for deletion in the caller's transaction; call get_storage_janitor().wake() after it commits.
+
+    The janitor only removes those that no row uses by then (images.refcount).
+    Returns False if a statement failed and rolled the transaction back.
+    """
+    images = [image for image in images if image and image != 'default.png']
+    return repo.images.release(conn, images) and repo.storage.enqueue(conn, images) is not None
+
+
+@app.cli.command('sweep-storage')
+def sweep_storage_command():
+    """Queue orphaned bucket objects and delete everything queued."""
+    if not get_storage():
+        print("No storage backend configured.")
+        return
+    conn = get_db_connection()
+    queued = get_storage_janitor().sweep(conn)
+    removed = 0
+    while True:
+        taken = get_storage_janitor().process_batch(conn)
+        removed += taken
+        if taken < STORAGE_DELETE_BATCH:
+            break
+    print(f"Queued {queued} orphaned images; processed {removed} queued deletions.")
+
+
+@app.after_request
+def report_image_url_resolutions(response):
+    resolutions = g.get('image_url_resolutions')
+    if resolutions:
+        response.headers['X-Image-URL-Resolutions'] = str(resolutions)
+        logging.debug("%s resolved %d image URLs", request.path, resolutions)
+    return response
+
 # Context processor to make get_image_url available in all templates
 @app.context_processor
 def utility_processor():
-    return dict(get_image_url=get_image_url)
+    return dict(get_image_url=get_image_url, render_card=render_card, live_events=LIVE_EVENTS)
+
+# --- PAGINATION HELPERS ---
+MARKET_PAGE_SIZE = int(os.environ.get('MARKET_PAGE_SIZE', 24))
+MARKET_PAGE_MAX = 100
+
+
+def get_market_filters():
+    """Validated ?sort=, ?min_price= and ?max_price= for the market feed; defaults are left out."""
+    filters = {}
+    sort = request.args.get('sort')
+    if sort in MARKET_SORTS and sort != 'newest':
+        filters['sort'] = sort
+    for name in ('min_price', 'max_price'):
+        value = parse_price(request.args.get(name))
+        if value is not None:
+            filters[name] = value
+    return filters
+
+
+def get_page_args(sort='newest'):
+    """Read the keyset cursor (?before=) and a clamped ?limit= from the query string.
+
+    The cursor is a listing id, or '<price>:<id>' when the feed is sorted by price.
+    """
+    if sort == 'newest':
+        before = request.args.get('before', type=int)
+    else:
+        price, _, item_id = (request.args.get('before') or '').partition(':')
+        try:
+            before = (Decimal(price), int(item_id))
+        except (ArithmeticError, ValueError):
+            before = None
+        if before and not before[0].is_finite():
+            before = None
+    limit = request.args.get('limit', MARKET_PAGE_SIZE, type=int)
+    return before, max(1, min(limit, MARKET_PAGE_MAX))
+
+
+def fetch_market_page(conn, before, limit, filters=None, columns='market_items.*'):
+    """Return (items, next_before) for one page of unsold listings.
+
+    Keyset pagination on market_items.id, or on (price_value, id) when sorted
+    by price: each page is an index range scan of at most limit + 1 rows,
+    however large the table gets. next_before is None on the last page.
+    """
+    filters = filters or {}
+    rows = repo.market.page(conn, before, limit + 1, columns=columns, **filters)
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    if filters.get('sort', 'newest') == 'newest':
+        return rows[:limit], last['id']
+    return rows[:limit], f"{last['price_value']}:{last['id']}"
+
+
+# --- SEARCH ---
+# On Postgres, matches come from the GIN-indexed search_vector columns, or,
+# for typos, from trigram similarity on the title (pg_trgm's % operator,
+# also GIN-indexed) when the extension is installed. Rank blends the two.
+# Search results are ranked, not ordered by id, so they page by offset;
+# SEARCH_MAX_PAGE keeps deep pages from turning into big scans.
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE = 25
+SEARCH_SCOPES = ('all', 'market', 'lost')
+
+
+def get_search_args():
+    """Read ?q=, ?scope= and a clamped ?page= / ?limit= from the query string."""
+    query = (request.args.get('q') or '').strip()[:200]
+    scope = request.args.get('scope', 'all')
+    if scope not in SEARCH_SCOPES:
+        scope = 'all'
+    page = max(1, min(request.args.get('page', 1, type=int), SEARCH_MAX_PAGE))
+    limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), MARKET_PAGE_MAX))
+    return query, scope, page, limit
+
+
+def search_listings(conn, query, scope='all', page=1, limit=SEARCH_PAGE_SIZE):
+    """Ranked matches for each table in scope: {'market': (rows, has_more), 'lost': (rows, has_more)}."""
+    results = {}
+    for table in ('market', 'lost'):
+        if scope not in ('all', table) or not query:
+            continue
+        queries = repo.market if table == 'market' else repo.lost
+        rows = queries.search(conn, query, limit + 1, (page - 1) * limit)
+        results[table] = (rows[:limit], len(rows) > limit and page < SEARCH_MAX_PAGE)
+    return results
+
 
 # --- AUTH HELPERS ---
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))  # seconds; 0 disables the cache
+
+_user_cache = {}  # email -> (expires_at, row)
+_user_cache_lock = threading.Lock()
+
+
+def load_user(email):
+    """Fetch a user's row by email through the short-lived per-process cache.
+
+    Writes in this worker call invalidate_user(); other workers see a change
+    within USER_CACHE_TTL seconds.
+    """
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(email)
+    if cached and cached[0] > now:
+        return dict(cached[1])
+    user = repo.users.by_email(get_db_connection(), email)
+    if user and USER_CACHE_TTL > 0:
+        with _user_cache_lock:
+            _user_cache[email] = (now + USER_CACHE_TTL, dict(user))
+    return user
+
+
+def invalidate_user(email):
+    with _user_cache_lock:
+        _user_cache.pop(email, None)
+
+
 def get_current_user():
-    """Return the current user row or None."""
-    email = session.get('email')
-    if not email:
-        return None
+    """Return the current user row or None, loaded at most once per request."""
+    if 'current_user' not in g:
+        email = session.get('email')
+        g.current_user = None
+        if email:
+            try:
+                g.current_user = load_user(email)
+            except Exception as e:
+                logging.error(f"Database error in get_current_user: {e}")
+    return g.current_user
+
+
+# --- RATE LIMITING ---
+# Token buckets per client IP and per account, checked before a POST touches
+# the database or hashes a password. The buckets live in a store every worker
+# shares (ratelimit.py): by default a SQLite file on this host, or a Redis
+# server with RATE_LIMIT_STORE=redis://... when several hosts serve the app.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True'
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', os.path.join(tempfile.gettempdir(), 'hustl-ratelimit.db'))
+# name -> ((scope, requests, per seconds), ...). A scope is 'ip', 'user' (the
+# signed-in email) or a form field holding the account being tried.
+RATE_LIMITS = {
+    'login': (('ip', 20, 60), ('email', 5, 60)),
+    'signup': (('ip', 10, 3600), ('email', 3, 3600)),
+    'admin_login': (('ip', 5, 60), ('username', 10, 600)),
+    'claim': (('ip', 30, 3600), ('user', 10, 3600)),
+    'upload': (('ip', 60, 3600), ('user', 30, 3600)),
+    'import': (('ip', 10, 3600), ('user', 5, 3600)),
+}
+
+@lazy_service
+def get_rate_limiter():
+    """The shared RateLimiter, or None with RATE_LIMIT_ENABLED off."""
+    return RateLimiter(open_store(RATE_LIMIT_STORE)) if RATE_LIMIT_ENABLED else None
+
+
+def rate_limit_key(scope):
+    if scope == 'ip':
+        return request.remote_addr
+    if scope == 'user':
+        return session.get('email')
+    # Only the login forms name a field; upload bodies are never parsed here.
+    return (request.form.get(scope) or '').strip().lower() or None
+
+
+def too_many_requests(retry_after):
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        response = make_response({"error": "too many requests", "retry_after": retry_after}, 429)
+    else:
+        flash(f"Too many attempts. Please try again in {retry_after} seconds.", "error")
+        response = make_response(render_template("rate_limited.html"), 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limited(name):
+    """Refuse POSTs to the wrapped view beyond RATE_LIMITS[name], with a 429 and Retry-After."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            rate_limiter = get_rate_limiter()
+            if rate_limiter and request.method == 'POST':
+                for scope, count, period in RATE_LIMITS[name]:
+                    key = rate_limit_key(scope)
+                    if not key:
+                        continue
+                    retry_after = rate_limiter.hit(f'{name}:{scope}:{key}', count, period)
+                    if retry_after:
+                        logging.info("Rate limited %s by %s %s", name, scope, key)
+                        return too_many_requests(retry_after)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- SITE STATS ---
+# Dashboard and lost & found counters live in site_stats and are bumped in the
+# same transaction as the write that changes them, so reading them is a
+# primary-key lookup instead of a COUNT(*) scan. "Recovered this week" is the
+# sum of the last seven claim_approvals_daily buckets. Anything that slips
+# past the incremental updates (manual SQL, a race with a concurrent
+# reconcile) is corrected by reconcile_stats() every STATS_RECONCILE_INTERVAL.
+STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', 3600))
+STAT_NAMES = ('total_users', 'market_listings', 'active_reports', 'verified_returns')
+
+_stats_checked_at = None
+
+
+def bump_stats(conn, commit=False, **deltas):
+    """Add deltas to site_stats counters, e.g. bump_stats(conn, total_users=1); False if that failed."""
+    return repo.stats.bump(conn, deltas, commit=commit)
+
+
+def record_claim_approvals(conn, count):
+    """Count approvals towards today's bucket for the weekly recovered stat; False if that failed."""
+    return not count or repo.stats.record_claim_approvals(conn, count)
+
+
+def reconcile_stats(conn):
+    """Recompute every counter from the real tables.
+
+    Only one process reconciles at a time (a transaction-level advisory lock
+    on Postgres); the others skip. Returns True if this call did the work.
+    """
+    return repo.stats.reconcile(conn)
+
+
+def maybe_reconcile_stats(conn):
+    """Reconcile if nobody has in the last STATS_RECONCILE_INTERVAL seconds.
+
+    Each worker checks at most once per interval, so this is normally free.
+    """
+    global _stats_checked_at
+    now = time.monotonic()
+    if _stats_checked_at is not None and now - _stats_checked_at < STATS_RECONCILE_INTERVAL:
+        return
+    _stats_checked_at = now
+    last = repo.stats.value(conn, 'reconciled_at')
+    if last is None or time.time() - last >= STATS_RECONCILE_INTERVAL:
+        try:
+            reconcile_stats(conn)
+        except DB_ERRORS:
+            conn.rollback()
+            logging.exception("Failed to reconcile site stats")
+
+
+def get_site_stats(conn):
+    """All counters in one small query: a dict with STAT_NAMES plus recovered_week."""
+    maybe_reconcile_stats(conn)
+    rows = repo.stats.all(conn)
+    stats = dict.fromkeys(STAT_NAMES + ('recovered_week',), 0)
+    stats.update((row['name'], row['value']) for row in rows)
+    return stats
+
+
+@app.cli.command('reconcile-stats')
+def reconcile_stats_command():
+    """Recompute the site_stats counters from the real tables."""
+    if reconcile_stats(get_db_connection()):
+        print("Site stats reconciled.")
+    else:
+        print("Another process is reconciling site stats; skipped.")
+
+
+# --- PAGE CACHE ---
+# Public pages (home, listing detail, seller profile) are versioned by the
+# newest market_items id plus the catalog_version counter in site_stats,
+# which every write that changes what they show bumps in its own
+# transaction. Each worker re-reads that pair at most every PAGE_CACHE_TTL
+# seconds, so an anonymous visitor is answered with a 304 or a cached
+# render without touching the database; other workers notice a write
+# within PAGE_CACHE_TTL. Logged-in requests always render (nav, flashes),
+# but still reuse listing cards, which are cached per item and row_version.
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', 5))  # seconds; 0 disables page caching
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 256))
+CARD_CACHE_SIZE = int(os.environ.get('CARD_CACHE_SIZE', 2048))
+# Each seller's newest unsold listings, shared by seller_profile() and the
+# "more from this seller" strip of listing_detail(), are one bounded query
+# on market_items_seller_unsold_idx and are kept per worker under the same
+# catalog version as the pages.
+SELLER_LISTINGS_LIMIT = int(os.environ.get('SELLER_LISTINGS_LIMIT', 24))
+SELLER_CACHE_SIZE = int(os.environ.get('SELLER_CACHE_SIZE', 1024))
+RELATED_LISTINGS_LIMIT = 8  # cards in listing_detail()'s "more from this seller"
+
+_catalog_state = None  # (expires_at, state)
+_page_cache = OrderedDict()  # full path -> (etag, body, mimetype)
+_card_cache = OrderedDict()  # (template, item id) -> (version, html)
+_seller_cache = OrderedDict()  # seller id -> (etag, rows)
+_page_cache_lock = threading.Lock()
+
+
+def get_catalog_state():
+    """{'max_id', 'version', 'updated_at'} for the public catalog, or None if the DB is unreachable."""
+    global _catalog_state
+    now = time.monotonic()
+    cached = _catalog_state
+    if cached and cached[0] > now:
+        return cached[1]
     try:
         conn = get_db_connection()
-        try:
-            user = safe_execute(conn, 'SELECT * FROM users WHERE email = %s', (email,), fetchone=True)
-            return user
-        finally:
-            conn.close()
     except Exception as e:
-        logging.error(f"Database error in get_current_user: {e}")
+        logging.error("Could not read catalog version: %s", e)
         return None
+    state = repo.stats.catalog_state(conn)
+    if state:
+        _catalog_state = (now + PAGE_CACHE_TTL, state)
+    return state
+
+
+def invalidate_public_pages(*item_ids):
+    """Drop this worker's cached pages (and the given items' cards) after a catalog write commits.
+
+    The write itself must bump catalog_version (bump_stats(conn, catalog_version=1))
+    so that other workers pick it up too.
+    """
+    global _catalog_state
+    with _page_cache_lock:
+        _catalog_state = None
+        _page_cache.clear()
+        _seller_cache.clear()
+        if item_ids:
+            ids = set(item_ids)
+            for key in [key for key in _card_cache if key[1] in ids]:
+                del _card_cache[key]
+
+
+def _lru_put(cache, key, value, size):
+    with _page_cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+
+def cache_public_page(view):
+    """Answer anonymous GETs with conditional responses and a per-worker rendered-page cache."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if session or PAGE_CACHE_TTL <= 0:
+            return view(*args, **kwargs)
+        state = get_catalog_state()
+        if state is None:
+            return view(*args, **kwargs)
+        etag = f"{state['max_id']}-{state['version']}"
+        last_modified = datetime.fromtimestamp(state['updated_at'], timezone.utc)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = app.response_class(status=304)
+            cache_status = 'revalidated'
+        else:
+            with _page_cache_lock:
+                cached = _page_cache.get(request.full_path)
+            if cached and cached[0] == etag:
+                response = app.response_class(cached[1], mimetype=cached[2])
+                cache_status = 'hit'
+            else:
+                response = make_response(view(*args, **kwargs))
+                cache_status = 'miss'
+                if response.status_code == 200:
+                    _lru_put(_page_cache, request.full_path,
+                             (etag, response.get_data(), response.mimetype), PAGE_CACHE_SIZE)
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        response.headers['X-Page-Cache'] = cache_status
+        return response
+    return wrapper
+
+
+def seller_listings(conn, user_id):
+    """A seller's newest unsold listings, up to SELLER_LISTINGS_LIMIT + 1 so callers can tell there are more.
+
+    Served from this worker's cache while the catalog version is unchanged;
+    every write that lists, sells or deletes an item bumps it.
+    """
+    state = get_catalog_state() if PAGE_CACHE_TTL > 0 else None
+    etag = state and f"{state['max_id']}-{state['version']}"
+    if etag:
+        with _page_cache_lock:
+            cached = _seller_cache.get(user_id)
+        if cached and cached[0] == etag:
+            return cached[1]
+    rows = tuple(repo.market.for_seller(conn, user_id, SELLER_LISTINGS_LIMIT + 1))
+    if etag:
+        _lru_put(_seller_cache, user_id, (etag, rows), SELLER_CACHE_SIZE)
+    return rows
+
+
+def render_card(template_name, item):
+    """Render a listing-card partial, reusing the HTML until the item's row_version or seller name changes."""
+    version = (item.get('row_version'), item.get('seller_display'))
+    if version[0] is None:
+        return Markup(render_template(template_name, item=item))
+    key = (template_name, item['id'])
+    with _page_cache_lock:
+        cached = _card_cache.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    html = Markup(render_template(template_name, item=item))
+    _lru_put(_card_cache, key, (version, html), CARD_CACHE_SIZE)
+    return html
+
+
+# --- CLAIM MATCHING ---
+# Each worker keeps a TF-IDF index (matching.LostMatcher) of the open lost &
+# found reports. lost() adds a new report to this worker's index as it is
+# filed and approve_claims() drops recovered ones; other workers pick new
+# reports up from the database the next time the admin dashboard syncs, and
+# drop recovered ones when they turn up as candidates.
+CLAIM_MATCH_CANDIDATES = int(os.environ.get('CLAIM_MATCH_CANDIDATES', 3))
+# Cosine similarity below which another report isn't worth suggesting
+CLAIM_MATCH_MIN_SCORE = float(os.environ.get('CLAIM_MATCH_MIN_SCORE', 0.15))
+# Reports just below the last synced id are re-read, in case they committed after a higher id was seen
+CLAIM_MATCH_SYNC_OVERLAP = 50
+
+lost_matcher = LostMatcher()
+_lost_matcher_sync_lock = threading.Lock()
+
+
+def sync_lost_matcher(conn):
+    """Index open reports filed since the last sync (all of them on the first call)."""
+    with _lost_matcher_sync_lock:
+        for row in repo.lost.open_since(conn, max(0, lost_matcher.synced_id - CLAIM_MATCH_SYNC_OVERLAP)):
+            if row['id'] not in lost_matcher:
+                lost_matcher.add(row['id'], row['title'], row['description'], row['location'])
+            lost_matcher.synced_id = max(lost_matcher.synced_id, row['id'])
+
+
+def match_claims(conn, claims):
+    """Score each claim's proof against the report it claims and rank the other open reports it matches.
+
+    Sets ``match_score`` (0-1) and ``candidates``: up to CLAIM_MATCH_CANDIDATES
+    other open reports as {'id', 'title', 'location', 'custody', 'score'}, best first.
+    """
+    if not claims:
+        return claims
+    sync_lost_matcher(conn)
+    ranked = {}
+    for claim in claims:
+        claim['match_score'] = lost_matcher.score(claim['proof_details'], claim['item_id'])
+        ranked[claim['id']] = [(item_id, score) for item_id, score
+                               in lost_matcher.match(claim['proof_details'], CLAIM_MATCH_CANDIDATES + 1)
+                               if item_id != claim['item_id'] and score >= CLAIM_MATCH_MIN_SCORE]
+    ids = {item_id for matches in ranked.values() for item_id, _ in matches}
+    rows = {row['id']: row for row in repo.lost.open_by_ids(conn, list(ids))} if ids else {}
+    if ids - rows.keys():
+        lost_matcher.remove(ids - rows.keys())  # recovered through another worker
+    for claim in claims:
+        claim['candidates'] = [dict(rows[item_id], score=score) for item_id, score in ranked[claim['id']]
+                               if item_id in rows][:CLAIM_MATCH_CANDIDATES]
+    return claims
+
+
+# --- LIVE EVENTS ---
+# Triggers on market_items and claim_requests NOTIFY the hustl_events channel
+# (migration 12). Each worker holds one LISTEN connection, outside the pool,
+# and fans every notification out to the in-memory queues of its /events
+# (Server-Sent Events) clients, so a thousand open pages cost one database
+# connection per worker, not one each. Every open stream occupies a worker
+# while it lasts, so this is only on under an async worker
+# (gunicorn -k gevent) unless LIVE_EVENTS says otherwise. Postgres only.
+EVENTS_CHANNEL = 'hustl_events'  # the channel migration 12's triggers notify
+EVENTS_KEEPALIVE = 15  # seconds between comment lines that keep proxies from closing idle streams
+EVENTS_CLIENT_BUFFER = 100  # events a slow client may fall behind by before it is told to resync
+_live_events = os.environ.get('LIVE_EVENTS', 'auto')
+LIVE_EVENTS = (ASYNC_WORKER if _live_events == 'auto' else _live_events == 'True') and not USE_SQLITE
+
+
+class Subscription:
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """The next event, or None if nothing arrived within ``timeout`` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """One LISTEN connection per process, fanned out to every subscriber in it."""
+
+    def __init__(self, dsn, channel, buffer_size):
+        self.dsn = dsn
+        self.channel = channel
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._pid = None
+
+    def subscribe(self):
+        self._ensure_started()
+        sub = Subscription(self.buffer_size)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._subscribers = set()
+        threading.Thread(target=self._listen, name='event-listener', daemon=True).start()
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                # Too far behind to catch up from the stream; it reloads instead.
+                sub.overflowed = True
+                self.unsubscribe(sub)
+
+    def _listen(self):
+        delay = 1
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {self.channel}')
+                logging.info("Listening for %s notifications (pid %s)", self.channel, os.getpid())
+                if delay > 1:
+                    self.publish({'table': None, 'op': 'resync'})  # anything sent while disconnected is lost
+                delay = 1
+                while True:
+                    if select.select([conn], [], [], EVENTS_KEEPALIVE) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            self.publish(json.loads(notify.payload))
+                        except ValueError:
+                            logging.warning("Ignoring malformed %s payload: %r", self.channel, notify.payload)
+            except psycopg2.Error as e:
+                logging.warning("Event listener lost its connection, retrying in %ds: %s", delay, e)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+event_broker = EventBroker(DATABASE_URL, EVENTS_CHANNEL, EVENTS_CLIENT_BUFFER) if LIVE_EVENTS else None
+
+
+def sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 # --- ROUTES ---
@@ -155,42 +2199,29 @@ def get_current_user():
 # Health check endpoint - doesn't require database
 @app.route("/health")
 def health():
-    return {"status": "ok"}, 200
+    return {"status": "ok", "db_pool": get_db_pool().stats() if DATABASE_URL else None}, 200
 
 @app.route("/")
+@cache_public_page
 def index():
     user = get_current_user()
     market_items = []
     lost_items = []
     try:
         conn = get_db_connection()
-        try:
-            market_items = safe_execute(
-                conn,
-                '''SELECT market_items.*, 
-                          COALESCE(users.display_name, market_items.seller_brand, users.email, 'Campus Seller') AS seller_display
-                   FROM market_items
-                   LEFT JOIN users ON market_items.user_id = users.id
-                   WHERE market_items.is_sold = 0
-                   ORDER BY market_items.id DESC LIMIT 8''',
-                fetchall=True
-            ) or []
-            lost_items = safe_execute(
-                conn,
-                'SELECT * FROM lost_items ORDER BY id DESC LIMIT 4',
-                fetchall=True
-            ) or []
-        finally:
-            conn.close()
+        market_items = repo.market.page(conn, None, 8)
+        lost_items = repo.lost.latest(conn, 4)
     except Exception as e:
         logging.error(f"Database error in index route: {e}")
         market_items = []
         lost_items = []
+    resolve_image_urls(market_items, lost_items)
     return render_template("index.html", user=user, market_items=market_items, lost_items=lost_items)
 
 
 # --- PROPER AUTHENTICATION ---
 @app.route("/login", methods=["GET", "POST"])
+@rate_limited('login')
 def login():
     if session.get('email'):
         return redirect(url_for('index'))
@@ -198,23 +2229,21 @@ def login():
         email = (request.form.get('email') or '').strip().lower()
         password = request.form.get('password')
         conn = get_db_connection()
-        try:
-            user = safe_execute(conn, 'SELECT * FROM users WHERE email = %s', (email,), fetchone=True)
-            if user and user.get('password_hash') and check_password_hash(user['password_hash'], password):
-                session['email'] = email
-                flash("Welcome back!", "success")
-                return redirect(url_for('index'))
+        user = repo.users.credentials(conn, email)
+        if user and user.get('password_hash') and check_password_hash(user['password_hash'], password):
+            session['email'] = email
+            flash("Welcome back!", "success")
+            return redirect(url_for('index'))
             
-            # Fallback for old accounts without password (require signup)
-            if user and not user.get('password_hash'):
-                flash("Please sign up to set a password for your old account.", "error")
-            else:
-                flash("Invalid email or password.", "error")
-        finally:
-            conn.close()
+        # Fallback for old accounts without password (require signup)
+        if user and not user.get('password_hash'):
+            flash("Please sign up to set a password for your old account.", "error")
+        else:
+            flash("Invalid email or password.", "error")
     return render_template("auth.html", is_login=True)
 
 @app.route("/signup", methods=["GET", "POST"])
+@rate_limited('signup')
 def signup():
     if session.get('email'):
         return redirect(url_for('index'))
@@ -232,25 +2261,22 @@ def signup():
 
         hashed_pw = generate_password_hash(password)
         conn = get_db_connection()
-        try:
-            existing = safe_execute(conn, 'SELECT id, password_hash FROM users WHERE email = %s', (email,), fetchone=True)
-            if existing and existing.get('password_hash'):
-                flash("Account already exists. Please log in.", "error")
-                return redirect(url_for('login'))
+        existing = repo.users.credentials(conn, email)
+        if existing and existing.get('password_hash'):
+            flash("Account already exists. Please log in.", "error")
+            return redirect(url_for('login'))
             
-            if existing and not existing.get('password_hash'):
-                # Claim old account
-                safe_execute(conn, 'UPDATE users SET password_hash = %s WHERE email = %s', (hashed_pw, email), commit=True)
-            else:
-                # Create new account
-                safe_execute(conn, '''INSERT INTO users (email, password_hash, user_type, role) 
-                                      VALUES (%s, %s, %s, %s)''', 
-                             (email, hashed_pw, 'buyer', 'buyer'), commit=True)
-            session['email'] = email
-            flash("Account created successfully!", "success")
-            return redirect(url_for('index'))
-        finally:
-            conn.close()
+        if existing and not existing.get('password_hash'):
+            # Claim old account
+            repo.users.set_password(conn, email, hashed_pw)
+        else:
+            # Create new account
+            if repo.users.create(conn, email, hashed_pw, 'buyer', 'buyer'):
+                bump_stats(conn, commit=True, total_users=1)
+        invalidate_user(email)
+        session['email'] = email
+        flash("Account created successfully!", "success")
+        return redirect(url_for('index'))
     return render_template("auth.html", is_login=False)
 
 @app.route("/logout")
@@ -265,124 +2291,196 @@ def seller_onboarding():
         return redirect(url_for('login'))
         
     conn = get_db_connection()
-    try:
-        user = safe_execute(conn, 'SELECT * FROM users WHERE email = %s', (session['email'],), fetchone=True)
-        if request.method == "POST":
-            # Become a seller logic
-            legal_name = request.form.get('legal_name')
-            display_name = request.form.get('display_name')
-            reg_number = request.form.get('reg_number')
-            whatsapp = request.form.get('whatsapp')
-            id_proof_link = request.form.get('id_proof_link')
-            social_link = request.form.get('social_link')
-
-            safe_execute(conn, '''UPDATE users SET legal_name=%s, display_name=%s, reg_number=%s, whatsapp=%s,
-                            id_proof_link=%s, social_link=%s, role='pending_verification', user_type='seller', is_verified=0
-                            WHERE email = %s''',
-                         (legal_name, display_name, reg_number, whatsapp, id_proof_link,
-                          social_link, session['email']), commit=True)
-            flash("Your seller profile has been submitted for review.", "success")
-            return redirect(url_for('seller_onboarding'))
+    user = get_current_user()
+    if request.method == "POST":
+        # Become a seller logic
+        legal_name = request.form.get('legal_name')
+        display_name = request.form.get('display_name')
+        reg_number = request.form.get('reg_number')
+        whatsapp = request.form.get('whatsapp')
+        id_proof_link = request.form.get('id_proof_link')
+        social_link = request.form.get('social_link')
+
+        repo.users.submit_seller_profile(conn, session['email'], legal_name, display_name, reg_number,
+                                         whatsapp, id_proof_link, social_link)
+        bump_stats(conn, commit=True, catalog_version=1)  # seller name / profile visibility
+        invalidate_user(session['email'])
+        invalidate_public_pages()
+        flash("Your seller profile has been submitted for review.", "success")
+        return redirect(url_for('seller_onboarding'))
             
-        if user and user.get('reg_number') and user.get('is_verified') == 0:
-            return render_template("pending_approval.html")
+    if user and user.get('reg_number') and user.get('is_verified') == 0:
+        return render_template("pending_approval.html")
             
-    finally:
-        conn.close()
     return render_template("seller_onboarding.html")
 
 @app.route("/market", methods=["GET", "POST"])
+@rate_limited('upload')
 def market():
     if not session.get('email'):
         return redirect(url_for('login'))
     conn = get_db_connection()
-    try:
-        user = safe_execute(conn, 'SELECT * FROM users WHERE email = %s', (session['email'],), fetchone=True)
+    user = get_current_user()
 
-        if request.method == "POST":
-            # Only verified sellers can post
-            if not user or user['is_verified'] != 1 or user['user_type'] != 'seller':
-                flash("Only verified sellers can post items.", "error")
-                return redirect(url_for('market'))
+    if request.method == "POST":
+        # Only verified sellers can post
+        if not user or user['is_verified'] != 1 or user['user_type'] != 'seller':
+            flash("Only verified sellers can post items.", "error")
+            return redirect(url_for('market'))
 
-            img = request.files.get("image")
-            filename = 'default.png'
-            if img and img.filename:
-                if not allowed_file(img.filename):
-                    flash("File type not allowed.", "error")
+        if parse_price(request.form.get('price')) is None:
+            flash("Please enter a price.", "error")
+            return redirect(url_for('market'))
+
+        img = request.files.get("image")
+        filename = 'default.png'
+        upload_job = None
+        if img and img.filename:
+            if not allowed_file(img.filename):
+                flash("File type not allowed.", "error")
+                return redirect(url_for('market'))
+            if get_storage():
+                try:
+                    filename, upload_job = stage_image_upload(conn, img)
+                except InvalidImage as e:
+                    flash(str(e), "error")
+                    return redirect(url_for('market'))
+                except OSError as e:
+                    logging.error("Failed to spool image upload: %s", e)
+                    flash("Image upload failed. " + str(e), "error")
                     return redirect(url_for('market'))
+            else:
                 filename = secure_filename(img.filename)
-                
-                if supabase:
-                    # Upload to Supabase Storage
-                    file_content = img.read()
-                    import uuid
-                    # Make filename unique to avoid conflicts
-                    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-                    unique_filename = f"{uuid.uuid4().hex}.{ext}" if ext else f"{uuid.uuid4().hex}"
-                    try:
-                        supabase.storage.from_('market-images').upload(
-                            file=file_content, 
-                            path=unique_filename, 
-                            file_options={"content-type": img.content_type}
-                        )
-                        filename = unique_filename
-                    except Exception as e:
-                        logging.error("Failed to upload image to supabase: %s", e)
-                        flash("Image upload failed. " + str(e), "error")
-                        return redirect(url_for('list_item'))
-                else:
-                     flash("Database storage is not configured for remote uploads.", "error")
+                flash("Database storage is not configured for remote uploads.", "error")
+
+        brand = request.form.get('brand') or (user['display_name'] if user else None)
+        seller_brand = user['display_name'] if user else None
+        user_id = user['id'] if user else None
+
+        item_id = repo.market.create(conn, request.form.get('title'), brand, request.form.get('price'),
+                                     request.form.get('whatsapp'), filename, seller_brand, user_id,
+                                     'pending' if upload_job else 'ready')
+        if item_id:
+            bump_stats(conn, commit=True, market_listings=1, catalog_version=1)
+            invalidate_public_pages()
+        if item_id and upload_job:
+            get_upload_queue().submit(upload_job, 'market_items', item_id)
+        return redirect(url_for('market'))
+
+    filters = get_market_filters()
+    before, limit = get_page_args(filters.get('sort', 'newest'))
+    items, next_before = fetch_market_page(conn, before, limit, filters)
+    resolve_image_urls(items)
+    return render_template("market.html", items=items,
+                           user_type=(user['user_type'] if user else 'buyer'),
+                           user=user, next_before=next_before, limit=limit, filters=filters)
 
-            brand = request.form.get('brand') or (user['display_name'] if user else None)
-            seller_brand = user['display_name'] if user else None
-            user_id = user['id'] if user else None
 
-            safe_execute(conn, '''INSERT INTO market_items (title, brand, price, whatsapp, image, seller_brand, user_id)
-                            VALUES (%s,%s,%s,%s,%s,%s,%s)''',
-                         (request.form.get('title'), brand, request.form.get('price'),
-                          request.form.get('whatsapp'), filename, seller_brand, user_id), commit=True)
-            return redirect(url_for('market'))
+@app.route("/market/feed")
+def market_feed():
+    """Infinite-scroll endpoint: the next page of market cards (or, with ?after=, newer ones) as HTML."""
+    if not session.get('email'):
+        return {"error": "login required"}, 401
+    filters = get_market_filters()
+    before, limit = get_page_args(filters.get('sort', 'newest'))
+    after = request.args.get('after', type=int)
+    if after is not None:
+        # Listings newer than the page's first card, for the live feed to prepend.
+        # complete is False if there were more than ``limit``; the page reloads then.
+        items = repo.market.page(get_db_connection(), None, limit + 1, after=after)
+        resolve_image_urls(items[:limit])
+        html = render_template("partials/market_cards.html", items=items[:limit])
+        return {"html": html, "complete": len(items) <= limit}
+    items, next_before = fetch_market_page(get_db_connection(), before, limit, filters)
+    resolve_image_urls(items)
+    html = render_template("partials/market_cards.html", items=items)
+    return {"html": html, "next_before": next_before}
+
+
+@app.route("/events")
+def live_events():
+    """Server-Sent Events: 'listing' for market changes, plus 'claim' for admins; 'resync' means reload."""
+    if not event_broker:
+        abort(404)
+    if not session.get('email'):
+        abort(401)
+    is_admin = bool(session.get('is_admin'))
+    sub = event_broker.subscribe()
 
-        items = safe_execute(conn, '''SELECT market_items.*, 
-                                        COALESCE(users.display_name, market_items.seller_brand, users.email, 'Campus Seller') AS seller_display
-                                FROM market_items
-                                LEFT JOIN users ON market_items.user_id = users.id
-                                WHERE market_items.is_sold = 0
-                                ORDER BY market_items.id DESC''', fetchall=True) or []
-    finally:
-        conn.close()
-    return render_template("market.html", items=items,
-                           user_type=(user['user_type'] if user else 'buyer'),
-                           user=user)
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                event = sub.get(EVENTS_KEEPALIVE)
+                if sub.overflowed or (event and event['op'] == 'resync'):
+                    yield sse_message('resync', {})
+                    return
+                if event is None:
+                    yield ": keepalive\n\n"
+                elif event['table'] == 'market_items':
+                    yield sse_message('listing', {key: event[key] for key in ('op', 'id', 'is_sold', 'image_status')})
+                elif event['table'] == 'claim_requests' and is_admin:
+                    yield sse_message('claim', {key: event[key] for key in ('op', 'id', 'item_id', 'status')})
+        finally:
+            event_broker.unsubscribe(sub)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route("/search")
+def search():
+    query, scope, page, limit = get_search_args()
+    results = search_listings(get_db_connection(), query, scope, page, limit)
+    market_items, market_more = results.get('market', ([], False))
+    lost_items, lost_more = results.get('lost', ([], False))
+    resolve_image_urls(market_items, lost_items)
+    return render_template("search.html", q=query, scope=scope, page=page, limit=limit,
+                           market_items=market_items, lost_items=lost_items,
+                           has_more=market_more or lost_more)
+
+
+@app.route("/api/search")
+def api_search():
+    query, scope, page, limit = get_search_args()
+    results = search_listings(get_db_connection(), query, scope, page, limit)
+    payload = {"q": query, "scope": scope, "page": page, "limit": limit}
+    for table, (rows, has_more) in results.items():
+        resolve_image_urls(rows)
+        payload[table] = {
+            "items": [dict(row, rank=round(row['rank'], 4), image=get_image_url(row['image']))
+                      for row in rows],
+            "has_more": has_more,
+        }
+    return payload
+
+
+@app.route("/uploads/pending/<path:name>")
+def pending_image(name):
+    """Serve an image variant that is still waiting in this instance's upload spool."""
+    upload_queue, storage = get_upload_queue(), get_storage()
+    if upload_queue.spooled_path(name):
+        return send_from_directory(upload_queue.objects_dir, name, max_age=60)
+    if storage:
+        # Upload finished (or happened on another instance) since the page rendered.
+        return redirect(storage.public_url(name))
+    abort(404)
 
 
 # --- LISTING DETAIL ---
 @app.route("/listing/<int:item_id>")
+@cache_public_page
 def listing_detail(item_id):
     conn = get_db_connection()
-    try:
-        item = safe_execute(conn, '''SELECT market_items.*, 
-                                        COALESCE(users.display_name, market_items.seller_brand, users.email, 'Campus Seller') AS seller_display
-                                        FROM market_items 
-                                        LEFT JOIN users ON market_items.user_id = users.id
-                                        WHERE market_items.id = %s''', (item_id,), fetchone=True)
-        if not item:
-            abort(404)
-        other_products = []
-        if item['user_id']:
-            other_products = safe_execute(
-                conn,
-                '''SELECT market_items.*, 
-                          COALESCE(users.display_name, market_items.seller_brand, users.email, 'Campus Seller') AS seller_display
-                   FROM market_items 
-                   LEFT JOIN users ON market_items.user_id = users.id
-                   WHERE market_items.user_id = %s AND market_items.id != %s AND market_items.is_sold = 0 
-                   ORDER BY market_items.id DESC''',
-                (item['user_id'], item_id), fetchall=True
-            ) or []
-    finally:
-        conn.close()
+    item = repo.market.detail(conn, item_id)
+    if not item:
+        abort(404)
+    other_products = []
+    if item['user_id']:
+        other_products = [row for row in seller_listings(conn, item['user_id'])
+                          if row['id'] != item_id][:RELATED_LISTINGS_LIMIT]
+    resolve_image_urls([item], variant='detail')
+    resolve_image_urls(other_products)
     return render_template("listing_detail.html", item=item, other_products=other_products, quantity=1)
 
 
@@ -392,40 +2490,255 @@ def seller_dash():
     if not session.get('email'):
         return redirect(url_for('login'))
     conn = get_db_connection()
+    user = get_current_user()
+    if not user or user['user_type'] != 'seller':
+        return redirect(url_for('market'))
+    items = repo.market.for_owner(conn, user['id'])
+    resolve_image_urls(items, variant='thumb')
+    return render_template("seller_dash.html", items=items, user=user)
+
+
+# --- LISTING IMPORT ---
+# Verified sellers can post many listings at once: a CSV or JSON sheet with
+# one listing per row (title and price, optionally brand, whatsapp and an
+# image file name) plus a .zip of the photos. Rows are read and validated
+# one at a time, and a bad row is reported and skipped rather than failing
+# the import. The request only reads, checks and hashes the photos; every
+# good row is inserted in one transaction with paged multi-row INSERTs, and
+# once that commits each new photo is spooled raw for the upload workers,
+# which decode, resize and upload it off the request (UPLOAD_WORKERS at a time).
+LISTING_IMPORT_MAX_ROWS = int(os.environ.get('LISTING_IMPORT_MAX_ROWS', 500))
+LISTING_IMPORT_MAX_BYTES = int(os.environ.get('LISTING_IMPORT_MAX_BYTES', 64 * 1024 * 1024))  # sheet plus archive
+LISTING_IMPORT_EXTENSIONS = ('.csv', '.json', '.jsonl')
+# What a damaged, encrypted or oddly compressed archive member raises on read
+ARCHIVE_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError, RuntimeError, NotImplementedError)
+
+
+def read_import_rows(sheet):
+    """Yield (row, fields, error) for each listing in an uploaded CSV, JSON array or JSON Lines file.
+
+    ``row`` is the line number, or the position in a JSON array. CSV and
+    JSON Lines are decoded a line at a time; a JSON array is parsed whole.
+    """
+    text = io.TextIOWrapper(sheet.stream, encoding='utf-8-sig', newline='')
+    if sheet.filename.lower().endswith('.csv'):
+        reader = csv.DictReader(text)
+        for fields in reader:
+            yield reader.line_num, fields, None
+        return
+    first = text.read(1)
+    while first.isspace():
+        first = text.read(1)
+    if first == '[':
+        try:
+            listings = json.loads(first + text.read())
+        except ValueError:
+            yield 1, None, "The file is not valid JSON."
+            return
+        for row, fields in enumerate(listings, 1):
+            yield row, fields, None
+        return
+    for row, line in enumerate(itertools.chain([first + text.readline()], text), 1):
+        if not line.strip():
+            continue
+        try:
+            yield row, json.loads(line), None
+        except ValueError:
+            yield row, None, "This line is not valid JSON."
+
+
+def validate_import_row(fields, user, photos):
+    """The market_items values for one import row, or an error; returns (values, error).
+
+    ``photos`` maps the image archive's file names to their ZipInfo, or is
+    None when no archive was uploaded.
+    """
+    if not isinstance(fields, dict):
+        return None, "Expected an object with a title and a price."
+    fields = {str(key).strip().lower(): '' if value is None else str(value).strip()
+              for key, value in fields.items() if key is not None}
+    if not fields.get('title'):
+        return None, "Title is missing."
+    if parse_price(fields.get('price')) is None:
+        return None, "Price is missing or not a number."
+    whatsapp = fields.get('whatsapp') or user['whatsapp']
+    if not whatsapp:
+        return None, "WhatsApp number is missing."
+    image = fields.get('image') or None
+    if image:
+        if photos is None:
+            return None, f"{image} needs an image archive to be uploaded with the sheet."
+        if not allowed_file(image):
+            return None, f"{image}: file type not allowed."
+        if image not in photos:
+            return None, f"{image} is not in the image archive."
+        if photos[image].file_size > app.config['MAX_CONTENT_LENGTH']:
+            return None, f"{image} is larger than the upload limit."
+    return {'title': fields['title'], 'brand': fields.get('brand') or user['display_name'],
+            'price': fields['price'], 'whatsapp': whatsapp, 'image': image,
+            'seller_brand': user['display_name'], 'user_id': user['id']}, None
+
+
+def scan_import_photos(archive, infos):
+    """Read, check and hash archive members; returns {file name: (image column value, error)}.
+
+    Only headers are parsed (check_upload_image); decoding and resizing are
+    left to the upload workers. Runs under run_cpu_bound(), so it doesn't log.
+    """
+    scanned = {}
+    for info in infos:
+        name = info.filename.rsplit('/', 1)[-1]
+        try:
+            with archive.open(info) as f:
+                data = f.read()
+            check_upload_image(data)
+            scanned[name] = upload_base_name(data), None
+        except InvalidImage as e:
+            scanned[name] = None, f"{name}: {e}"
+        except ARCHIVE_ERRORS as e:
+            scanned[name] = None, f"{name} could not be read from the image archive ({e})."
+    return scanned
+
+
+def import_listings_for(conn, user, sheet, archive):
+    """Validate and insert one seller's import; returns (number of listings imported, [{'row', 'error'}]).
+
+    Photos whose bytes are already stored are only counted, like
+    stage_image_upload(). The rest go in as 'pending' and are spooled for
+    the upload workers once the rows are committed.
+    """
+    photos = None
+    if archive is not None:
+        photos = {info.filename.rsplit('/', 1)[-1]: info for info in archive.infolist()
+                  if not info.is_dir() and not info.filename.startswith('__MACOSX/')}
+
+    listings, errors = [], []  # listings: (row, values)
+    read, row = 0, 0
     try:
-        user = safe_execute(conn, 'SELECT * FROM users WHERE email = %s', (session['email'],), fetchone=True)
-        if not user or user['user_type'] != 'seller':
-            return redirect(url_for('market'))
-        items = safe_execute(
-            conn,
-            'SELECT * FROM market_items WHERE user_id = %s ORDER BY id DESC',
-            (user['id'],), fetchall=True
-        ) or []
+        for row, fields, error in read_import_rows(sheet):
+            read += 1
+            if read > LISTING_IMPORT_MAX_ROWS:
+                errors.append({'row': row, 'error': f"At most {LISTING_IMPORT_MAX_ROWS} listings can be imported "
+                                                    "at once; this row and the ones after it were skipped."})
+                break
+            values, error = (None, error) if error else validate_import_row(fields, user, photos)
+            if error:
+                errors.append({'row': row, 'error': error})
+            else:
+                listings.append((row, values))
+    except (UnicodeDecodeError, csv.Error) as e:
+        errors.append({'row': row + 1, 'error': f"The file could not be read from here on ({e})."})
+
+    names = sorted({values['image'] for _, values in listings if values['image']})
+    scanned = run_cpu_bound(scan_import_photos, archive, [photos[name] for name in names]) if names else {}
+    members = {}  # image column value -> the first archive member with those bytes
+    good = []
+    for row, values in listings:
+        if values['image']:
+            base_name, error = scanned[values['image']]
+            if error:
+                errors.append({'row': row, 'error': error})
+                continue
+            members.setdefault(base_name, values['image'])
+            values['image'] = base_name
+        else:
+            values['image'] = 'default.png'
+        good.append(values)
+    errors.sort(key=lambda e: e['row'])
+    if not good:
+        return 0, errors
+
+    uses = Counter(values['image'] for values in good if values['image'] != 'default.png')
+    statuses = repo.images.acquire_many(conn, {base_name: (None, count) for base_name, count in uses.items()})
+    if statuses is None:
+        return 0, errors + [{'row': None, 'error': "The listings could not be saved; nothing was imported."}]
+    for values in good:
+        stored = values['image'] == 'default.png' or statuses.get(values['image']) == 'ready'
+        values['image_status'] = 'ready' if stored else 'pending'
+    ids = repo.market.create_many(conn, good)
+    if ids is None:
+        # safe_execute rolled the transaction back, acquire_many()'s counts with it, and nothing is spooled yet
+        return 0, errors + [{'row': None, 'error': "The listings could not be saved; nothing was imported."}]
+    bump_stats(conn, commit=True, market_listings=len(ids), catalog_version=1)
+    invalidate_public_pages()
+
+    pending = {}  # image column value -> ids of the rows showing it
+    for item_id, values in zip(ids, good):
+        if values['image_status'] == 'pending':
+            pending.setdefault(values['image'], []).append(item_id)
+    upload_queue = get_upload_queue()
+    for base_name, row_ids in pending.items():
+        try:
+            with archive.open(photos[members[base_name]]) as f:
+                job = upload_queue.spool_source(f.read(), image=base_name)
+        except (OSError, *ARCHIVE_ERRORS) as e:
+            logging.error("Failed to spool imported photo %s: %s", base_name, e)
+            repo.market.set_image_status(conn, row_ids, 'failed')
+            continue
+        upload_queue.submit(job, 'market_items', row_ids)
+    return len(ids), errors
+
+
+@app.route("/seller-dash/import", methods=["POST"])
+@rate_limited('import')
+def import_listings():
+    if not session.get('email'):
+        return redirect(url_for('login'))
+    conn = get_db_connection()
+    user = get_current_user()
+    if not user or user['is_verified'] != 1 or user['user_type'] != 'seller':
+        flash("Only verified sellers can post items.", "error")
+        return redirect(url_for('seller_dash'))
+
+    # A sheet plus its photos is far bigger than the one-photo MAX_CONTENT_LENGTH
+    request.max_content_length = LISTING_IMPORT_MAX_BYTES
+    sheet = request.files.get('listings')
+    if not sheet or not sheet.filename.lower().endswith(LISTING_IMPORT_EXTENSIONS):
+        flash("Please choose a .csv or .json file of listings.", "error")
+        return redirect(url_for('seller_dash'))
+    upload = request.files.get('images')
+    archive = None
+    if upload and upload.filename:
+        if not get_storage():
+            flash("Database storage is not configured for remote uploads.", "error")
+            return redirect(url_for('seller_dash'))
+        try:
+            archive = zipfile.ZipFile(upload.stream)
+        except (zipfile.BadZipFile, OSError):
+            flash("The image archive is not a valid .zip file.", "error")
+            return redirect(url_for('seller_dash'))
+
+    try:
+        imported, errors = import_listings_for(conn, user, sheet, archive)
     finally:
-        conn.close()
-    return render_template("seller_dash.html", items=items, user=user)
+        if archive is not None:
+            archive.close()
+
+    if request.accept_mimetypes.best == 'application/json':
+        return make_response({"imported": imported, "errors": errors})
+    flash(f"Imported {imported} listing{'s' if imported != 1 else ''}"
+          + (f"; {len(errors)} row{'s' if len(errors) != 1 else ''} skipped." if errors else "."),
+          "error" if errors and not imported else "success")
+    items = repo.market.for_owner(conn, user['id'])
+    resolve_image_urls(items, variant='thumb')
+    return render_template("seller_dash.html", items=items, user=user, import_errors=errors)
 
 
 # --- SELLER PROFILE (public) ---
 @app.route("/seller/<int:user_id>")
+@cache_public_page
 def seller_profile(user_id):
     conn = get_db_connection()
-    try:
-        seller = safe_execute(conn, 'SELECT * FROM users WHERE id = %s AND is_verified = 1',
-                              (user_id,), fetchone=True)
-        if not seller:
-            abort(404)
-        items = safe_execute(
-            conn,
-            'SELECT * FROM market_items WHERE user_id = %s AND is_sold = 0 ORDER BY id DESC',
-            (user_id,), fetchall=True
-        ) or []
-    finally:
-        conn.close()
+    seller = repo.users.verified_seller(conn, user_id)
+    if not seller:
+        abort(404)
+    items = seller_listings(conn, user_id)
+    resolve_image_urls(items[:SELLER_LISTINGS_LIMIT])
     return render_template("seller_profile.html",
                            name=seller['display_name'],
                            whatsapp=seller['whatsapp'],
-                           items=items,
+                           items=items[:SELLER_LISTINGS_LIMIT],
+                           more_items=len(items) > SELLER_LISTINGS_LIMIT,
                            join_date="2026")
 
 
@@ -435,73 +2748,70 @@ def mark_sold(item_id):
     if not session.get('email'):
         return redirect(url_for('login'))
     conn = get_db_connection()
-    try:
-        user = safe_execute(conn, 'SELECT * FROM users WHERE email = %s', (session['email'],), fetchone=True)
-        item = safe_execute(conn, 'SELECT * FROM market_items WHERE id = %s', (item_id,), fetchone=True)
-        if not user or not item:
-            abort(404)
-        # Only the seller who owns the item (or admin) can mark it sold
-        if item['user_id'] != user['id'] and not session.get('is_admin'):
-            abort(403)
-        safe_execute(conn, 'UPDATE market_items SET is_sold = 1 WHERE id = %s', (item_id,), commit=True)
-    finally:
-        conn.close()
+    user = get_current_user()
+    item = repo.market.get(conn, item_id)
+    if not user or not item:
+        abort(404)
+    # Only the seller who owns the item (or admin) can mark it sold
+    if item['user_id'] != user['id'] and not session.get('is_admin'):
+        abort(403)
+    if repo.market.mark_sold(conn, item_id):
+        bump_stats(conn, commit=True, catalog_version=1)
+        invalidate_public_pages(item_id)
     return redirect(url_for('seller_dash'))
 
 
 # --- LOST AND FOUND ---
 @app.route("/lost", methods=["GET", "POST"])
+@rate_limited('upload')
 def lost():
     conn = get_db_connection()
-    try:
-        if request.method == "POST":
-            img = request.files.get("image")
-            filename = None
-            if img and img.filename and img.filename != '':
-                if not allowed_file(img.filename):
-                    flash("File type not allowed.", "error")
-                    return redirect(url_for('lost'))
-                filename = secure_filename(img.filename)
-                try:
-                    file_data = img.read()
-                    res = supabase.storage.from_('market-images').upload(
-                        file=file_data,
-                        path=filename,
-                        file_options={"content-type": img.content_type}
-                    )
-                    print(f"Uploaded successfully to Supabase Storage: {res}")
-                except Exception as e:
-                    print(f"Error uploading to Supabase: {e}")
-                    flash("Error uploading image to storage.", "error")
-                    return redirect(url_for('lost'))
-
-            title = request.form.get('title', 'Unknown Item')
-            description = request.form.get('description', 'No description provided.')
-            location = request.form.get('location', 'Unknown Location')
-            custody = request.form.get('custody', 'With Mediator')
-
-            safe_execute(conn,
-                         'INSERT INTO lost_items (title, description, location, custody, image, is_recovered) VALUES (%s,%s,%s,%s,%s, 0)',
-                         (title, description, location, custody, filename), commit=True)
-            return redirect(url_for('lost'))
-
-        items = safe_execute(conn, 'SELECT * FROM lost_items WHERE is_recovered = 0 ORDER BY id DESC', fetchall=True) or []
-        # Stats logic:
-        recovered_week = safe_execute(conn, 
-                                      "SELECT COUNT(*) as count FROM claim_requests WHERE status = 'approved' AND created_at > NOW() - INTERVAL '7 days'", 
-                                      fetchone=True)['count']
-        verified_returns = safe_execute(conn, 
-                                        "SELECT COUNT(*) as count FROM claim_requests WHERE status = 'approved'", 
-                                        fetchone=True)['count']
-    finally:
-        conn.close()
+    if request.method == "POST":
+        img = request.files.get("image")
+        filename = None
+        upload_job = None
+        if img and img.filename and img.filename != '':
+            if not allowed_file(img.filename):
+                flash("File type not allowed.", "error")
+                return redirect(url_for('lost'))
+            try:
+                if not get_storage():
+                    raise RuntimeError("Image storage is not configured.")
+                filename, upload_job = stage_image_upload(conn, img)
+            except InvalidImage as e:
+                flash(str(e), "error")
+                return redirect(url_for('lost'))
+            except Exception as e:
+                logging.error("Failed to spool lost item image: %s", e)
+                flash("Error uploading image to storage.", "error")
+                return redirect(url_for('lost'))
+
+        title = request.form.get('title', 'Unknown Item')
+        description = request.form.get('description', 'No description provided.')
+        location = request.form.get('location', 'Unknown Location')
+        custody = request.form.get('custody', 'With Mediator')
+
+        lost_id = repo.lost.create(conn, title, description, location, custody, filename,
+                                   'pending' if upload_job else 'ready')
+        if lost_id:
+            bump_stats(conn, commit=True, active_reports=1, catalog_version=1)
+            invalidate_public_pages()
+            lost_matcher.add(lost_id, title, description, location)
+        if lost_id and upload_job:
+            get_upload_queue().submit(upload_job, 'lost_items', lost_id)
+        return redirect(url_for('lost'))
+
+    items = repo.lost.active(conn)
+    stats = get_site_stats(conn)
+    resolve_image_urls(items)
     return render_template("lost.html", 
                            items=items, 
-                           recovered_week=recovered_week, 
-                           verified_returns=verified_returns)
+                           recovered_week=stats['recovered_week'], 
+                           verified_returns=stats['verified_returns'])
 
 
 @app.route("/claim-item", methods=["POST"])
+@rate_limited('claim')
 def claim_item():
     if not session.get('email'):
         flash("Please login to claim an item.", "error")
@@ -515,65 +2825,117 @@ def claim_item():
         return redirect(url_for('lost'))
 
     conn = get_db_connection()
-    try:
-        print(f"DEBUG: Inserting claim for item {item_id} by {session['email']}")
-        safe_execute(conn,
-                     'INSERT INTO claim_requests (item_id, requester_email, proof_details) VALUES (%s,%s,%s)',
-                     (item_id, session['email'], proof), commit=True)
-        flash("Claim request submitted successfully! Admin will review it.", "success")
-    finally:
-        conn.close()
+    logging.info("Claim submitted for lost item %s by %s", item_id, session['email'])
+    repo.claims.create(conn, item_id, session['email'], proof)
+    flash("Claim request submitted successfully! Admin will review it.", "success")
 
     return redirect(url_for('lost'))
 
 
+# --- JSON API ---
+# /api/v1 answers with only the columns a client shows (MARKET_SUMMARY_COLUMNS
+# and friends in repository.py), never SELECT *. Lists page with the same
+# keyset cursor as the HTML feed: pass ?before=<next_before> for the next page.
+# /api/v1/market takes /market's ?sort= and ?min_price=/?max_price= too.
+# Bodies of API_COMPRESS_MIN bytes or more go out brotli- or gzip-encoded,
+# whichever the client accepts.
+API_COMPRESS_MIN = int(os.environ.get('API_COMPRESS_MIN', 1024))
+
+
+def json_default(value):
+    # NUMERIC columns (price_value) as numbers; anything else unknown as text
+    return float(value) if isinstance(value, Decimal) else str(value)
+
+
+def dump_json(payload):
+    if orjson:
+        return orjson.dumps(payload, default=json_default)
+    return json.dumps(payload, separators=(',', ':'), default=json_default).encode()
+
+
+def api_response(payload, status=200):
+    """Serialize ``payload`` and compress it if the client accepts brotli or gzip."""
+    body = dump_json(payload)
+    response = app.response_class(body, status=status, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if len(body) >= API_COMPRESS_MIN:
+        accepted = request.accept_encodings
+        if brotli and accepted['br']:
+            response.set_data(brotli.compress(body, quality=5))
+            response.content_encoding = 'br'
+        elif accepted['gzip']:
+            response.set_data(gzip.compress(body, compresslevel=6))
+            response.content_encoding = 'gzip'
+    return response
+
+
+def api_items(rows, variant='grid'):
+    """Rows as plain dicts, with ``image`` replaced by its URL."""
+    resolve_image_urls(rows, variant=variant)
+    items = []
+    for row in rows:
+        item = dict(row)
+        item['image'] = get_image_url(item['image'], variant)
+        item.pop('image_status', None)
+        items.append(item)
+    return items
+
+
+def api_page(rows, limit):
+    """One page of up to ``limit`` of ``rows`` (fetched as limit + 1) and the cursor for the next."""
+    next_before = rows[limit - 1]['id'] if len(rows) > limit else None
+    return {"items": api_items(rows[:limit]), "next_before": next_before}
+
+
+@app.route("/api/v1/market")
+def api_market():
+    if not session.get('email'):
+        return api_response({"error": "login required"}, 401)
+    filters = get_market_filters()
+    before, limit = get_page_args(filters.get('sort', 'newest'))
+    items, next_before = fetch_market_page(get_db_connection(), before, limit, filters,
+                                           columns=MARKET_SUMMARY_COLUMNS)
+    return api_response({"items": api_items(items), "next_before": next_before})
+
+
+@app.route("/api/v1/lost")
+def api_lost():
+    before, limit = get_page_args()
+    rows = repo.lost.page(get_db_connection(), before, limit + 1, columns=LOST_SUMMARY_COLUMNS)
+    return api_response(api_page(rows, limit))
+
+
+@app.route("/api/v1/listing/<int:item_id>")
+def api_listing(item_id):
+    row = repo.market.detail(get_db_connection(), item_id, columns=MARKET_DETAIL_COLUMNS)
+    if not row:
+        return api_response({"error": "not found"}, 404)
+    return api_response(api_items([row], variant='detail')[0])
+
+
 @app.route("/admin", methods=["GET"])
 def admin_dashboard():
     if not session.get('is_admin'):
         return redirect(url_for('admin_login'))
     
     conn = get_db_connection()
-    try:
-        pending_users = safe_execute(
-            conn,
-            'SELECT * FROM users WHERE is_verified = 0 AND reg_number IS NOT NULL',
-            fetchall=True
-        ) or []
-        market_oversight = safe_execute(
-            conn,
-            '''SELECT market_items.*, users.display_name AS seller_display
-               FROM market_items
-               LEFT JOIN users ON market_items.user_id = users.id
-               ORDER BY market_items.id DESC''',
-            fetchall=True
-        ) or []
-        claim_requests = safe_execute(
-            conn,
-            '''SELECT claim_requests.*, lost_items.title AS item_title, lost_items.image AS item_image
-               FROM claim_requests
-               JOIN lost_items ON claim_requests.item_id = lost_items.id
-               WHERE claim_requests.status = 'pending'
-               ORDER BY claim_requests.created_at DESC''',
-            fetchall=True
-        ) or []
-        print(f"DEBUG: Found {len(claim_requests)} pending claim requests")
-        if claim_requests:
-            print(f"DEBUG: First claim: {claim_requests[0]}")
-        
-        # Real stats for dashboard:
-        total_users = safe_execute(conn, "SELECT COUNT(*) as count FROM users", fetchone=True)['count']
-        active_reports = safe_execute(conn, "SELECT COUNT(*) as count FROM lost_items WHERE is_recovered = 0", fetchone=True)['count']
-        
-    finally:
-        conn.close()
+    pending_users = repo.users.pending_sellers(conn, ADMIN_QUEUE_LIMIT + 1)
+    claim_requests = match_claims(conn, repo.claims.pending(conn, ADMIN_QUEUE_LIMIT))
+    logging.debug("Admin dashboard: %d pending claim requests shown", len(claim_requests))
+
+    # Real stats for dashboard:
+    stats = get_site_stats(conn)
+
     return render_template("admin/dashboard.html", 
-                           pending_users=pending_users, 
-                           market_oversight=market_oversight,
+                           pending_users=pending_users[:ADMIN_QUEUE_LIMIT],
+                           more_pending_users=len(pending_users) > ADMIN_QUEUE_LIMIT,
+                           market_listings=stats['market_listings'],
                            claim_requests=claim_requests,
-                           total_users=total_users,
-                           active_reports=active_reports)
+                           total_users=stats['total_users'],
+                           active_reports=stats['active_reports'])
 
 @app.route("/admin-login", methods=["GET", "POST"])
+@rate_limited('admin_login')
 def admin_login():
     if request.method == "POST":
         if (request.form.get("username") == ADMIN_USERNAME and
@@ -586,89 +2948,289 @@ def admin_login():
     return render_template("admin_login.html")
 
 
+# --- MODERATION ---
+# Every action takes a list of ids and runs as one set-based UPDATE/DELETE in
+# a single transaction; the one-id links on the dashboard go through the same
+# helpers.
+
+def moderation_ids():
+    """Ids from a JSON body ({"ids": [...]}) or repeated ``ids`` form fields; at most ADMIN_BULK_LIMIT."""
+    if request.is_json:
+        raw = (request.get_json(silent=True) or {}).get('ids') or []
+    else:
+        raw = request.form.getlist('ids')
+    ids = []
+    for value in raw if isinstance(raw, list) else []:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            abort(400)
+    if len(ids) > ADMIN_BULK_LIMIT:
+        abort(413)
+    return sorted(set(ids))
+
+
+def moderation_response(count, message, fallback):
+    """JSON for API callers, otherwise a flash message and a redirect back."""
+    if request.is_json:
+        return {"updated": count}
+    flash(message.format(count=count), "success")
+    return redirect(request.referrer or url_for(fallback))
+
+
+def verify_sellers(conn, user_ids):
+    emails = repo.users.verify_many(conn, user_ids)
+    for email in emails:
+        invalidate_user(email)
+    return len(emails)
+
+
+def approve_claims(conn, claim_ids):
+    """Approve claims and mark their items recovered, counting each approval once; one commit.
+
+    Recovered items no longer show their photo anywhere, so their images are
+    released. All or nothing: if any step fails, the transaction is rolled
+    back, the counters are left alone and 0 is returned.
+    """
+    approved = repo.claims.approve_many(conn, claim_ids)
+    item_ids = list({claim['item_id'] for claim in approved})
+    recovered = repo.lost.mark_recovered_many(conn, item_ids) if approved else None
+    if (recovered is None
+            or not release_images(conn, [item['image'] for item in recovered])
+            or not record_claim_approvals(conn, len(approved))
+            or not bump_stats(conn, commit=True, verified_returns=len(approved), active_reports=-len(recovered),
+                              catalog_version=1)):
+        conn.rollback()
+        return 0
+    get_storage_janitor().wake()
+    invalidate_public_pages()
+    lost_matcher.remove(item['id'] for item in recovered)
+    return len(approved)
+
+
+def delete_market_items(conn, item_ids):
+    """Delete listings and queue their images for removal, in one transaction; 0 if any step failed."""
+    deleted = repo.market.delete_many(conn, item_ids)
+    if (not deleted
+            or not release_images(conn, [item['image'] for item in deleted])
+            or not bump_stats(conn, commit=True, market_listings=-len(deleted), catalog_version=1)):
+        conn.rollback()
+        return 0
+    get_storage_janitor().wake()
+    invalidate_public_pages(*(item['id'] for item in deleted))
+    return len(deleted)
+
+
 @app.route("/admin/verify/<int:uid>")
 def verify_user(uid):
     if not session.get('is_admin'):
         return redirect("/")
-    conn = get_db_connection()
-    try:
-        safe_execute(conn, 'UPDATE users SET is_verified = 1 WHERE id = %s', (uid,), commit=True)
-    finally:
-        conn.close()
+    verify_sellers(get_db_connection(), [uid])
     return redirect(url_for('admin_dashboard'))
 
+
+@app.route("/admin/verify", methods=["POST"])
+def verify_users_bulk():
+    if not session.get('is_admin'):
+        abort(403)
+    count = verify_sellers(get_db_connection(), moderation_ids())
+    return moderation_response(count, "Verified {count} sellers.", 'admin_dashboard')
+
+
+# --- ADMIN TABLES ---
+# The user and listing tables have no upper bound, so they are streamed: rows
+# come from a server-side cursor STREAM_CHUNK_SIZE at a time and are rendered
+# (or written as CSV) as they arrive, keeping memory flat and the first byte
+# fast however many there are.
+USER_EXPORT_COLUMNS = ('id', 'email', 'display_name', 'user_type', 'role', 'is_verified', 'reg_number', 'whatsapp')
+ITEM_EXPORT_COLUMNS = ('id', 'title', 'brand', 'price', 'is_sold', 'user_id', 'user_display', 'legal_name', 'image')
+CSV_CHUNK_SIZE = 64 * 1024  # bytes buffered per write to the response
+
+
+def stream_page(template_name, **context):
+    """stream_template() for a page fed by streamed rows.
+
+    The session cookie is written before the body, so flashed messages are
+    popped here rather than while base.html renders.
+    """
+    get_flashed_messages()
+    return stream_template(template_name, **context)
+
+
+def with_image_urls(rows, variant='grid'):
+    """resolve_image_urls() one row at a time, for rows that are streamed."""
+    for row in rows:
+        resolve_image_urls((row,), variant=variant)
+        yield row
+
+
+def csv_cell(value):
+    # A leading =, +, - or @ would run as a formula when the file is opened in a spreadsheet.
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def csv_response(filename, columns, rows):
+    """Stream ``rows`` as a CSV download with the given columns."""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([csv_cell(row[column]) for column in columns])
+            if buffer.tell() >= CSV_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
 @app.route("/admin/users")
 def admin_manage_users():
     if not session.get('is_admin'):
         return redirect("/")
-    conn = get_db_connection()
-    try:
-        users = safe_execute(conn, 'SELECT * FROM users ORDER BY id DESC', fetchall=True) or []
-    finally:
-        conn.close()
-    return render_template("admin/users.html", users=users)
+    users = repo.users.all(get_db_connection())
+    return stream_page("admin/users.html", users=users)
+
+
+@app.route("/admin/users.csv")
+def admin_export_users():
+    if not session.get('is_admin'):
+        abort(403)
+    return csv_response('users.csv', USER_EXPORT_COLUMNS, repo.users.all(get_db_connection()))
+
 
 @app.route("/admin/manage-items")
 def admin_manage_items():
+    if not session.get('is_admin'):
+        return redirect("/")
+    items = repo.market.for_admin(get_db_connection())
+    return stream_page("admin/manage_items.html", items=with_image_urls(items, variant='thumb'))
+
+
+@app.route("/admin/manage-items.csv")
+def admin_export_items():
+    if not session.get('is_admin'):
+        abort(403)
+    return csv_response('listings.csv', ITEM_EXPORT_COLUMNS, repo.market.for_admin(get_db_connection()))
+
+
+# Near-duplicate lookup: listings and reports whose photo's pHash is within
+# NEAR_DUPLICATE_DISTANCE bits of a listing's, for spotting reposts and spam.
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_DISTANCE', 6))  # at most repository.MAX_PHASH_DISTANCE
+NEAR_DUPLICATE_LIMIT = 100  # rows shown
+
+
+@app.route("/admin/manage-items/<int:item_id>/similar")
+def admin_similar_items(item_id):
     if not session.get('is_admin'):
         return redirect("/")
     conn = get_db_connection()
-    try:
-        items = safe_execute(conn, '''SELECT market_items.*, users.legal_name AS legal_name,
-                                 COALESCE(users.display_name, market_items.seller_brand, users.email, 'Unknown') AS user_display
-                                 FROM market_items LEFT JOIN users ON market_items.user_id = users.id
-                                 ORDER BY market_items.id DESC''', fetchall=True) or []
-    finally:
-        conn.close()
-    return render_template("admin/manage_items.html", items=items)
+    item = repo.market.detail(conn, item_id)
+    if not item:
+        abort(404)
+    phash = repo.images.phash(conn, item['image']) if item['image'] else None
+    matches = []
+    if phash is not None:
+        distances = {image['name']: image['distance'] for image in
+                     repo.images.similar(conn, phash, NEAR_DUPLICATE_DISTANCE, NEAR_DUPLICATE_LIMIT)}
+        matches = [dict(row, distance=distances[row['image']]) for row in repo.images.used_by(conn, list(distances))
+                   if not (row['kind'] == 'market' and row['id'] == item_id)]
+        matches = sorted(matches, key=lambda row: (row['distance'], row['kind'], -row['id']))[:NEAR_DUPLICATE_LIMIT]
+    resolve_image_urls([item], matches, variant='thumb')
+    return render_template("admin/similar_items.html", item=item, matches=matches, hashed=phash is not None,
+                           max_distance=NEAR_DUPLICATE_DISTANCE)
+
 
 @app.route("/admin/delete-item/<int:item_id>")
 def admin_delete_item(item_id):
     if not session.get('is_admin'):
         return redirect("/")
-    conn = get_db_connection()
-    try:
-        item = safe_execute(conn, 'SELECT image FROM market_items WHERE id = %s', (item_id,), fetchone=True)
-        if item and item['image'] and item['image'] != 'default.png':
-            if supabase:
-                try: supabase.storage.from_('market-images').remove([item['image']])
-                except: pass
-        safe_execute(conn, 'DELETE FROM market_items WHERE id = %s', (item_id,), commit=True)
-    finally:
-        conn.close()
+    delete_market_items(get_db_connection(), [item_id])
     return redirect(request.referrer or url_for('admin_manage_items'))
 
 
+@app.route("/admin/delete-items", methods=["POST"])
+def admin_delete_items():
+    if not session.get('is_admin'):
+        abort(403)
+    count = delete_market_items(get_db_connection(), moderation_ids())
+    return moderation_response(count, "Deleted {count} listings.", 'admin_manage_items')
+
+
 @app.route("/admin/approve-claim/<int:claim_id>")
 def approve_claim(claim_id):
     if not session.get('is_admin'):
         return redirect("/")
-    conn = get_db_connection()
-    try:
-        # Get item_id first
-        claim = safe_execute(conn, 'SELECT item_id FROM claim_requests WHERE id = %s', (claim_id,), fetchone=True)
-        if claim:
-            # Mark request as approved
-            safe_execute(conn, "UPDATE claim_requests SET status = 'approved' WHERE id = %s", (claim_id,), commit=True)
-            # Mark item as recovered
-            safe_execute(conn, "UPDATE lost_items SET is_recovered = 1 WHERE id = %s", (claim['item_id'],), commit=True)
-            flash("Claim approved and item marked as recovered!", "success")
-    finally:
-        conn.close()
+    # A no-op if the claim already was approved, so it is only counted once
+    if approve_claims(get_db_connection(), [claim_id]):
+        flash("Claim approved and item marked as recovered!", "success")
     return redirect(url_for('admin_dashboard'))
 
 
+@app.route("/admin/approve-claims", methods=["POST"])
+def approve_claims_bulk():
+    if not session.get('is_admin'):
+        abort(403)
+    count = approve_claims(get_db_connection(), moderation_ids())
+    return moderation_response(count, "Approved {count} claims; their items are marked recovered.",
+                               'admin_dashboard')
+
+
 @app.route("/admin/reject-claim/<int:claim_id>")
 def reject_claim(claim_id):
     if not session.get('is_admin'):
         return redirect("/")
-    conn = get_db_connection()
-    try:
-        safe_execute(conn, "UPDATE claim_requests SET status = 'rejected' WHERE id = %s", (claim_id,), commit=True)
-        flash("Claim request rejected.", "success")
-    finally:
-        conn.close()
+    repo.claims.reject_many(get_db_connection(), [claim_id])
+    flash("Claim request rejected.", "success")
     return redirect(url_for('admin_dashboard'))
 
+
+@app.route("/admin/reject-claims", methods=["POST"])
+def reject_claims_bulk():
+    if not session.get('is_admin'):
+        abort(403)
+    count = repo.claims.reject_many(get_db_connection(), moderation_ids())
+    return moderation_response(count, "Rejected {count} claims.", 'admin_dashboard')
+
+# --- APP FACTORY ---
+# Importing app.py only defines things: routes are registered on the
+# module-level app, and every service it needs at runtime is a lazy_service
+# getter (storage backend, upload queue, storage janitor, rate limiter,
+# metrics registry, image format check) or lazy in its own right (the
+# Supabase SDK, the connection pool). create_app() is what builds them, so
+# a gunicorn --preload master builds them once and forks workers that share
+# them. Threads and connections still start in the process that uses them:
+# the pool on first use, the upload and janitor threads when
+# start_background_threads() runs in each worker after the fork (gunicorn.conf.py's
+# post_worker_init, or the first request). Everything a fork could share is keyed on the pid.
+# `flask --app app ...` commands and scripts skip create_app() and get each
+# service the first time they ask for it. benchmarks/importtime.py keeps the
+# import itself cheap.
+
+def create_app():
+    """Build the app's services and return the WSGI app, for ``gunicorn 'app:create_app()'`` (see gunicorn.conf.py)."""
+    if not DATABASE_URL:
+        logging.warning("DATABASE_URL is not set; every page that reads the database will fail.")
+    if STORAGE_BACKEND != 'local' and not (SUPABASE_URL and SUPABASE_KEY):
+        # We still allow the app to run without it, but uploads will fail
+        logging.warning("Missing SUPABASE_URL or SUPABASE_KEY. Image uploads will fail.")
+    image_variant_format()
+    get_storage()
+    get_upload_queue()
+    get_storage_janitor()
+    get_rate_limiter()
+    if METRICS_ENABLED:
+        get_metrics()
+    return app
+
+
 if __name__ == "__main__":
+    # Local dev convenience; in production `flask --app app migrate` runs before gunicorn.
+    if DATABASE_URL:
+        run_migrations()
     app.run(debug=True, port=5000)
\ No newline at end of file
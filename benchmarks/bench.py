@@ -0,0 +1,443 @@
+"""Hustl benchmark suite: seed a synthetic dataset, time the main routes, save JSON.
+
+    python benchmarks/bench.py --rows 10000                        # Flask test client only
+    python benchmarks/bench.py --rows 100000 --gunicorn --workers 3
+    python benchmarks/bench.py --compare OLD.json NEW.json         # flag regressions
+
+Every scenario reports p50/p95/p99 latency (ms) and requests per second. The
+test-client run also counts DB queries per request and the process's RSS;
+the gunicorn run reports the RSS of each worker. Results are written to
+benchmarks/results/<git sha>.json unless --out is given.
+
+By default the data lives in a SQLite file (see sqlite_backend.py), so this
+runs offline. To measure Postgres, set DATABASE_URL to a scratch database.
+Seeding refuses to touch a database that has rows it did not create.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+DEFAULT_DB = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'hustl-bench.db')
+BENCH_PASSWORD = 'bench-password'
+SEED_MARKER = 'bench_seed_rows'  # site_stats row recording the seeded size
+BATCH = 5000
+
+WORDS = ('calculator', 'textbook', 'cycle', 'lamp', 'kettle', 'hoodie', 'laptop', 'stand', 'mattress', 'drafter',
+         'headphones', 'charger', 'bottle', 'umbrella', 'chair', 'monitor', 'keyboard', 'notes', 'guitar', 'racket')
+BRANDS = ('Casio', 'Camlin', 'Milton', 'Hero', 'Philips', 'Boat', 'Dell', 'HP', 'Nike', 'Yonex')
+
+# name, method, path, who is logged in, form kind for POSTs
+SCENARIOS = [
+    ('index', 'GET', '/', 'anon', None),
+    ('market', 'GET', '/market', 'buyer', None),
+    ('market_by_price', 'GET', '/market?sort=price_asc&min_price=500&max_price=5000', 'buyer', None),
+    ('listing_detail', 'GET', '/listing/{item_id}', 'anon', None),
+    ('lost', 'GET', '/lost', 'anon', None),
+    ('admin_dashboard', 'GET', '/admin', 'admin', None),
+    ('market_upload', 'POST', '/market', 'seller', 'market'),
+    ('lost_upload', 'POST', '/lost', 'buyer', 'lost'),
+]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors):
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': round(percentile(values, 50) * 1000, 3) if values else None,
+        'p95_ms': round(percentile(values, 95) * 1000, 3) if values else None,
+        'p99_ms': round(percentile(values, 99) * 1000, 3) if values else None,
+        'rps': round(len(values) / elapsed, 1) if elapsed else None,
+    }
+
+
+def rss_mb(pid='self'):
+    """Resident set size of a process in MB (Linux /proc)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def test_image():
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new('RGB', (800, 600), (random.randrange(256), 80, 160)).save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
+def form_fields(kind):
+    word = random.choice(WORDS)
+    if kind == 'market':
+        return {'title': f'Bench {word}', 'brand': random.choice(BRANDS), 'price': str(random.randint(50, 5000)),
+                'whatsapp': '9999999999'}
+    return {'title': f'Lost {word}', 'description': f'Bench report: {word}', 'location': 'Library',
+            'custody': 'Guard desk'}
+
+
+# --- seeding ---
+
+def seed(A, rows, reseed=False):
+    """Fill the database with ``rows`` market items plus users, lost items and claims; returns ids to hit."""
+    conn = A.get_db_pool().getconn()
+    try:
+        existing = A.safe_execute(conn, 'SELECT COUNT(*) AS n FROM market_items', fetchone=True)['n']
+        seeded = A.repo.stats.value(conn, SEED_MARKER)
+        if existing and seeded is None:
+            sys.exit("Refusing to seed: this database has data the benchmark did not create.")
+        if reseed or seeded != rows:
+            print(f"Seeding {rows} market items...", file=sys.stderr)
+            started = time.perf_counter()
+            _wipe(conn)
+            _insert_dataset(A, conn, rows)
+            A.bump_stats(conn, commit=True, catalog_version=1)
+            A.reconcile_stats(conn)
+            A.safe_execute(conn, '''INSERT INTO site_stats (name, value) VALUES (%s, %s)
+                                    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value''',
+                           (SEED_MARKER, rows), commit=True)
+            print(f"Seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        ids = A.safe_execute(conn, 'SELECT MIN(id) AS lo, MAX(id) AS hi FROM market_items', fetchone=True)
+        seller = A.safe_execute(conn, "SELECT email FROM users WHERE user_type = 'seller' ORDER BY id LIMIT 1",
+                                fetchone=True)
+        buyer = A.safe_execute(conn, "SELECT email FROM users WHERE user_type = 'buyer' ORDER BY id LIMIT 1",
+                               fetchone=True)
+        return {'item_lo': ids['lo'], 'item_hi': ids['hi'], 'seller': seller['email'], 'buyer': buyer['email']}
+    finally:
+        A.get_db_pool().putconn(conn)
+
+
+def _wipe(conn):
+    with conn.cursor() as cur:
+        # Every table the migrations create, except schema_version
+        for table in ('claim_requests', 'lost_items', 'market_items', 'users', 'claim_approvals_daily',
+                      'storage_deletions', 'images', 'site_stats'):
+            cur.execute(f'DELETE FROM {table}')
+        cur.execute("INSERT INTO site_stats (name, value) VALUES ('catalog_version', 0)")
+    conn.commit()
+
+
+def _insert(A, conn, table, columns, rows):
+    placeholders = ', '.join(['%s'] * len(columns))
+    sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES '
+    with conn.cursor() as cur:
+        for start in range(0, len(rows), BATCH):
+            batch = rows[start:start + BATCH]
+            if A.repo.dialect == 'postgres':
+                from psycopg2.extras import execute_values
+                execute_values(cur, sql + '%s', batch, page_size=BATCH)
+            else:
+                cur.executemany(sql + f'({placeholders})', batch)
+    conn.commit()
+
+
+def _insert_dataset(A, conn, rows):
+    from werkzeug.security import generate_password_hash
+    rng = random.Random(4857)
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    n_users = max(rows // 50, 20)
+    n_sellers = max(n_users // 5, 2)
+    users = [(f'bench{i}@hustl.test', password_hash, f'Seller {i}' if i < n_sellers else None,
+              'seller' if i < n_sellers else 'buyer', 'seller' if i < n_sellers else 'buyer',
+              1 if i < n_sellers else 0, f'REG{i}' if i < n_sellers else None, '9999999999')
+             for i in range(n_users)]
+    # a few sellers waiting on verification, for the admin queue
+    users += [(f'pending{i}@hustl.test', password_hash, f'Pending {i}', 'seller', 'pending_verification', 0,
+               f'PREG{i}', '9999999999') for i in range(min(25, n_users))]
+    _insert(A, conn, 'users', ('email', 'password_hash', 'display_name', 'user_type', 'role', 'is_verified',
+                               'reg_number', 'whatsapp'), users)
+    seller_ids = [row['id'] for row in A.safe_execute(
+        conn, "SELECT id FROM users WHERE user_type = 'seller' AND is_verified = 1", fetchall=True)]
+    prices = [rng.randint(50, 20000) for _ in range(rows)]
+    items = [(f'{rng.choice(BRANDS)} {rng.choice(WORDS)} {rng.choice(WORDS)}', rng.choice(BRANDS),
+              str(price), price, '9999999999', 'default.png', None, rng.choice(seller_ids),
+              1 if rng.random() < 0.1 else 0)
+             for price in prices]
+    _insert(A, conn, 'market_items', ('title', 'brand', 'price', 'price_value', 'whatsapp', 'image', 'seller_brand',
+                                      'user_id', 'is_sold'), items)
+    n_lost = max(rows // 10, 10)
+    lost = [(f'Lost {rng.choice(WORDS)}', f'Found near block {rng.randint(1, 9)}', f'Block {rng.randint(1, 9)}',
+             'Guard desk', None, 1 if rng.random() < 0.3 else 0) for _ in range(n_lost)]
+    _insert(A, conn, 'lost_items', ('title', 'description', 'location', 'custody', 'image', 'is_recovered'), lost)
+    lost_ids = [row['id'] for row in A.safe_execute(conn, 'SELECT id FROM lost_items', fetchall=True)]
+    claims = [(rng.choice(lost_ids), f'bench{rng.randrange(n_users)}@hustl.test', 'It has my name on it',
+               rng.choice(('pending', 'pending', 'approved', 'rejected'))) for _ in range(max(rows // 20, 10))]
+    _insert(A, conn, 'claim_requests', ('item_id', 'requester_email', 'proof_details', 'status'), claims)
+
+
+# --- in-process run (Flask test client) ---
+
+class QueryCounter:
+    """Counts queries issued through the repository (i.e. safe_execute)."""
+
+    def __init__(self, A):
+        self.count = 0
+        # The repository and each of its query namespaces (users, market, ..., images, storage, stats)
+        namespaces = [A.repo] + [value for value in vars(A.repo).values() if hasattr(value, 'execute')]
+        for queries in namespaces:
+            queries.execute = self._wrap(queries.execute)
+
+    def _wrap(self, execute):
+        def counted(*args, **kwargs):
+            self.count += 1
+            return execute(*args, **kwargs)
+        return counted
+
+
+def run_test_client(A, ids, requests, warmup):
+    counter = QueryCounter(A)
+    clients = {'anon': A.app.test_client()}
+    for who in ('buyer', 'seller', 'admin'):
+        client = A.app.test_client()
+        with client.session_transaction() as sess:
+            if who == 'admin':
+                sess.update(is_admin=True, email=A.ADMIN_USERNAME)
+            else:
+                sess['email'] = ids[who]
+        clients[who] = client
+    image = test_image()
+    results = {}
+    for name, method, path, who, form in SCENARIOS:
+        client = clients[who]
+
+        def call():
+            url = path.format(item_id=random.randint(ids['item_lo'], ids['item_hi']))
+            if method == 'GET':
+                return client.get(url)
+            data = dict(form_fields(form), image=(io.BytesIO(image), 'bench.jpg'))
+            return client.post(url, data=data, content_type='multipart/form-data')
+
+        for _ in range(warmup):
+            call()
+        latencies, errors = [], 0
+        queries_before = counter.count
+        started = time.perf_counter()
+        for _ in range(requests):
+            t0 = time.perf_counter()
+            status = call().status_code
+            latencies.append(time.perf_counter() - t0)
+            errors += status >= 500
+        elapsed = time.perf_counter() - started
+        results[name] = dict(summarize(latencies, elapsed, errors),
+                             queries_per_request=round((counter.count - queries_before) / requests, 2))
+        print(f"  {name:16} {results[name]}", file=sys.stderr)
+    A.get_upload_queue().drain(timeout=60)
+    return {'scenarios': results, 'rss_mb': rss_mb()}
+
+
+# --- multi-worker run (gunicorn over HTTP) ---
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _opener():
+    return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+
+def _send(opener, url, data=None, headers=None):
+    request = urllib.request.Request(url, data=data, headers=headers or {})
+    try:
+        with opener.open(request, timeout=30) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+def _multipart(fields, image):
+    boundary = f'bench{random.getrandbits(64):x}'
+    parts = []
+    for key, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="bench.jpg"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n'.encode() + image + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+def _login(base, who, ids):
+    opener = _opener()
+    if who == 'admin':
+        form = {'username': os.environ.get('ADMIN_USERNAME', 'admin'),
+                'password': os.environ.get('ADMIN_PASSWORD', 'changeme')}
+        _send(opener, base + '/admin-login', urllib.parse.urlencode(form).encode())
+    elif who != 'anon':
+        form = {'email': ids[who], 'password': BENCH_PASSWORD}
+        _send(opener, base + '/login', urllib.parse.urlencode(form).encode())
+    return opener
+
+
+def _worker_pids(master_pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == master_pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return sorted(pids)
+
+
+def run_gunicorn(ids, requests, warmup, workers, concurrency, port):
+    base = f'http://127.0.0.1:{port}'
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+                             '--workers', str(workers), '--log-level', 'warning'],
+                            cwd=ROOT, env=os.environ.copy())
+    try:
+        deadline = time.monotonic() + 30
+        while _send(_opener(), base + '/health') != 200:
+            if time.monotonic() > deadline or proc.poll() is not None:
+                raise RuntimeError("gunicorn did not come up")
+            time.sleep(0.2)
+        image = test_image()
+        results = {}
+        for name, method, path, who, form in SCENARIOS:
+            openers = [_login(base, who, ids) for _ in range(concurrency)]
+            latencies, errors, lock = [], [0], threading.Lock()
+            per_thread = max(1, requests // concurrency)
+
+            def drive(opener, count, record):
+                for _ in range(count):
+                    url = base + path.format(item_id=random.randint(ids['item_lo'], ids['item_hi']))
+                    data, headers = (None, None) if method == 'GET' else _multipart(form_fields(form), image)
+                    t0 = time.perf_counter()
+                    status = _send(opener, url, data, headers)
+                    if record:
+                        with lock:
+                            latencies.append(time.perf_counter() - t0)
+                            errors[0] += status is None or status >= 500
+
+            def run(count, record):
+                threads = [threading.Thread(target=drive, args=(opener, count, record)) for opener in openers]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            run(max(1, warmup // concurrency), record=False)
+            started = time.perf_counter()
+            run(per_thread, record=True)
+            results[name] = summarize(latencies, time.perf_counter() - started, errors[0])
+            print(f"  {name:16} {results[name]}", file=sys.stderr)
+        return {'workers': workers, 'concurrency': concurrency, 'scenarios': results,
+                'worker_rss_mb': [rss_mb(pid) for pid in _worker_pids(proc.pid)]}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+# --- comparing runs ---
+
+def compare(old_path, new_path, tolerance):
+    """Print per-scenario p95 and RPS changes; returns True if any p95 regressed beyond ``tolerance`` percent."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    regressed = False
+    for run in ('test_client', 'gunicorn'):
+        for name, after in (new.get(run) or {}).get('scenarios', {}).items():
+            before = (old.get(run) or {}).get('scenarios', {}).get(name)
+            if not before or not before.get('p95_ms') or not after.get('p95_ms'):
+                continue
+            change = (after['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+            flag = 'REGRESSION' if change > tolerance else ''
+            regressed |= bool(flag)
+            print(f"{run:12} {name:16} p95 {before['p95_ms']:>9.2f} -> {after['p95_ms']:>9.2f} ms ({change:+6.1f}%)  "
+                  f"rps {before['rps']} -> {after['rps']}  {flag}")
+    return regressed
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000, help='market_items to seed (default 10000)')
+    parser.add_argument('--reseed', action='store_true', help='wipe and reseed even if the dataset matches')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per scenario first')
+    parser.add_argument('--gunicorn', action='store_true', help='also benchmark a multi-worker gunicorn server')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads for the gunicorn run')
+    parser.add_argument('--port', type=int, default=8757)
+    parser.add_argument('--out', help='where to write the JSON results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    parser.add_argument('--tolerance', type=float, default=10, help='allowed p95 slowdown in percent for --compare')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.tolerance) else 0)
+
+    os.environ.setdefault('DATABASE_URL', DEFAULT_DB)
+    os.environ.setdefault('STORAGE_BACKEND', 'local')
+    os.environ.setdefault('UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'hustl-bench-spool'))
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'False')  # the upload scenarios post far more than a user may
+    sys.path.insert(0, ROOT)
+    import app as A
+
+    A.run_migrations()
+    ids = seed(A, args.rows, args.reseed)
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'backend': A.repo.dialect,
+            'rows': args.rows,
+            'requests': args.requests,
+            'page_cache_ttl': A.PAGE_CACHE_TTL,
+        },
+    }
+    print("Flask test client:", file=sys.stderr)
+    results['test_client'] = run_test_client(A, ids, args.requests, args.warmup)
+    if args.gunicorn:
+        print(f"gunicorn, {args.workers} workers:", file=sys.stderr)
+        results['gunicorn'] = run_gunicorn(ids, args.requests, args.warmup, args.workers, args.concurrency,
+                                           args.port)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{results['meta']['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {out}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
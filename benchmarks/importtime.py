@@ -0,0 +1,79 @@
+"""Import-time budget for app.py, measured with ``python -X importtime``.
+
+    python benchmarks/importtime.py                   # median of 5 fresh imports vs. the budget
+    python benchmarks/importtime.py --budget-ms 400 --top 20
+
+Every gunicorn master, `flask --app app migrate` and script pays for
+``import app`` before doing anything, so it must stay cheap: no I/O, and no
+heavy SDKs that only a background thread needs. Each run imports the app in
+a fresh interpreter with Supabase credentials set (so the lazy client is
+exercised) and an in-memory SQLite DATABASE_URL. The check fails, exiting
+non-zero, if the median cumulative import time of ``app`` is over the
+budget or if any of LAZY_MODULES was imported.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET_MS = 500
+# Loaded on first use only (get_supabase); any of these at import is a regression
+LAZY_MODULES = ('supabase', 'storage3', 'postgrest', 'httpx', 'gotrue', 'supabase_auth', 'realtime')
+
+
+def import_once():
+    """One fresh ``import app``; returns ({module: (self_us, cumulative_us, depth)}, total_us)."""
+    env = dict(os.environ, SUPABASE_URL='https://example.supabase.co', SUPABASE_KEY='importtime-check',
+               DATABASE_URL='sqlite://', RATE_LIMIT_STORE='memory')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode:
+        sys.exit(f"import app failed:\n{proc.stderr}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    if 'app' not in modules:
+        sys.exit("No import time was reported for app")
+    return modules, modules['app'][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh imports to take the median of (default 5)')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f'fail above this median import time (default {DEFAULT_BUDGET_MS})')
+    parser.add_argument('--top', type=int, default=10, help='direct imports of app to list, slowest first')
+    args = parser.parse_args()
+
+    import_once()  # compiles any stale .pyc files, which would inflate the first run
+    runs = [import_once() for _ in range(args.runs)]
+    median_ms = statistics.median(total for _, total in runs) / 1000
+    modules = runs[-1][0]
+
+    # Direct imports of app are the ones one level below it in the tree
+    app_depth = modules['app'][2]
+    direct = sorted(((cumulative, name) for name, (_, cumulative, depth) in modules.items()
+                     if depth == app_depth + 1), reverse=True)
+    print(f"import app: median {median_ms:.0f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    for cumulative, name in direct[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    eager = sorted({name.split('.')[0] for name in modules} & set(LAZY_MODULES))
+    if eager:
+        print(f"FAIL: imported at startup but meant to load lazily: {', '.join(eager)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"FAIL: import time is over budget by {median_ms - args.budget_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Gunicorn settings for Render: gunicorn 'app:create_app()' -c gunicorn.conf.py
+
+The master imports the app and calls create_app() once (preload_app), then
+forks the workers from it. A deploy or restart pays for the import and the
+service setup once instead of once per worker, and the workers share that
+memory until they write to it. Neither step opens a connection or starts a
+thread (see APP FACTORY in app.py), so nothing the master creates leaks into
+a worker.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 3))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = 1000
+preload_app = True
+
+if worker_class == 'gevent':
+    # The gevent worker patches the stdlib only after the fork. Patch the
+    # master before it imports the app, or the locks and sockets app.py
+    # creates at import would block the whole worker instead of one greenlet.
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    # The app is loaded by now. Freezing what the master allocated keeps the
+    # workers' garbage collector from touching, and so copying, those pages.
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Start the upload and janitor threads in each worker now, after the fork
+    # (and after gevent's patching), so that jobs a dead worker left in the
+    # upload spool are adopted without waiting for a request.
+    import app
+    app.start_background_threads()
@@ -0,0 +1,131 @@
+"""TF-IDF matching of claim text against open lost-and-found reports.
+
+LostMatcher keeps, per process, an L2-normalised TF-IDF vector for each open
+report (title counted twice, then description and location) and an inverted
+index from each term to the reports that contain it. Scoring a claim only
+walks the postings of the claim's own terms, so it stays fast with
+thousands of open reports. Reports are added and removed one at a time.
+Vectors are computed with the IDF weights current when they were added, so
+every vector is recomputed once the number of reports has drifted by
+REBUILD_DRIFT since the last rebuild.
+"""
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_WORD = re.compile(r'[a-z0-9]+')
+# Common words, plus ones every report and claim uses
+STOPWORDS = frozenset('''
+    a an and are as at be been but by can did do for from had has have he her his i if in into is it its just
+    me my of on or our she so that the their them there they this to too was we were what when where which
+    who with you your lost found left near mine belong belongs please think item
+'''.split())
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lower-cased words minus stopwords, with a plural 's' dropped ('keys' matches 'key')."""
+    tokens = []
+    for word in _WORD.findall((text or '').lower()):
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class LostMatcher:
+    REBUILD_DRIFT = 0.25  # fraction of the corpus added or removed before all vectors are recomputed
+    MIN_REBUILD = 20  # ...but never more often than every this many changes
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[int, Counter] = {}  # report id -> term counts
+        self._vectors: Dict[int, Dict[str, float]] = {}
+        self._postings: Dict[str, Dict[int, float]] = defaultdict(dict)  # term -> {report id: weight}
+        self._df: Counter = Counter()
+        self._built_size = 0
+        self.synced_id = 0  # reports up to this id have been loaded from the database
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._counts
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def add(self, item_id: int, title: Optional[str], description: Optional[str], location: Optional[str]) -> None:
+        counts = Counter(tokenize(title) * 2 + tokenize(description) + tokenize(location))
+        with self._lock:
+            self._remove(item_id)
+            self._counts[item_id] = counts
+            self._df.update(counts.keys())
+            if self._drifted():
+                self._rebuild()
+            else:
+                self._index(item_id)
+
+    def remove(self, item_ids: Iterable[int]) -> None:
+        with self._lock:
+            for item_id in item_ids:
+                self._remove(item_id)
+            if self._drifted():
+                self._rebuild()
+
+    def match(self, text: Optional[str], limit: int) -> List[Tuple[int, float]]:
+        """The ``limit`` reports most similar to ``text``, as (report id, cosine similarity), best first."""
+        scores: Dict[int, float] = defaultdict(float)
+        with self._lock:
+            for term, weight in self._vector(Counter(tokenize(text))).items():
+                for item_id, item_weight in self._postings.get(term, {}).items():
+                    scores[item_id] += weight * item_weight
+        return heapq.nlargest(limit, scores.items(), key=lambda pair: pair[1])
+
+    def score(self, text: Optional[str], item_id: int) -> float:
+        """Cosine similarity between ``text`` and one report (0 if it isn't indexed)."""
+        with self._lock:
+            vector = self._vectors.get(item_id)
+            if not vector:
+                return 0.0
+            query = self._vector(Counter(tokenize(text)))
+            return sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+
+    def _idf(self, term: str) -> float:
+        return math.log((1 + len(self._counts)) / (1 + self._df[term])) + 1
+
+    def _vector(self, counts: Counter) -> Dict[str, float]:
+        weights = {term: (1 + math.log(count)) * self._idf(term) for term, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        return {term: weight / norm for term, weight in weights.items()}
+
+    def _index(self, item_id: int) -> None:
+        vector = self._vectors[item_id] = self._vector(self._counts[item_id])
+        for term, weight in vector.items():
+            self._postings[term][item_id] = weight
+
+    def _remove(self, item_id: int) -> None:
+        counts = self._counts.pop(item_id, None)
+        if counts is None:
+            return
+        for term in counts:
+            self._df[term] -= 1
+            if self._df[term] <= 0:
+                del self._df[term]
+        for term in self._vectors.pop(item_id, {}):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(item_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def _drifted(self) -> bool:
+        return abs(len(self._counts) - self._built_size) >= max(self.MIN_REBUILD, self.REBUILD_DRIFT * self._built_size)
+
+    def _rebuild(self) -> None:
+        self._vectors.clear()
+        self._postings.clear()
+        for item_id in self._counts:
+            self._index(item_id)
+        self._built_size = len(self._counts)
@@ -0,0 +1,171 @@
+"""Prometheus counters and histograms for request and query instrumentation.
+
+Only used when METRICS_ENABLED is set (see app.py). Values live in the worker
+process. Under gunicorn each worker can also write a snapshot to a shared
+directory (METRICS_DIR) at most once per ``flush_interval`` seconds; /metrics
+then sums the snapshots of every worker that has ever run, so counters stay
+monotonic across worker restarts. Empty the directory on deploy.
+"""
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """One line per query shape: literals become ``?`` and placeholder lists collapse."""
+    sql = _PLACEHOLDER_LISTS.sub('%s, ...', _LITERALS.sub('?', sql))
+    return ' '.join(sql.split())
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels)
+    return '{' + pairs + '}' if pairs else ''
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Metrics:
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._reset(os.getpid())
+
+    def _reset(self, pid: int) -> None:
+        self._pid = pid
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}  # bucket counts..., sum, count
+        self._flushed_at = 0.0
+
+    def _check_pid(self) -> None:
+        # Values recorded before a fork belong to the parent.
+        if self._pid != os.getpid():
+            self._reset(os.getpid())
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._help[name] = ('counter', help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self._help[name] = ('histogram', help_text)
+        self._buckets[name] = tuple(buckets)
+
+    def inc(self, name: str, labels: Labels = (), amount: float = 1) -> None:
+        with self._lock:
+            self._check_pid()
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        buckets = self._buckets[name]
+        with self._lock:
+            self._check_pid()
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [0] * (len(buckets) + 2)
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            self._check_pid()
+            return {'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                    'histograms': [[name, list(labels), list(series)]
+                                   for (name, labels), series in self._histograms.items()]}
+
+    def maybe_flush(self) -> None:
+        """Write this worker's snapshot for the others to read, if the interval has passed."""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if now - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = now
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'{os.getpid()}.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self._snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            logging.exception("Could not write metrics snapshot to %s", self.directory)
+
+    def _snapshots(self) -> List[dict]:
+        snapshots = [self._snapshot()]
+        if not self.directory or not os.path.isdir(self.directory):
+            return snapshots
+        own = f'{os.getpid()}.json'
+        for entry in os.listdir(self.directory):
+            if not entry.endswith('.json') or entry == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, entry)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # a worker mid-write; it will be there next scrape
+        return snapshots
+
+    def render(self, extra: Iterable[str] = ()) -> str:
+        """Prometheus text exposition of every worker's values, plus ``extra`` lines."""
+        counters: Dict[Tuple[str, Labels], float] = {}
+        histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        for snapshot in self._snapshots():
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, series in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], series)]
+                else:
+                    histograms[key] = list(series)
+        lines = []
+        for name, (kind, help_text) in sorted(self._help.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (series_name, labels), value in sorted(counters.items()):
+                    if series_name == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+                continue
+            buckets = self._buckets[name]
+            for (series_name, labels), series in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, series):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_number(bound)),))} '
+                                 f'{_format_number(cumulative)}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} '
+                             f'{_format_number(series[-1])}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(series[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {_format_number(series[-1])}')
+        lines.extend(extra)
+        return '\n'.join(lines) + '\n'
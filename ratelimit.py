@@ -0,0 +1,166 @@
+"""Token-bucket rate limiting with state shared between worker processes.
+
+Each bucket holds up to ``burst`` tokens and refills at ``rate`` tokens per
+second; a request takes one token or is refused with the seconds until one
+is back. Buckets live in a store:
+
+- SqliteStore: a small SQLite file that every worker on the host opens, one
+  connection per process; one ``BEGIN IMMEDIATE`` transaction per check
+  keeps updates atomic.
+- RedisStore: any Redis-compatible server (needs the ``redis`` package), for
+  limits shared between hosts; one Lua script per check.
+- MemoryStore: this process only; for development and tests.
+
+A store that fails lets the request through (see RateLimiter.hit) rather than
+take the site down with it.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+def refill(tokens: float, updated_at: float, now: float, rate: float, burst: float) -> float:
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+
+class MemoryStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, updated_at)
+
+    def take(self, key: str, rate: float, burst: float, now: float) -> float:
+        """Take a token if there is one; returns the tokens left before taking (< 1 means refused)."""
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated_at, now, rate, burst)
+            self._buckets[key] = (tokens - 1 if tokens >= 1 else tokens, now)
+            return tokens
+
+
+class SqliteStore:
+    PRUNE_INTERVAL = 300  # seconds between deletes of buckets that have refilled completely
+    BUSY_SLEEP = 0.002  # seconds between tries while another process holds the write lock
+
+    def __init__(self, path: str, timeout: float = 1.0):
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._pruned_at = 0.0
+        # Once, at startup; each worker then just opens the file.
+        conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS buckets (
+                                key TEXT PRIMARY KEY,
+                                tokens REAL NOT NULL,
+                                updated_at REAL NOT NULL,
+                                full_at REAL NOT NULL)''')
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per process, used under self._lock; none inherited across a fork.
+        if self._conn is None or self._pid != os.getpid():
+            # No busy timeout: SQLite would wait for the write lock in C, stalling a gevent worker's hub.
+            self._conn = sqlite3.connect(self.path, timeout=0, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA synchronous=OFF')  # losing a few buckets in a crash is harmless
+            self._pid = os.getpid()
+        return self._conn
+
+    def _begin(self, conn: sqlite3.Connection) -> None:
+        # Wait for other processes' writes with time.sleep(), which yields under gevent.
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or time.monotonic() >= deadline:
+                    raise
+            time.sleep(self.BUSY_SLEEP)
+
+    def take(self, key: str, rate: float, burst: float, now: float) -> float:
+        with self._lock:
+            conn = self._connect()
+            self._begin(conn)
+            try:
+                row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = refill(*row, now, rate, burst) if row else burst
+                left = tokens - 1 if tokens >= 1 else tokens
+                conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)',
+                             (key, left, now, now + (burst - left) / rate))
+                if now - self._pruned_at >= self.PRUNE_INTERVAL:
+                    self._pruned_at = now
+                    conn.execute('DELETE FROM buckets WHERE full_at < ?', (now,))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            return tokens
+
+
+class RedisStore:
+    # Refill and take in one round trip, atomically; the key expires once the bucket would be full again.
+    SCRIPT = '''
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(state[1]) or burst
+        local updated_at = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+        local left = tokens
+        if tokens >= 1 then left = tokens - 1 end
+        redis.call('HSET', KEYS[1], 'tokens', left, 'updated_at', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil((burst - left) / rate) + 1)
+        return tostring(tokens)
+    '''
+
+    def __init__(self, url: str, prefix: str = 'ratelimit:'):
+        if redis is None:
+            raise RuntimeError("RedisStore needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key: str, rate: float, burst: float, now: float) -> float:
+        return float(self._script(keys=[self.prefix + key], args=[rate, burst, now]))
+
+
+def open_store(spec: str):
+    """A store from RATE_LIMIT_STORE: ``memory``, ``redis://...``/``rediss://...``, or a SQLite file path."""
+    if spec == 'memory':
+        return MemoryStore()
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(spec)
+    return SqliteStore(spec)
+
+
+class RateLimiter:
+    def __init__(self, store):
+        self.store = store
+
+    def hit(self, key: str, count: int, period: float) -> Optional[int]:
+        """Spend one of ``count`` requests per ``period`` seconds for ``key``.
+
+        Returns None if the request may go ahead, otherwise the whole seconds
+        until it may be retried. A store error is logged and allows it.
+        """
+        rate = count / period
+        try:
+            tokens = self.store.take(key, rate, count, time.time())
+        except Exception:
+            logging.exception("Rate limit store failed; allowing %s", key)
+            return None
+        if tokens >= 1:
+            return None
+        return max(1, math.ceil((1 - tokens) / rate))
@@ -0,0 +1,790 @@
+"""Typed query functions for users, market_items, lost_items and claim_requests.
+
+Routes talk to the database only through a Repository: ``repo.users``,
+``repo.market``, ``repo.lost``, ``repo.claims``, ``repo.images``,
+``repo.storage`` and ``repo.stats``. Every query runs through the ``execute`` callable the
+repository was built with (app.safe_execute), so error handling and logging
+stay in one place.
+
+PostgresRepository is what production runs. SqliteRepository overrides the
+few queries that use Postgres-only SQL (full-text search, advisory locks,
+date arithmetic, row locks) so the app can run against sqlite_backend offline.
+"""
+import re
+from collections import Counter
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+Row = Dict[str, Any]
+Execute = Callable[..., Any]
+# A market page cursor: the last id, or (price_value, id) when sorted by price
+Cursor = Union[int, Tuple[Decimal, int], None]
+
+# Seller name shown on listing cards
+SELLER_DISPLAY = "COALESCE(users.display_name, market_items.seller_brand, users.email, 'Campus Seller') AS seller_display"
+# Columns the JSON API (/api/v1) returns; seller contact details only on the detail view.
+MARKET_SUMMARY_COLUMNS = ('market_items.id, market_items.title, market_items.brand, market_items.price, '
+                          'market_items.price_value, market_items.image, market_items.image_status')
+MARKET_DETAIL_COLUMNS = MARKET_SUMMARY_COLUMNS + ', market_items.whatsapp, market_items.is_sold, market_items.user_id'
+LOST_SUMMARY_COLUMNS = 'id, title, description, location, custody, image, image_status'
+# What load_user() caches; password hashes and ID proofs stay out of it.
+USER_COLUMNS = 'id, email, display_name, whatsapp, reg_number, user_type, role, is_verified'
+# Statements EXPLAIN accepts; it plans them without executing.
+_EXPLAINABLE = re.compile(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+# Orders of the market feed, as (ORDER BY, keyset comparison). Each is a range
+# scan of market_items_is_sold_id_idx or market_items_is_sold_price_value_id_idx.
+MARKET_SORTS = {
+    'newest': ('market_items.id DESC', 'market_items.id < %s'),
+    'price_asc': ('market_items.price_value, market_items.id', '(market_items.price_value, market_items.id) > (%s, %s)'),
+    'price_desc': ('market_items.price_value DESC, market_items.id DESC',
+                   '(market_items.price_value, market_items.id) < (%s, %s)'),
+}
+_PRICE = re.compile(r'[0-9]+(?:\.[0-9]+)?')
+MAX_PRICE_DIGITS = 10  # market_items.price_value is NUMERIC(12, 2)
+
+# images.phash is split into four 16-bit bands, each with an expression index
+# (Postgres migration 15); the SQL must match the index expressions exactly.
+PHASH_BAND_SQL = ('((phash >> 48) & 65535)', '((phash >> 32) & 65535)', '((phash >> 16) & 65535)', '(phash & 65535)')
+# Probing each band and its 16 one-bit neighbours finds every hash within this many bits
+MAX_PHASH_DISTANCE = 7
+
+
+
+def parse_price(text: Optional[str]) -> Optional[Decimal]:
+    """The first number in a price as typed ('₹1,200', '500 negotiable'), or None.
+
+    Keep in step with the backfill in Postgres migration 14.
+    """
+    match = _PRICE.search((text or '').replace(',', ''))
+    if not match or len(match.group().split('.')[0]) > MAX_PRICE_DIGITS:
+        return None
+    return Decimal(match.group()).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+class Queries:
+    def __init__(self, execute: Execute):
+        self.execute = execute
+
+
+class UserQueries(Queries):
+    def by_email(self, conn, email: str) -> Optional[Row]:
+        return self.execute(conn, f'SELECT {USER_COLUMNS} FROM users WHERE email = %s', (email,), fetchone=True)
+
+    def credentials(self, conn, email: str) -> Optional[Row]:
+        """id and password_hash, for login and signup only."""
+        return self.execute(conn, 'SELECT id, password_hash FROM users WHERE email = %s', (email,), fetchone=True)
+
+    def set_password(self, conn, email: str, password_hash: str) -> None:
+        self.execute(conn, 'UPDATE users SET password_hash = %s WHERE email = %s', (password_hash, email),
+                     commit=True)
+
+    def create(self, conn, email: str, password_hash: str, user_type: str = 'buyer',
+               role: str = 'buyer') -> Optional[int]:
+        """Insert a user without committing; returns the new id."""
+        row = self.execute(conn, '''INSERT INTO users (email, password_hash, user_type, role)
+                                    VALUES (%s, %s, %s, %s) RETURNING id''',
+                           (email, password_hash, user_type, role), fetchone=True)
+        return row['id'] if row else None
+
+    def submit_seller_profile(self, conn, email: str, legal_name: str, display_name: str, reg_number: str,
+                              whatsapp: str, id_proof_link: str, social_link: str) -> bool:
+        """Turn a user into an unverified seller, without committing."""
+        return self.execute(conn, '''UPDATE users SET legal_name=%s, display_name=%s, reg_number=%s, whatsapp=%s,
+                                     id_proof_link=%s, social_link=%s, role='pending_verification',
+                                     user_type='seller', is_verified=0
+                                     WHERE email = %s''',
+                            (legal_name, display_name, reg_number, whatsapp, id_proof_link, social_link,
+                             email)) is not None
+
+    def verify_many(self, conn, user_ids: List[int]) -> List[str]:
+        """Mark sellers verified and commit; returns the emails of those that weren't already."""
+        rows = self.execute(conn, 'UPDATE users SET is_verified = 1 WHERE id = ANY(%s) AND is_verified = 0 '
+                                  'RETURNING email', (list(user_ids),), commit=True, fetchall=True)
+        return [row['email'] for row in rows or []]
+
+    def verified_seller(self, conn, user_id: int) -> Optional[Row]:
+        return self.execute(conn, 'SELECT id, display_name, whatsapp FROM users WHERE id = %s AND is_verified = 1',
+                            (user_id,), fetchone=True)
+
+    def pending_sellers(self, conn, limit: int) -> List[Row]:
+        """The oldest ``limit`` seller profiles awaiting verification."""
+        return self.execute(conn, f'''SELECT {USER_COLUMNS} FROM users
+                                      WHERE is_verified = 0 AND reg_number IS NOT NULL
+                                      ORDER BY id LIMIT %s''', (limit,), fetchall=True) or []
+
+    def all(self, conn) -> Iterator[Row]:
+        """Every account, newest first, streamed from a server-side cursor."""
+        return self.execute(conn, f'SELECT {USER_COLUMNS} FROM users ORDER BY id DESC', stream=True)
+
+
+class ImageRowQueries(Queries):
+    table = None
+
+    def set_image_status(self, conn, row_ids: List[int], status: str) -> None:
+        """Record where a background upload ended up for the rows showing it, and commit."""
+        self.execute(conn, f'UPDATE {self.table} SET image_status = %s WHERE id = ANY(%s)', (status, list(row_ids)),
+                     commit=True)
+
+
+class MarketQueries(ImageRowQueries):
+    table = 'market_items'
+
+    _SEARCH_SQL = '''SELECT market_items.id, market_items.title, market_items.brand, market_items.price,
+                            market_items.image, market_items.image_status, market_items.is_sold,
+                            market_items.row_version, {seller_display},
+                            ts_rank(market_items.search_vector, q.tsq){rank} AS rank
+                     FROM market_items
+                     LEFT JOIN users ON market_items.user_id = users.id,
+                          websearch_to_tsquery('english', %(q)s) AS q(tsq)
+                     WHERE market_items.is_sold = 0
+                       AND (market_items.search_vector @@ q.tsq{match})
+                     ORDER BY rank DESC, market_items.id DESC
+                     LIMIT %(limit)s OFFSET %(offset)s'''
+
+    def __init__(self, execute: Execute, trigram: Optional[Callable[[Any], bool]] = None):
+        super().__init__(execute)
+        self.trigram = trigram
+
+    def page(self, conn, before: Cursor, limit: int, after: Optional[int] = None,
+             columns: str = 'market_items.*', sort: str = 'newest',
+             min_price: Optional[Decimal] = None, max_price: Optional[Decimal] = None) -> List[Row]:
+        """Unsold listings in ``sort`` order after the ``before`` cursor (keyset pagination).
+
+        ``after`` (newest only) keeps ids above it instead. Price sorts and
+        price bounds leave out listings whose price couldn't be parsed.
+        """
+        order, seek = MARKET_SORTS[sort]
+        where = 'market_items.is_sold = 0'
+        params = []
+        if sort != 'newest' or min_price is not None or max_price is not None:
+            where += ' AND market_items.price_value IS NOT NULL'
+        if min_price is not None:
+            where += ' AND market_items.price_value >= %s'
+            params.append(min_price)
+        if max_price is not None:
+            where += ' AND market_items.price_value <= %s'
+            params.append(max_price)
+        if before is not None:
+            where += ' AND ' + seek
+            params.extend(before if isinstance(before, tuple) else (before,))
+        if after is not None:
+            where += ' AND market_items.id > %s'
+            params.append(after)
+        params.append(limit)
+        return self.execute(conn, f'''SELECT {columns}, {SELLER_DISPLAY}
+                                      FROM market_items
+                                      LEFT JOIN users ON market_items.user_id = users.id
+                                      WHERE {where}
+                                      ORDER BY {order}
+                                      LIMIT %s''', tuple(params), fetchall=True) or []
+
+    def detail(self, conn, item_id: int, columns: str = 'market_items.*') -> Optional[Row]:
+        return self.execute(conn, f'''SELECT {columns}, {SELLER_DISPLAY}
+                                      FROM market_items
+                                      LEFT JOIN users ON market_items.user_id = users.id
+                                      WHERE market_items.id = %s''', (item_id,), fetchone=True)
+
+    def get(self, conn, item_id: int) -> Optional[Row]:
+        return self.execute(conn, 'SELECT * FROM market_items WHERE id = %s', (item_id,), fetchone=True)
+
+    def for_seller(self, conn, user_id: int, limit: int) -> List[Row]:
+        """A seller's newest ``limit`` unsold listings (an index range scan on market_items_seller_unsold_idx)."""
+        return self.execute(conn, f'''SELECT market_items.*, {SELLER_DISPLAY}
+                                      FROM market_items
+                                      LEFT JOIN users ON market_items.user_id = users.id
+                                      WHERE market_items.user_id = %s AND market_items.is_sold = 0
+                                      ORDER BY market_items.id DESC
+                                      LIMIT %s''',
+                            (user_id, limit), fetchall=True) or []
+
+    def for_owner(self, conn, user_id: int) -> List[Row]:
+        """Everything a seller has listed, sold or not, for their dashboard."""
+        return self.execute(conn, 'SELECT * FROM market_items WHERE user_id = %s ORDER BY id DESC',
+                            (user_id,), fetchall=True) or []
+
+    def for_admin(self, conn) -> Iterator[Row]:
+        """Every listing with its seller, newest first, streamed from a server-side cursor."""
+        return self.execute(conn, '''SELECT market_items.id, market_items.title, market_items.brand, market_items.price,
+                                            market_items.image, market_items.image_status, market_items.is_sold,
+                                            market_items.user_id, users.legal_name AS legal_name,
+                                     COALESCE(users.display_name, market_items.seller_brand, users.email, 'Unknown') AS user_display
+                                     FROM market_items LEFT JOIN users ON market_items.user_id = users.id
+                                     ORDER BY market_items.id DESC''', stream=True)
+
+    def create(self, conn, title: str, brand: str, price: str, whatsapp: str, image: str,
+               seller_brand: Optional[str], user_id: Optional[int], image_status: str = 'ready') -> Optional[int]:
+        """Insert a listing without committing; returns the new id."""
+        row = self.execute(conn, '''INSERT INTO market_items (title, brand, price, price_value, whatsapp, image,
+                                                              seller_brand, user_id, image_status)
+                                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING id''',
+                           (title, brand, price, parse_price(price), whatsapp, image, seller_brand, user_id,
+                            image_status), fetchone=True)
+        return row['id'] if row else None
+
+    def create_many(self, conn, listings: List[Row], page_size: int = 100) -> Optional[List[int]]:
+        """Insert listings (dicts of create()'s arguments) without committing; returns their ids in order.
+
+        Sends one multi-row INSERT per ``page_size`` listings, as psycopg2's
+        execute_values does. Returns None if any page failed, in which case
+        the whole transaction has been rolled back.
+        """
+        ids = []
+        for start in range(0, len(listings), page_size):
+            page = listings[start:start + page_size]
+            values = ', '.join(['(%s,%s,%s,%s,%s,%s,%s,%s,%s)'] * len(page))
+            params = tuple(v for item in page for v in (
+                item['title'], item['brand'], item['price'], parse_price(item['price']), item['whatsapp'],
+                item['image'], item['seller_brand'], item['user_id'], item.get('image_status', 'ready')))
+            rows = self.execute(conn, f'''INSERT INTO market_items (title, brand, price, price_value, whatsapp, image,
+                                                                   seller_brand, user_id, image_status)
+                                          VALUES {values} RETURNING id''', params, fetchall=True)
+            if rows is None:
+                return None
+            # Ids come from one sequence in VALUES order, whatever order RETURNING lists them in
+            ids.extend(sorted(row['id'] for row in rows))
+        return ids
+
+    def mark_sold(self, conn, item_id: int) -> bool:
+        """Mark a listing sold without committing."""
+        return self.execute(conn, 'UPDATE market_items SET is_sold = 1 WHERE id = %s', (item_id,)) is not None
+
+    def delete_many(self, conn, item_ids: List[int]) -> List[Row]:
+        """Delete listings without committing; returns {'id', 'image'} for each one that existed."""
+        return self.execute(conn, 'DELETE FROM market_items WHERE id = ANY(%s) RETURNING id, image',
+                            (list(item_ids),), fetchall=True) or []
+
+    def search(self, conn, query: str, limit: int, offset: int) -> List[Row]:
+        """Ranked full-text (and, with pg_trgm, fuzzy title) matches among unsold listings."""
+        trigram = self.trigram(conn) if self.trigram else False
+        sql = self._SEARCH_SQL.format(
+            seller_display=SELLER_DISPLAY,
+            rank=' + similarity(market_items.title, %(q)s)' if trigram else '',
+            match=' OR market_items.title %% %(q)s' if trigram else '')
+        return self.execute(conn, sql, {'q': query, 'limit': limit, 'offset': offset}, fetchall=True) or []
+
+
+class LostQueries(ImageRowQueries):
+    table = 'lost_items'
+
+    _SEARCH_SQL = '''SELECT lost_items.id, lost_items.title, lost_items.description, lost_items.location,
+                            lost_items.custody, lost_items.image, lost_items.image_status,
+                            ts_rank(lost_items.search_vector, q.tsq){rank} AS rank
+                     FROM lost_items, websearch_to_tsquery('english', %(q)s) AS q(tsq)
+                     WHERE lost_items.is_recovered = 0
+                       AND (lost_items.search_vector @@ q.tsq{match})
+                     ORDER BY rank DESC, lost_items.id DESC
+                     LIMIT %(limit)s OFFSET %(offset)s'''
+
+    def __init__(self, execute: Execute, trigram: Optional[Callable[[Any], bool]] = None):
+        super().__init__(execute)
+        self.trigram = trigram
+
+    def latest(self, conn, limit: int) -> List[Row]:
+        """The newest open reports; recovered ones are no longer shown (their images are released)."""
+        return self.execute(conn, 'SELECT * FROM lost_items WHERE is_recovered = 0 ORDER BY id DESC LIMIT %s',
+                            (limit,), fetchall=True) or []
+
+    def active(self, conn) -> List[Row]:
+        return self.execute(conn, 'SELECT * FROM lost_items WHERE is_recovered = 0 ORDER BY id DESC',
+                            fetchall=True) or []
+
+    def page(self, conn, before: Optional[int], limit: int, columns: str = '*') -> List[Row]:
+        """Open reports newest first, with ids below ``before`` if given (keyset pagination)."""
+        where = 'is_recovered = 0'
+        params = []
+        if before is not None:
+            where += ' AND id < %s'
+            params.append(before)
+        params.append(limit)
+        return self.execute(conn, f'SELECT {columns} FROM lost_items WHERE {where} ORDER BY id DESC LIMIT %s',
+                            tuple(params), fetchall=True) or []
+
+    def open_since(self, conn, after_id: int) -> List[Row]:
+        """Text columns of open reports with ids above ``after_id``, oldest first (for the claim matcher)."""
+        return self.execute(conn, '''SELECT id, title, description, location FROM lost_items
+                                     WHERE is_recovered = 0 AND id > %s ORDER BY id''',
+                            (after_id,), fetchall=True) or []
+
+    def open_by_ids(self, conn, item_ids: List[int]) -> List[Row]:
+        """The reports among ``item_ids`` that are still open."""
+        return self.execute(conn, '''SELECT id, title, location, custody FROM lost_items
+                                     WHERE id = ANY(%s) AND is_recovered = 0''',
+                            (list(item_ids),), fetchall=True) or []
+
+    def create(self, conn, title: str, description: str, location: str, custody: str, image: Optional[str],
+               image_status: str = 'ready') -> Optional[int]:
+        """Insert a report without committing; returns the new id."""
+        row = self.execute(conn, '''INSERT INTO lost_items (title, description, location, custody, image,
+                                                            is_recovered, image_status)
+                                    VALUES (%s,%s,%s,%s,%s, 0, %s) RETURNING id''',
+                           (title, description, location, custody, image, image_status), fetchone=True)
+        return row['id'] if row else None
+
+    def mark_recovered_many(self, conn, item_ids: List[int]) -> Optional[List[Row]]:
+        """Mark reports recovered and clear their images, without committing.
+
+        Returns {'id', 'image'} (the image it had) for each one that wasn't
+        already recovered; the caller queues those images for deletion.
+        Returns None if a statement failed (and the transaction was rolled back).
+        """
+        rows = self.execute(conn, 'UPDATE lost_items SET is_recovered = 1 WHERE id = ANY(%s) AND is_recovered = 0 '
+                                  'RETURNING id, image', (list(item_ids),), fetchall=True)
+        if rows is None:
+            return None
+        released = [row['id'] for row in rows if row['image']]
+        if released and self.execute(conn, 'UPDATE lost_items SET image = NULL WHERE id = ANY(%s)',
+                                     (released,)) is None:
+            return None
+        return rows
+
+    def search(self, conn, query: str, limit: int, offset: int) -> List[Row]:
+        """Ranked full-text (and, with pg_trgm, fuzzy title) matches among open reports."""
+        trigram = self.trigram(conn) if self.trigram else False
+        sql = self._SEARCH_SQL.format(
+            rank=' + similarity(lost_items.title, %(q)s)' if trigram else '',
+            match=' OR lost_items.title %% %(q)s' if trigram else '')
+        return self.execute(conn, sql, {'q': query, 'limit': limit, 'offset': offset}, fetchall=True) or []
+
+
+class ClaimQueries(Queries):
+    def create(self, conn, item_id: int, requester_email: str, proof_details: str) -> None:
+        self.execute(conn, 'INSERT INTO claim_requests (item_id, requester_email, proof_details) VALUES (%s,%s,%s)',
+                     (item_id, requester_email, proof_details), commit=True)
+
+    def pending(self, conn, limit: int) -> List[Row]:
+        """Newest pending claims with the lost item's title and image."""
+        return self.execute(conn, '''SELECT claim_requests.*, lost_items.title AS item_title,
+                                            lost_items.image AS item_image
+                                     FROM claim_requests
+                                     JOIN lost_items ON claim_requests.item_id = lost_items.id
+                                     WHERE claim_requests.status = 'pending'
+                                     ORDER BY claim_requests.created_at DESC
+                                     LIMIT %s''', (limit,), fetchall=True) or []
+
+    def approve_many(self, conn, claim_ids: List[int]) -> List[Row]:
+        """Approve claims without committing; returns {'item_id'} for each one that wasn't already approved."""
+        return self.execute(conn, '''UPDATE claim_requests SET status = 'approved', reviewed_at = CURRENT_TIMESTAMP
+                                     WHERE id = ANY(%s) AND status != 'approved' RETURNING item_id''',
+                            (list(claim_ids),), fetchall=True) or []
+
+    def reject_many(self, conn, claim_ids: List[int]) -> int:
+        """Reject pending claims and commit; returns how many were rejected."""
+        rows = self.execute(conn, '''UPDATE claim_requests SET status = 'rejected', reviewed_at = CURRENT_TIMESTAMP
+                                     WHERE id = ANY(%s) AND status = 'pending' RETURNING id''',
+                            (list(claim_ids),), commit=True, fetchall=True)
+        return len(rows or [])
+
+
+class StorageQueries(Queries):
+    """The storage_deletions queue: image names (column values) whose objects should leave the bucket."""
+
+    _DUE_SQL = '''SELECT name, attempts FROM storage_deletions WHERE next_attempt_at <= %s
+                  ORDER BY next_attempt_at LIMIT %s FOR UPDATE SKIP LOCKED'''
+
+    def enqueue(self, conn, names: List[str], commit: bool = False) -> Optional[int]:
+        """Queue image names for deletion (already-queued ones are skipped); returns how many were new.
+
+        Returns None if the statement failed (and the transaction was rolled back).
+        """
+        names = sorted(set(names))
+        if not names:
+            return 0
+        values = ', '.join(['(%s)'] * len(names))
+        rows = self.execute(conn, f'''INSERT INTO storage_deletions (name) VALUES {values}
+                                      ON CONFLICT (name) DO NOTHING RETURNING name''', tuple(names),
+                            commit=commit, fetchall=True)
+        return None if rows is None else len(rows)
+
+    def due(self, conn, now: float, limit: int) -> List[Row]:
+        """Up to ``limit`` entries ready for an attempt, locked until the caller commits."""
+        return self.execute(conn, self._DUE_SQL, (int(now), limit), fetchall=True) or []
+
+    def referenced(self, conn, names: List[str]) -> set:
+        """The subset of ``names`` some market or lost item still points at."""
+        if not names:
+            return set()
+        rows = self.execute(conn, '''SELECT image FROM market_items WHERE image = ANY(%s)
+                                     UNION
+                                     SELECT image FROM lost_items WHERE image = ANY(%s)''',
+                            (list(names), list(names)), fetchall=True)
+        return {row['image'] for row in rows or []}
+
+    def done(self, conn, names: List[str]) -> None:
+        self.execute(conn, 'DELETE FROM storage_deletions WHERE name = ANY(%s)', (list(names),))
+
+    def retry(self, conn, names: List[str], next_attempt_at: float, error: str) -> None:
+        self.execute(conn, '''UPDATE storage_deletions
+                              SET attempts = attempts + 1, next_attempt_at = %s, last_error = %s
+                              WHERE name = ANY(%s)''', (int(next_attempt_at), error[:500], list(names)))
+
+    def claim_sweep(self, conn, now: float, interval: float) -> bool:
+        """Take the orphan sweep if nobody has run it in the last ``interval`` seconds, and commit."""
+        row = self.execute(conn, '''INSERT INTO site_stats (name, value) VALUES ('storage_swept_at', %s)
+                                    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value,
+                                                                     updated_at = CURRENT_TIMESTAMP
+                                    WHERE site_stats.value <= %s
+                                    RETURNING name''', (int(now), int(now - interval)), commit=True, fetchone=True)
+        return row is not None
+
+
+def phash_bands(phash: int) -> List[int]:
+    """The four 16-bit bands of a (signed 64-bit) pHash, as PHASH_BAND_SQL computes them."""
+    return [(phash >> shift) & 0xFFFF for shift in (48, 32, 16, 0)]
+
+
+def phash_distance(a: int, b: int) -> int:
+    """Hamming distance between two pHashes."""
+    return bin((a ^ b) & 0xFFFF_FFFF_FFFF_FFFF).count('1')
+
+
+class ImageQueries(Queries):
+    """The images table: one row per stored image (content-hash name) with its pHash and use count.
+
+    ``refcount`` is how many market and lost rows point at the image and
+    ``status`` becomes 'ready' once its objects are in the bucket, so an
+    upload of the same bytes can reuse them without going near storage.
+    """
+
+    def status(self, conn, name: str) -> Optional[str]:
+        row = self.execute(conn, 'SELECT status FROM images WHERE name = %s', (name,), fetchone=True)
+        return row['status'] if row else None
+
+    def acquire(self, conn, name: str, phash: Optional[int]) -> str:
+        """Count one more row using ``name``, inserting it as 'pending' if new, without committing.
+
+        Returns the image's status. Waits if the storage janitor is deleting
+        the image (see forget); the fresh row it then inserts is 'pending'.
+        """
+        row = self.execute(conn, '''INSERT INTO images (name, phash, refcount) VALUES (%s, %s, 1)
+                                    ON CONFLICT (name) DO UPDATE SET refcount = images.refcount + 1,
+                                                                     phash = COALESCE(images.phash, EXCLUDED.phash)
+                                    RETURNING status''', (name, phash), fetchone=True)
+        return row['status'] if row else 'pending'
+
+    def acquire_many(self, conn, uses: Dict[str, Tuple[Optional[int], int]]) -> Optional[Dict[str, str]]:
+        """acquire() for many images in one statement: ``uses`` maps name -> (phash, rows using it).
+
+        Returns {name: status}, or None if the statement failed (and the
+        transaction was rolled back).
+        """
+        if not uses:
+            return {}
+        names = sorted(uses)  # a fixed lock order, so two imports can't deadlock
+        values = ', '.join(['(%s, %s, %s)'] * len(names))
+        rows = self.execute(conn, f'''INSERT INTO images (name, phash, refcount) VALUES {values}
+                                      ON CONFLICT (name) DO UPDATE SET refcount = images.refcount + EXCLUDED.refcount,
+                                                                       phash = COALESCE(images.phash, EXCLUDED.phash)
+                                      RETURNING name, status''',
+                            tuple(v for name in names for v in (name, uses[name][0], uses[name][1])), fetchall=True)
+        if rows is None:
+            return None
+        return {row['name']: row['status'] for row in rows}
+
+    def set_phash(self, conn, name: str, phash: int) -> None:
+        self.execute(conn, 'UPDATE images SET phash = %s WHERE name = %s', (phash, name))
+
+    def mark_ready(self, conn, name: str) -> None:
+        """Record that the image's objects are in the bucket, without committing."""
+        self.execute(conn, "UPDATE images SET status = 'ready' WHERE name = %s", (name,))
+
+    def release(self, conn, names: List[str]) -> bool:
+        """Count one row fewer per occurrence in ``names``, without committing.
+
+        Returns False if a statement failed (and the transaction was rolled back).
+        """
+        by_count: Dict[int, List[str]] = {}
+        for name, count in Counter(names).items():
+            by_count.setdefault(count, []).append(name)
+        for count, group in by_count.items():
+            if self.execute(conn, 'UPDATE images SET refcount = refcount - %s WHERE name = ANY(%s)',
+                            (count, group)) is None:
+                return False
+        return True
+
+    def forget(self, conn, names: List[str]) -> set:
+        """Delete the unused rows among ``names``, without committing; returns the names still in use.
+
+        The deleted rows stay locked until the caller commits, so an upload of
+        the same bytes waits until the objects are gone and then uploads anew.
+        """
+        if not names:
+            return set()
+        self.execute(conn, 'DELETE FROM images WHERE name = ANY(%s) AND refcount <= 0', (list(names),))
+        rows = self.execute(conn, 'SELECT name FROM images WHERE name = ANY(%s)', (list(names),), fetchall=True)
+        return {row['name'] for row in rows or []}
+
+    def phash(self, conn, name: str) -> Optional[int]:
+        row = self.execute(conn, 'SELECT phash FROM images WHERE name = %s', (name,), fetchone=True)
+        return row['phash'] if row else None
+
+    def similar(self, conn, phash: int, max_distance: int, limit: int) -> List[Row]:
+        """Images whose pHash is within ``max_distance`` bits, nearest first, as {'name', 'phash', 'distance'}.
+
+        Any hash within MAX_PHASH_DISTANCE bits matches one of the four
+        bands exactly or with one bit flipped, so four indexed IN lists find
+        every candidate without a scan.
+        """
+        max_distance = min(max_distance, MAX_PHASH_DISTANCE)
+        probes = [[band] + [band ^ (1 << bit) for bit in range(16)] for band in phash_bands(phash)]
+        where = ' OR '.join(f'{expr} = ANY(%s)' for expr in PHASH_BAND_SQL)
+        rows = self.execute(conn, f'SELECT name, phash FROM images WHERE {where}', tuple(probes),
+                            fetchall=True) or []
+        matches = []
+        for row in rows:
+            distance = phash_distance(phash, row['phash'])
+            if distance <= max_distance:
+                matches.append(dict(row, distance=distance))
+        matches.sort(key=lambda row: (row['distance'], row['name']))
+        return matches[:limit]
+
+    def used_by(self, conn, names: List[str]) -> List[Row]:
+        """Market listings and lost reports showing any of ``names``.
+
+        Rows have kind ('market' or 'lost'), id, title, image, image_status,
+        closed (sold or recovered) and detail (the seller, or where it was found).
+        """
+        if not names:
+            return []
+        return self.execute(conn, '''SELECT 'market' AS kind, market_items.id, market_items.title, market_items.image,
+                                            market_items.image_status, market_items.is_sold AS closed,
+                                            COALESCE(users.display_name, market_items.seller_brand, users.email,
+                                                     'Campus Seller') AS detail
+                                     FROM market_items LEFT JOIN users ON users.id = market_items.user_id
+                                     WHERE market_items.image = ANY(%s)
+                                     UNION ALL
+                                     SELECT 'lost', id, title, image, image_status, is_recovered, location
+                                     FROM lost_items WHERE image = ANY(%s)''',
+                            (list(names), list(names)), fetchall=True) or []
+
+
+class StatsQueries(Queries):
+    """site_stats counters and the claim_approvals_daily buckets."""
+
+    def __init__(self, execute: Execute, lock_key: int):
+        super().__init__(execute)
+        self.lock_key = lock_key
+
+    def bump(self, conn, deltas: Dict[str, int], commit: bool = False) -> bool:
+        """Add deltas to counters; returns False if that failed (and the transaction was rolled back)."""
+        rows = [(name, delta) for name, delta in deltas.items() if delta]
+        if not rows:
+            if commit:
+                conn.commit()
+            return True
+        values = ', '.join(['(%s, %s)'] * len(rows))
+        return self.execute(conn, f'''INSERT INTO site_stats (name, value) VALUES {values}
+                                      ON CONFLICT (name) DO UPDATE
+                                      SET value = site_stats.value + EXCLUDED.value, updated_at = CURRENT_TIMESTAMP''',
+                            tuple(v for row in rows for v in row), commit=commit) is not None
+
+    def record_claim_approvals(self, conn, count: int) -> bool:
+        return self.execute(conn, '''INSERT INTO claim_approvals_daily (day, approvals) VALUES (CURRENT_DATE, %s)
+                                     ON CONFLICT (day) DO UPDATE
+                                     SET approvals = claim_approvals_daily.approvals + EXCLUDED.approvals''',
+                            (count,)) is not None
+
+    def value(self, conn, name: str) -> Optional[int]:
+        row = self.execute(conn, 'SELECT value FROM site_stats WHERE name = %s', (name,), fetchone=True)
+        return row['value'] if row else None
+
+    def all(self, conn) -> List[Row]:
+        """Every counter, plus recovered_week summed from the last seven daily buckets."""
+        return self.execute(conn, '''SELECT name, value FROM site_stats
+                                     UNION ALL
+                                     SELECT 'recovered_week', COALESCE(SUM(approvals), 0) FROM claim_approvals_daily
+                                     WHERE day > CURRENT_DATE - 7''', fetchall=True) or []
+
+    def catalog_state(self, conn) -> Optional[Row]:
+        """Newest listing id, catalog_version and its update time (epoch seconds)."""
+        return self.execute(conn, '''SELECT (SELECT COALESCE(MAX(id), 0) FROM market_items) AS max_id,
+                                            value AS version, EXTRACT(EPOCH FROM updated_at)::BIGINT AS updated_at
+                                     FROM site_stats WHERE name = %s''', ('catalog_version',), fetchone=True)
+
+    def _lock(self, cur) -> bool:
+        cur.execute('SELECT pg_try_advisory_xact_lock(%s)', (self.lock_key,))
+        return cur.fetchone()[0]
+
+    _RECONCILED_AT = 'EXTRACT(EPOCH FROM NOW())::BIGINT'
+    _REVIEW_DAY = 'COALESCE(reviewed_at, created_at)::date'
+
+    def reconcile(self, conn) -> bool:
+        """Recompute every counter from the real tables.
+
+        Only one process reconciles at a time; the others skip. Returns True
+        if this call did the work. Raises the driver's error on failure.
+        """
+        with conn.cursor() as cur:
+            if not self._lock(cur):
+                conn.rollback()
+                return False
+            cur.execute(f'''INSERT INTO site_stats (name, value)
+                            SELECT 'total_users', COUNT(*) FROM users
+                            UNION ALL SELECT 'market_listings', COUNT(*) FROM market_items
+                            UNION ALL SELECT 'active_reports', COUNT(*) FROM lost_items WHERE is_recovered = 0
+                            UNION ALL SELECT 'verified_returns', COUNT(*) FROM claim_requests WHERE status = 'approved'
+                            UNION ALL SELECT 'reconciled_at', {self._RECONCILED_AT}
+                            ON CONFLICT (name) DO UPDATE
+                            SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP''')
+            cur.execute('DELETE FROM claim_approvals_daily')
+            cur.execute(f'''INSERT INTO claim_approvals_daily (day, approvals)
+                            SELECT {self._REVIEW_DAY}, COUNT(*)
+                            FROM claim_requests WHERE status = 'approved'
+                            GROUP BY 1''')
+        conn.commit()
+        return True
+
+
+class PostgresRepository:
+    dialect = 'postgres'
+
+    def __init__(self, execute: Execute, stats_lock_key: int):
+        self.execute = execute
+        self._trigram = None
+        self.users = UserQueries(execute)
+        self.market = MarketQueries(execute, self.has_trigram)
+        self.lost = LostQueries(execute, self.has_trigram)
+        self.claims = ClaimQueries(execute)
+        self.images = ImageQueries(execute)
+        self.storage = StorageQueries(execute)
+        self.stats = StatsQueries(execute, stats_lock_key)
+
+    def has_trigram(self, conn) -> bool:
+        """Whether pg_trgm is installed; looked up once per process."""
+        if self._trigram is not None:
+            return self._trigram
+        row = self.execute(conn, "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS installed",
+                           fetchone=True)
+        if row is None:  # don't pin the fallback on a failed lookup
+            return False
+        self._trigram = bool(row['installed'])
+        return self._trigram
+
+    def image_rows(self, table: str) -> ImageRowQueries:
+        """The queries for a table that has image/image_status columns."""
+        return {'market_items': self.market, 'lost_items': self.lost}[table]
+
+    def explain(self, conn, sql: str, params: Any = ()) -> Optional[str]:
+        """The planner's plan for a statement, without running it (for the slow-query log).
+
+        Goes straight to the connection rather than through ``execute``. A
+        failed EXPLAIN must not abort the caller's transaction, so inside one
+        it runs under a savepoint; otherwise its own transaction is rolled back.
+        """
+        if not _EXPLAINABLE.match(sql):
+            return None
+        in_transaction = conn.info.transaction_status != 0  # TRANSACTION_STATUS_IDLE
+        with conn.cursor() as cur:
+            try:
+                if in_transaction:
+                    cur.execute('SAVEPOINT explain_plan')
+                cur.execute('EXPLAIN ' + sql, params)
+                plan = '\n'.join(row[0] for row in cur.fetchall())
+                if in_transaction:
+                    cur.execute('RELEASE SAVEPOINT explain_plan')
+                return plan
+            except Exception:
+                if in_transaction:
+                    cur.execute('ROLLBACK TO SAVEPOINT explain_plan')
+                raise
+            finally:
+                if not in_transaction:
+                    conn.rollback()
+
+
+# --- SQLite ---
+# Search falls back to LIKE on every word (ranked by where it matched): no
+# stemming or typo tolerance, but the same rows and shapes for local runs.
+
+def _like_terms(query: str) -> List[str]:
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return [f'%{word}%' for word in escaped.split()[:8]]
+
+
+def _like_search(columns: List[Tuple[str, float]], terms: List[str]) -> Tuple[str, str, List[str]]:
+    """(match SQL, rank SQL, params) requiring every term somewhere in ``columns``."""
+    match, rank, match_params, rank_params = [], [], [], []
+    for term in terms:
+        match.append('(' + ' OR '.join(f"{col} LIKE %s ESCAPE '\\'" for col, _ in columns) + ')')
+        match_params.extend([term] * len(columns))
+        for col, weight in columns:
+            rank.append(f"(CASE WHEN {col} LIKE %s ESCAPE '\\' THEN {weight} ELSE 0 END)")
+            rank_params.append(term)
+    return ' AND '.join(match) or '1 = 0', ' + '.join(rank) or '0', rank_params + match_params
+
+
+class SqliteMarketQueries(MarketQueries):
+    def search(self, conn, query: str, limit: int, offset: int) -> List[Row]:
+        match, rank, params = _like_search([('market_items.title', 1.0), ('market_items.brand', 0.4),
+                                            ('market_items.seller_brand', 0.2)], _like_terms(query))
+        return self.execute(conn, f'''SELECT market_items.id, market_items.title, market_items.brand,
+                                             market_items.price, market_items.image, market_items.image_status,
+                                             market_items.is_sold, market_items.row_version, {SELLER_DISPLAY},
+                                             {rank} AS rank
+                                      FROM market_items
+                                      LEFT JOIN users ON market_items.user_id = users.id
+                                      WHERE market_items.is_sold = 0 AND {match}
+                                      ORDER BY rank DESC, market_items.id DESC
+                                      LIMIT %s OFFSET %s''', tuple(params) + (limit, offset), fetchall=True) or []
+
+
+class SqliteLostQueries(LostQueries):
+    def search(self, conn, query: str, limit: int, offset: int) -> List[Row]:
+        match, rank, params = _like_search([('lost_items.title', 1.0), ('lost_items.description', 0.4),
+                                            ('lost_items.location', 0.2)], _like_terms(query))
+        return self.execute(conn, f'''SELECT lost_items.id, lost_items.title, lost_items.description,
+                                             lost_items.location, lost_items.custody, lost_items.image,
+                                             lost_items.image_status, {rank} AS rank
+                                      FROM lost_items
+                                      WHERE lost_items.is_recovered = 0 AND {match}
+                                      ORDER BY rank DESC, lost_items.id DESC
+                                      LIMIT %s OFFSET %s''', tuple(params) + (limit, offset), fetchall=True) or []
+
+
+class SqliteStorageQueries(StorageQueries):
+    # No row locks in SQLite; two workers may pick the same entries, and
+    # removing an object twice is harmless.
+    _DUE_SQL = 'SELECT name, attempts FROM storage_deletions WHERE next_attempt_at <= %s ORDER BY next_attempt_at LIMIT %s'
+
+
+class SqliteStatsQueries(StatsQueries):
+    _RECONCILED_AT = "CAST(strftime('%s', 'now') AS INTEGER)"
+    _REVIEW_DAY = 'date(COALESCE(reviewed_at, created_at))'
+
+    def _lock(self, cur) -> bool:
+        # SQLite already serializes writers, and the reconcile is one transaction.
+        return True
+
+    def all(self, conn) -> List[Row]:
+        return self.execute(conn, '''SELECT name, value FROM site_stats
+                                     UNION ALL
+                                     SELECT 'recovered_week', COALESCE(SUM(approvals), 0) FROM claim_approvals_daily
+                                     WHERE day > date('now', '-7 day')''', fetchall=True) or []
+
+    def catalog_state(self, conn) -> Optional[Row]:
+        return self.execute(conn, '''SELECT (SELECT COALESCE(MAX(id), 0) FROM market_items) AS max_id,
+                                            value AS version, CAST(strftime('%%s', updated_at) AS INTEGER) AS updated_at
+                                     FROM site_stats WHERE name = %s''', ('catalog_version',), fetchone=True)
+
+
+class SqliteRepository(PostgresRepository):
+    dialect = 'sqlite'
+
+    def __init__(self, execute: Execute, stats_lock_key: int):
+        self.execute = execute
+        self.users = UserQueries(execute)
+        self.market = SqliteMarketQueries(execute)
+        self.lost = SqliteLostQueries(execute)
+        self.claims = ClaimQueries(execute)
+        self.images = ImageQueries(execute)
+        self.storage = SqliteStorageQueries(execute)
+        self.stats = SqliteStatsQueries(execute, stats_lock_key)
+
+    def has_trigram(self, conn) -> bool:
+        return False
+
+    def explain(self, conn, sql: str, params: Any = ()) -> Optional[str]:
+        if not _EXPLAINABLE.match(sql):
+            return None
+        with conn.cursor() as cur:
+            cur.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(row[-1] for row in cur.fetchall())
@@ -0,0 +1,422 @@
+"""SQLite stand-in for Postgres, so Hustl can run and be benchmarked offline.
+
+Set ``DATABASE_URL=sqlite:///hustl.db`` (a file, shared by every worker) or
+``DATABASE_URL=sqlite://`` (in memory, private to each process). The pool
+and connections here mimic the parts of psycopg2 and app.ConnectionPool the
+app uses: ``cursor(cursor_factory=...)`` returns dict rows, ``%s`` and
+``%(name)s`` placeholders are accepted, and getconn/putconn/stats behave the
+same. The schema is created on first connect; it mirrors the Postgres
+migrations minus full-text search columns (see repository.SqliteRepository).
+"""
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+from repository import parse_price
+
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))  # seconds to wait on another writer
+
+sqlite3.register_converter('TIMESTAMP', lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter('DATE', lambda b: date.fromisoformat(b.decode()))
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(' '))
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+# market_items.price_value comes back as Decimal, as from Postgres' NUMERIC(12, 2)
+sqlite3.register_converter('NUMERIC', lambda b: Decimal(b.decode()).quantize(Decimal('0.01')))
+sqlite3.register_adapter(Decimal, float)
+
+
+def _price_value(text):
+    value = parse_price(text)
+    return None if value is None else float(value)
+
+
+def add_price_value(conn):
+    """Postgres migration 14: the numeric price column, backfilled, and its index."""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(market_items)')}
+    if 'price_value' not in columns:
+        conn.execute('ALTER TABLE market_items ADD COLUMN price_value NUMERIC')
+    conn.create_function('parse_price', 1, _price_value, deterministic=True)
+    conn.execute('UPDATE market_items SET price_value = parse_price(price) WHERE price_value IS NULL')
+    conn.execute('CREATE INDEX IF NOT EXISTS market_items_is_sold_price_value_id_idx '
+                 'ON market_items (is_sold, price_value, id)')
+
+# Mirrors app.MIGRATIONS; append a step here whenever a Postgres migration
+# changes a table the app reads or writes.
+SQLITE_MIGRATIONS = [
+    (1, 'schema (Postgres migrations 1-10)', '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE, password_hash TEXT, reg_number TEXT, whatsapp TEXT,
+            display_name TEXT, legal_name TEXT, user_type TEXT,
+            id_proof_link TEXT, social_link TEXT,
+            role TEXT DEFAULT 'pending_verification',
+            is_verified INTEGER DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS market_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT, brand TEXT, price TEXT, whatsapp TEXT, image TEXT,
+            is_sold INTEGER DEFAULT 0,
+            seller_brand TEXT, user_id INTEGER,
+            image_status TEXT NOT NULL DEFAULT 'ready',
+            row_version INTEGER NOT NULL DEFAULT 1);
+        CREATE TABLE IF NOT EXISTS lost_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT, description TEXT, location TEXT, custody TEXT,
+            image TEXT, is_recovered INTEGER DEFAULT 0,
+            image_status TEXT NOT NULL DEFAULT 'ready');
+        CREATE TABLE IF NOT EXISTS claim_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER REFERENCES lost_items(id) ON DELETE CASCADE,
+            requester_email TEXT NOT NULL,
+            proof_details TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reviewed_at TIMESTAMP);
+        CREATE TABLE IF NOT EXISTS site_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE IF NOT EXISTS claim_approvals_daily (
+            day DATE PRIMARY KEY,
+            approvals INTEGER NOT NULL DEFAULT 0);
+        CREATE INDEX IF NOT EXISTS market_items_is_sold_id_idx ON market_items (is_sold, id DESC);
+        CREATE INDEX IF NOT EXISTS market_items_user_id_idx ON market_items (user_id);
+        CREATE INDEX IF NOT EXISTS lost_items_is_recovered_id_idx ON lost_items (is_recovered, id DESC);
+        CREATE INDEX IF NOT EXISTS claim_requests_status_created_at_idx ON claim_requests (status, created_at);
+        CREATE INDEX IF NOT EXISTS users_is_verified_idx ON users (is_verified);
+        CREATE TRIGGER IF NOT EXISTS market_items_row_version AFTER UPDATE ON market_items
+            FOR EACH ROW WHEN NEW.row_version = OLD.row_version
+            BEGIN
+                UPDATE market_items SET row_version = OLD.row_version + 1 WHERE id = NEW.id;
+            END;
+        INSERT OR IGNORE INTO site_stats (name, value) VALUES ('catalog_version', 0);
+    '''),
+    (2, 'storage_deletions queue and image indexes (Postgres migration 11)', '''
+        CREATE TABLE IF NOT EXISTS storage_deletions (
+            name TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE INDEX IF NOT EXISTS storage_deletions_next_attempt_at_idx ON storage_deletions (next_attempt_at);
+        CREATE INDEX IF NOT EXISTS market_items_image_idx ON market_items (image);
+        CREATE INDEX IF NOT EXISTS lost_items_image_idx ON lost_items (image);
+    '''),
+    (3, 'index unsold market_items per seller (Postgres migration 13)',
+     'CREATE INDEX IF NOT EXISTS market_items_seller_unsold_idx ON market_items (user_id, id DESC) WHERE is_sold = 0'),
+    (4, 'numeric market_items.price_value (Postgres migration 14)', add_price_value),
+    (5, 'refcounted images with perceptual hash (Postgres migration 15)', '''
+        CREATE TABLE IF NOT EXISTS images (
+            name TEXT PRIMARY KEY,
+            phash INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        INSERT INTO images (name, refcount, status)
+        SELECT image, COUNT(*), CASE WHEN MAX(image_status = 'ready') = 1 THEN 'ready' ELSE 'pending' END
+        FROM (SELECT image, image_status FROM market_items
+              UNION ALL
+              SELECT image, image_status FROM lost_items)
+        WHERE image IS NOT NULL AND image <> 'default.png'
+        GROUP BY image
+        ON CONFLICT (name) DO NOTHING;
+        CREATE INDEX IF NOT EXISTS images_phash_band0_idx ON images (((phash >> 48) & 65535));
+        CREATE INDEX IF NOT EXISTS images_phash_band1_idx ON images (((phash >> 32) & 65535));
+        CREATE INDEX IF NOT EXISTS images_phash_band2_idx ON images (((phash >> 16) & 65535));
+        CREATE INDEX IF NOT EXISTS images_phash_band3_idx ON images ((phash & 65535));
+    '''),
+]
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+_RETURNING = re.compile(r'\bRETURNING\b', re.IGNORECASE)
+_ANY_PLACEHOLDER = re.compile(r'=\s*ANY\(%s\)|%s|%%', re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def translate_sql(sql):
+    """Rewrite psycopg2-style placeholders (%s, %(name)s, %%) for sqlite3."""
+    def replace(match):
+        if match.group(1):
+            return ':' + match.group(1)
+        return '?' if match.group(0) == '%s' else '%'
+    return _PLACEHOLDER.sub(replace, sql)
+
+
+def expand_any(sql, params):
+    """Rewrite ``= ANY(%s)`` with a list parameter as ``IN (%s, ...)``.
+
+    psycopg2 sends a Python list as an array; SQLite has no arrays. An empty
+    list becomes ``IN (NULL)``, which matches nothing, like ``= ANY('{}')``.
+    """
+    params = iter(params)
+    flat = []
+
+    def replace(match):
+        token = match.group(0)
+        if token == '%%':
+            return token
+        value = next(params)
+        if token == '%s':
+            flat.append(value)
+            return token
+        flat.extend(value)
+        return 'IN (' + (', '.join(['%s'] * len(value)) or 'NULL') + ')'
+    return _ANY_PLACEHOLDER.sub(replace, sql), flat
+
+
+def sqlite_path(url):
+    """File path for a sqlite:// URL; ':memory:' for sqlite:// or sqlite:///:memory:."""
+    path = url.split('://', 1)[1]
+    if path in ('', '/', '/:memory:'):
+        return ':memory:'
+    return path[1:] if path.startswith('/') else path
+
+
+def _dict_row(cursor, row):
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+class SqliteCursor:
+    """psycopg2-flavoured wrapper around a sqlite3 cursor."""
+
+    def __init__(self, cursor, dict_rows):
+        self._cursor = cursor
+        self._buffered = None
+        if dict_rows:
+            cursor.row_factory = _dict_row
+
+    def execute(self, sql, params=None):
+        # Like psycopg2, placeholders are only interpreted when params are given.
+        if params is None:
+            self._cursor.execute(sql)
+        else:
+            if 'ANY(' in sql and not isinstance(params, dict):
+                sql, params = expand_any(sql, params)
+            self._cursor.execute(translate_sql(sql), params)
+        # SQLite can't commit while a RETURNING statement still has rows to
+        # step through (psycopg2 has them all already), so read them now.
+        self._buffered = iter(self._cursor.fetchall()) if _RETURNING.search(sql) else None
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._buffered = None
+        self._cursor.executemany(translate_sql(sql), seq_of_params)
+
+    def fetchone(self):
+        if self._buffered is not None:
+            return next(self._buffered, None)
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        size = size or self._cursor.arraysize
+        if self._buffered is not None:
+            return list(itertools.islice(self._buffered, size))
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        if self._buffered is not None:
+            return list(self._buffered)
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return self._buffered if self._buffered is not None else iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SqliteConnection:
+    """A sqlite3 connection exposing the psycopg2 connection API the app relies on."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.closed = 0
+
+    def cursor(self, cursor_factory=None, name=None):
+        return SqliteCursor(self._raw.cursor(), dict_rows=cursor_factory is not None)
+
+    @property
+    def autocommit(self):
+        return self._raw.isolation_level is None
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self._raw.isolation_level = None if value else ''
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+            self.closed = 1
+
+
+def run_migrations(conn):
+    """Apply pending SQLITE_MIGRATIONS on a raw sqlite3 connection; returns the versions applied."""
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+                 'applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    conn.commit()
+    applied = {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+    applied_now = []
+    for version, name, sql in SQLITE_MIGRATIONS:
+        if version in applied:
+            continue
+        # executescript commits first and runs its own statements; every step
+        # is idempotent, so two processes racing here is harmless. Steps that
+        # need Python (a column that may already exist, a backfill) are functions.
+        if callable(sql):
+            sql(conn)
+        else:
+            conn.executescript(sql)
+        conn.execute('INSERT OR IGNORE INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+        conn.commit()
+        applied_now.append(version)
+        logging.info("Applied SQLite migration %s (%s)", version, name)
+    return applied_now
+
+
+class SqlitePool:
+    """Per-process pool of SQLite connections with app.ConnectionPool's interface.
+
+    A file database is opened in WAL mode so workers read concurrently while
+    writes queue on the busy timeout. An in-memory database lives in a single
+    connection, so the pool hands out one at a time.
+    """
+
+    def __init__(self, path, maxconn=5, timeout=10, timeout_error=TimeoutError):
+        self.path = path
+        self.memory = path == ':memory:'
+        self.maxconn = 1 if self.memory else maxconn
+        self.timeout = timeout
+        self.timeout_error = timeout_error
+        self._cond = threading.Condition()
+        self._reset(os.getpid())
+
+    def _reset(self, pid):
+        self._pid = pid
+        self._idle = []
+        self._in_use = set()
+        self._size = 0
+        self._migrated = False
+        self._applied = []
+        self._counters = dict(borrows=0, created=0, discarded=0, waits=0, timeouts=0)
+
+    def _check_pid(self):
+        # Caller holds self._cond. Connections must not cross a fork.
+        if self._pid != os.getpid():
+            self._reset(os.getpid())
+
+    def _connect(self):
+        raw = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False,
+                              detect_types=sqlite3.PARSE_DECLTYPES)
+        raw.execute('PRAGMA foreign_keys = ON')
+        if not self.memory:
+            raw.execute('PRAGMA journal_mode = WAL')
+            raw.execute('PRAGMA synchronous = NORMAL')
+        conn = SqliteConnection(raw)
+        if not self._migrated:
+            self.migrate(conn)
+        return conn
+
+    def migrate(self, conn):
+        """Bring the schema up to date through ``conn``.
+
+        Returns every version this process applied, including those applied
+        when the pool opened its first connection.
+        """
+        self._applied.extend(run_migrations(conn._raw))
+        self._migrated = True
+        return list(self._applied)
+
+    def getconn(self):
+        """Borrow a connection, waiting up to ``timeout`` seconds for one to free up."""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self._check_pid()
+            waited = False
+            while not self._idle and self._size >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise self.timeout_error(f"No database connection available within {self.timeout}s "
+                                      f"(pool max is {self.maxconn}).")
+                if not waited:
+                    self._counters['waits'] += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self._counters['borrows'] += 1
+            if self._idle:
+                conn = self._idle.pop()
+                self._in_use.add(conn)
+                return conn
+            self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._size -= 1
+                raise
+            self._counters['created'] += 1
+            self._in_use.add(conn)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Return a borrowed connection, rolling back any transaction left open."""
+        with self._cond:
+            if self._pid != os.getpid() or conn not in self._in_use:
+                return
+            self._in_use.discard(conn)
+            if not conn.closed and conn.in_transaction:
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    close = True
+            if (close and not self.memory) or conn.closed:
+                conn.close()
+                self._size -= 1
+                self._counters['discarded'] += 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._check_pid()
+            conns = self._idle + list(self._in_use)
+            self._reset(self._pid)
+        for conn in conns:
+            conn.close()
+
+    def stats(self):
+        """Snapshot of pool usage for this worker process."""
+        with self._cond:
+            self._check_pid()
+            return dict(self._counters, pid=self._pid, size=self._size, idle=len(self._idle),
+                        in_use=len(self._in_use), min=0, max=self.maxconn, backend='sqlite')
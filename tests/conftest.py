@@ -0,0 +1,133 @@
+"""Shared fixtures: the app imported against a throwaway database, with no storage configured.
+
+Tests run on a fresh SQLite file. Set TEST_DATABASE_URL to an empty
+Postgres database to run them there instead (tests marked ``postgres``,
+which need row locks, only run then). Storage is left unconfigured, so no
+background janitor starts; tests hand their own UploadQueue or
+StorageJanitor a FakeStorage.
+"""
+import os
+import sys
+import tempfile
+import threading
+import uuid
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix='hustl-tests-')
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(_tmp, 'hustl.db')}"
+os.environ['UPLOAD_SPOOL_DIR'] = os.path.join(_tmp, 'spool')
+os.environ['RATE_LIMIT_ENABLED'] = 'False'
+os.environ['STORAGE_BACKEND'] = 'supabase'
+# Empty rather than unset, so load_dotenv() can't fill them in from a developer's .env
+os.environ['SUPABASE_URL'] = ''
+os.environ['SUPABASE_KEY'] = ''
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as hustl  # noqa: E402
+
+hustl.run_migrations()
+hustl.create_app()
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'postgres: needs Postgres row locks (set TEST_DATABASE_URL)')
+
+
+def pytest_collection_modifyitems(config, items):
+    if hustl.USE_SQLITE:
+        skip = pytest.mark.skip(reason='needs Postgres (set TEST_DATABASE_URL)')
+        for item in items:
+            if 'postgres' in item.keywords:
+                item.add_marker(skip)
+
+
+class FakeStorage:
+    """In-memory storage backend; ``fail`` makes the next that many calls raise."""
+
+    def __init__(self):
+        self.objects = {}  # name -> (data, content_type)
+        self.created = {}  # name -> epoch seconds, as list_objects() reports it
+        self.calls = []  # ('upload' | 'remove', name or names)
+        self.fail = 0
+        self.lock = threading.Lock()
+
+    def _maybe_fail(self):
+        if self.fail:
+            self.fail -= 1
+            raise OSError("storage is unavailable")
+
+    def upload(self, path, data, content_type):
+        with self.lock:
+            self.calls.append(('upload', path))
+            self._maybe_fail()
+            self.objects[path] = (data, content_type)
+            self.created.setdefault(path, 0)
+
+    def remove(self, paths):
+        with self.lock:
+            self.calls.append(('remove', list(paths)))
+            self._maybe_fail()
+            for path in paths:
+                self.objects.pop(path, None)
+                self.created.pop(path, None)
+
+    def list_objects(self, offset, limit):
+        with self.lock:
+            return [(name, self.created[name]) for name in sorted(self.objects)[offset:offset + limit]]
+
+    def public_url(self, path):
+        return f'https://storage.test/{path}'
+
+
+@pytest.fixture
+def storage():
+    return FakeStorage()
+
+
+@pytest.fixture
+def conn():
+    """A pooled connection, rolled back and returned after the test."""
+    conn = hustl.get_db_pool().getconn()
+    yield conn
+    conn.rollback()
+    hustl.get_db_pool().putconn(conn)
+
+
+@pytest.fixture
+def image_name():
+    """A fresh image column value, as upload_base_name() would make it."""
+    return lambda: f'{uuid.uuid4().hex}.webp'
+
+
+@pytest.fixture
+def client():
+    return hustl.app.test_client()
+
+
+@pytest.fixture
+def seller(conn):
+    """A verified seller, as a users row."""
+    email = f'seller-{uuid.uuid4().hex[:12]}@test.example'
+    user_id = hustl.repo.users.create(conn, email, 'x', 'seller', 'seller')
+    hustl.repo.users.submit_seller_profile(conn, email, 'Legal Name', f'Shop {user_id}', 'REG1', '919000000000',
+                                           'https://id.test', 'https://social.test')
+    hustl.repo.users.verify_many(conn, [user_id])
+    return hustl.repo.users.by_email(conn, email)
+
+
+@pytest.fixture
+def seller_client(client, seller):
+    with client.session_transaction() as session:
+        session['email'] = seller['email']
+    return client
+
+
+@pytest.fixture
+def admin_client():
+    client = hustl.app.test_client()  # its own session, so a test can have a seller_client too
+    with client.session_transaction() as session:
+        session['is_admin'] = True
+        session['email'] = 'admin'
+    return client
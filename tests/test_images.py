@@ -0,0 +1,140 @@
+import io
+import random
+import uuid
+
+import pytest
+from PIL import Image, ImageDraw
+from werkzeug.datastructures import FileStorage
+
+import app as hustl
+from repository import MAX_PHASH_DISTANCE, phash_distance
+
+
+def signed(bits):
+    return bits - (1 << 64) if bits >= 1 << 63 else bits
+
+
+def flip(phash, count, rng):
+    for bit in rng.sample(range(64), count):
+        phash = signed((phash ^ (1 << bit)) & 0xFFFF_FFFF_FFFF_FFFF)
+    return phash
+
+
+def refcount(conn, name):
+    row = hustl.safe_execute(conn, 'SELECT refcount FROM images WHERE name = %s', (name,), fetchone=True)
+    return row['refcount'] if row else None
+
+
+def photo(seed, size=(400, 300), fmt='JPEG', quality=90, caption=''):
+    img = Image.new('RGB', (400, 300), (seed * 40 % 255, 60, 90))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse([seed * 10, 20, seed * 10 + 100, 150], fill=(255, 255 - seed * 20, 0))
+    draw.rectangle([250, 180 - seed * 10, 380, 280], fill=(20, seed * 30 % 255, 200))
+    draw.text((10, 280), caption, fill='white')
+    buffer = io.BytesIO()
+    img.resize(size).save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def test_acquire_counts_uses_and_reports_status(conn, image_name):
+    name = image_name()
+    assert hustl.repo.images.acquire(conn, name, 123) == 'pending'
+    assert hustl.repo.images.acquire(conn, name, None) == 'pending'
+    hustl.repo.images.mark_ready(conn, name)
+    assert hustl.repo.images.acquire(conn, name, 456) == 'ready'
+    conn.commit()
+
+    assert refcount(conn, name) == 3
+    assert hustl.repo.images.phash(conn, name) == 123  # the first hash recorded is kept
+
+
+def test_acquire_many_adds_each_images_count(conn, image_name):
+    stored, new = image_name(), image_name()
+    hustl.repo.images.acquire(conn, stored, None)
+    hustl.repo.images.mark_ready(conn, stored)
+
+    statuses = hustl.repo.images.acquire_many(conn, {stored: (None, 2), new: (7, 3)})
+    conn.commit()
+
+    assert statuses == {stored: 'ready', new: 'pending'}
+    assert (refcount(conn, stored), refcount(conn, new)) == (3, 3)
+    assert hustl.repo.images.phash(conn, new) == 7
+    assert hustl.repo.images.acquire_many(conn, {}) == {}
+
+
+def test_release_and_forget_drop_only_unused_images(conn, image_name):
+    once, twice, kept = image_name(), image_name(), image_name()
+    hustl.repo.images.acquire_many(conn, {once: (None, 1), twice: (None, 2), kept: (None, 2)})
+
+    hustl.repo.images.release(conn, [once, twice, twice, kept])
+    still_used = hustl.repo.images.forget(conn, [once, twice, kept])
+    conn.commit()
+
+    assert still_used == {kept}
+    assert (refcount(conn, once), refcount(conn, twice), refcount(conn, kept)) == (None, None, 1)
+    assert hustl.repo.images.forget(conn, []) == set()
+
+
+def test_uploading_stored_bytes_again_skips_processing(conn, monkeypatch):
+    data = photo(1, caption=uuid.uuid4().hex)  # bytes no earlier run has stored
+    base_name, job = hustl.stage_image_upload(conn, FileStorage(io.BytesIO(data), 'a.jpg'))
+    assert job is not None and base_name == hustl.upload_base_name(data)
+    phash = hustl.repo.images.phash(conn, base_name)
+    hustl.repo.images.mark_ready(conn, base_name)
+    conn.commit()
+
+    def no_processing(data):
+        raise AssertionError("stored bytes were decoded again")
+    monkeypatch.setattr(hustl, 'process_upload_image', no_processing)
+    again, job = hustl.stage_image_upload(conn, FileStorage(io.BytesIO(data), 'b.jpg'))
+    conn.commit()
+
+    assert (again, job) == (base_name, None)
+    assert phash is not None and refcount(conn, base_name) == 2
+
+
+def test_phash_survives_resizing_and_recompression():
+    original = hustl.perceptual_hash(Image.open(io.BytesIO(photo(2))))
+    repost = hustl.perceptual_hash(Image.open(io.BytesIO(photo(2, size=(200, 150), fmt='JPEG', quality=40))))
+    other = hustl.perceptual_hash(Image.open(io.BytesIO(photo(5))))
+
+    assert phash_distance(original, repost) <= hustl.NEAR_DUPLICATE_DISTANCE
+    assert phash_distance(original, other) > hustl.NEAR_DUPLICATE_DISTANCE
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_band_search_finds_exactly_the_hashes_within_range(conn, image_name, seed):
+    rng = random.Random(seed)
+    base = signed(rng.getrandbits(64) | (1 << 63))  # negative, as half of all BIGINT hashes are
+    hashes = {image_name(): flip(base, distance, rng) for distance in range(13) for _ in range(4)}
+    hustl.repo.images.acquire_many(conn, {name: (phash, 1) for name, phash in hashes.items()})
+    conn.commit()
+
+    for max_distance in (0, 3, MAX_PHASH_DISTANCE):
+        found = [row for row in hustl.repo.images.similar(conn, base, max_distance, 1000) if row['name'] in hashes]
+        expected = {name for name, phash in hashes.items() if phash_distance(base, phash) <= max_distance}
+        assert {row['name'] for row in found} == expected
+        assert [row['distance'] for row in found] == sorted(phash_distance(base, hashes[row['name']])
+                                                            for row in found)
+
+    # A wider range is capped at what the band probes can find
+    assert {row['name'] for row in hustl.repo.images.similar(conn, base, 64, 1000) if row['name'] in hashes} == \
+        {name for name, phash in hashes.items() if phash_distance(base, phash) <= MAX_PHASH_DISTANCE}
+    assert len(hustl.repo.images.similar(conn, base, MAX_PHASH_DISTANCE, 5)) == 5
+
+
+def test_admin_sees_listings_with_a_near_duplicate_photo(conn, admin_client, image_name):
+    original, repost, unrelated = image_name(), image_name(), image_name()
+    rng = random.Random(7)
+    phash = signed(rng.getrandbits(64))
+    hustl.repo.images.acquire_many(conn, {original: (phash, 1), repost: (flip(phash, 2, rng), 1),
+                                          unrelated: (flip(phash, 30, rng), 1)})
+    listings = (('Original lamp', original), ('Reposted lamp', repost), ('Unrelated desk', unrelated))
+    ids = [hustl.repo.market.create(conn, title, 'Brand', '100', '919', image, 'Shop', None)
+           for title, image in listings]
+    conn.commit()
+
+    page = admin_client.get(f'/admin/manage-items/{ids[0]}/similar').get_data(as_text=True)
+
+    assert 'Reposted lamp' in page
+    assert 'Unrelated desk' not in page
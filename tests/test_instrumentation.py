@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+import app as hustl
+
+
+@pytest.fixture
+def slow_queries(monkeypatch):
+    """The statements the slow-query log would report, as (sql, params, seconds), at a 20 ms threshold."""
+    logged = []
+    monkeypatch.setattr(hustl, 'SLOW_QUERY_MS', 20)
+    monkeypatch.setattr(hustl, 'log_slow_query',
+                        lambda conn, sql, params, elapsed: logged.append((sql, params, elapsed)))
+    return logged
+
+
+def streaming_execute(conn, sql, params=(), stream=False, fetch_delay=0.01, count=3):
+    """Stands in for safe_execute(..., stream=True): each row takes ``fetch_delay`` to arrive."""
+    def rows():
+        for i in range(count):
+            time.sleep(fetch_delay)
+            yield {'id': i}
+    return rows()
+
+
+def test_streamed_queries_are_timed_while_their_rows_are_read(slow_queries):
+    rows = hustl.instrument_queries(streaming_execute)(None, 'SELECT id FROM users', (7,), stream=True)
+    assert slow_queries == []  # nothing has run yet
+
+    read = []
+    for row in rows:
+        read.append(row['id'])
+        time.sleep(0.05)  # the caller's own work is not the query's
+
+    assert read == [0, 1, 2]
+    [(sql, params, elapsed)] = slow_queries
+    assert (sql, params) == ('SELECT id FROM users', (7,))
+    assert 0.03 <= elapsed < 0.1
+
+
+def test_a_stream_closed_early_is_recorded_once(slow_queries):
+    rows = hustl.instrument_queries(streaming_execute)(None, 'SELECT id FROM users', stream=True, fetch_delay=0.025)
+
+    assert next(rows) == {'id': 0}
+    rows.close()
+
+    [(sql, params, elapsed)] = slow_queries
+    assert sql == 'SELECT id FROM users' and params == () and elapsed >= 0.02
+
+
+def test_plain_queries_are_timed_as_they_run(slow_queries):
+    def execute(conn, sql, params=(), fetchall=False):
+        time.sleep(0.03)
+        return []
+
+    assert hustl.instrument_queries(execute)(None, 'SELECT 1', fetchall=True) == []
+    assert [(sql, params) for sql, params, _ in slow_queries] == [('SELECT 1', ())]
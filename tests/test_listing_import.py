@@ -0,0 +1,229 @@
+import csv
+import io
+import json
+import os
+import uuid
+import zipfile
+
+import pytest
+from PIL import Image, ImageDraw
+from werkzeug.datastructures import FileStorage
+
+import app as hustl
+from app import UploadQueue
+
+
+def photo(caption, color=(200, 60, 90), fmt='JPEG'):
+    img = Image.new('RGB', (320, 240), color)
+    ImageDraw.Draw(img).text((20, 100), caption, fill='white')
+    buffer = io.BytesIO()
+    img.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def archive(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        for name, data in files.items():
+            z.writestr(name, data)
+    return buffer.getvalue()
+
+
+def sheet(text, filename='listings.csv'):
+    return FileStorage(io.BytesIO(text.encode()), filename)
+
+
+class Member:
+    """Stands in for a ZipInfo in validate_import_row()'s ``photos``."""
+
+    def __init__(self, file_size=1000):
+        self.file_size = file_size
+
+
+@pytest.fixture
+def queue(tmp_path, storage, monkeypatch):
+    """The upload queue imports hand their photos to, uploading to a FakeStorage."""
+    queue = UploadQueue(storage, str(tmp_path), workers=1, base_delay=0.01,
+                        on_finish=hustl.record_upload_result, process=hustl.process_upload_source)
+    monkeypatch.setattr(hustl, 'get_storage', lambda: storage)
+    monkeypatch.setattr(hustl, 'get_upload_queue', lambda: queue)
+    return queue
+
+
+def post_import(client, listings, filename='listings.csv', images=None, json_response=True):
+    data = {'listings': (io.BytesIO(listings.encode()), filename)}
+    if images is not None:
+        data['images'] = (io.BytesIO(images), 'photos.zip')
+    headers = {'Accept': 'application/json'} if json_response else {}
+    return client.post('/seller-dash/import', data=data, content_type='multipart/form-data', headers=headers)
+
+
+def listings_of(conn, seller):
+    rows = hustl.safe_execute(conn, 'SELECT title, brand, price, price_value, whatsapp, image, image_status '
+                                    'FROM market_items WHERE user_id = %s ORDER BY id', (seller['id'],), fetchall=True)
+    conn.commit()
+    return [dict(row) for row in rows]
+
+
+@pytest.mark.parametrize('filename, text', [
+    ('l.csv', 'title,price\nLamp,100\nDesk,"1,200"\n'),
+    ('l.json', '[{"title": "Lamp", "price": 100}, {"title": "Desk", "price": "1,200"}]'),
+    ('l.jsonl', '{"title": "Lamp", "price": 100}\n\n{"title": "Desk", "price": "1,200"}\n'),
+])
+def test_reads_csv_json_and_json_lines(filename, text):
+    rows = list(hustl.read_import_rows(sheet(text, filename)))
+
+    assert [fields['title'] for _, fields, _ in rows] == ['Lamp', 'Desk']
+    assert [error for _, _, error in rows] == [None, None]
+
+
+def test_reports_bad_json_by_line():
+    rows = list(hustl.read_import_rows(sheet('{"title": "Lamp", "price": 1}\n{oops\n', 'l.jsonl')))
+    assert [(row, error) for row, _, error in rows] == [(1, None), (2, "This line is not valid JSON.")]
+    assert list(hustl.read_import_rows(sheet('[{"title": ', 'l.json'))) == [(1, None, "The file is not valid JSON.")]
+
+
+@pytest.mark.parametrize('fields, photos, error', [
+    ('not an object', None, "Expected an object with a title and a price."),
+    ({'title': ' ', 'price': '10'}, None, "Title is missing."),
+    ({'title': 'Lamp', 'price': 'free'}, None, "Price is missing or not a number."),
+    ({'title': 'Lamp', 'price': '10', 'image': 'a.jpg'}, None,
+     "a.jpg needs an image archive to be uploaded with the sheet."),
+    ({'title': 'Lamp', 'price': '10', 'image': 'a.exe'}, {'a.exe': Member()}, "a.exe: file type not allowed."),
+    ({'title': 'Lamp', 'price': '10', 'image': 'a.jpg'}, {}, "a.jpg is not in the image archive."),
+    ({'title': 'Lamp', 'price': '10', 'image': 'a.jpg'}, {'a.jpg': Member(10 ** 9)},
+     "a.jpg is larger than the upload limit."),
+])
+def test_rejects_invalid_rows(seller, fields, photos, error):
+    assert hustl.validate_import_row(fields, seller, photos) == (None, error)
+
+
+def test_fills_in_the_sellers_defaults(seller):
+    values, error = hustl.validate_import_row({' Title ': ' Lamp ', 'PRICE': 250, 'brand': '', 'extra': None},
+                                              seller, None)
+
+    assert error is None
+    assert values == {'title': 'Lamp', 'brand': seller['display_name'], 'price': '250',
+                      'whatsapp': seller['whatsapp'], 'image': None, 'seller_brand': seller['display_name'],
+                      'user_id': seller['id']}
+    no_number = dict(seller, whatsapp=None)
+    assert hustl.validate_import_row({'title': 'Lamp', 'price': '1'}, no_number, None) == \
+        (None, "WhatsApp number is missing.")
+
+
+def test_imports_good_rows_and_reports_the_rest(conn, seller, seller_client, queue, storage):
+    tag = uuid.uuid4().hex
+    one, two = photo(f'one {tag}'), photo(f'two {tag}', color=(20, 160, 90), fmt='PNG')
+    photos = archive({'pics/one.jpg': one, 'two.png': two, 'copy.jpg': one, 'bad.jpg': b'not an image'})
+    listings = ('title,price,brand,image\n'
+                'Lamp,450,,one.jpg\n'
+                'Desk,"1,200",IKEA,two.png\n'
+                ',100,,\n'
+                'Broken,50,,bad.jpg\n'
+                'Missing,50,,nope.jpg\n'
+                'Same lamp,460,,copy.jpg\n'
+                'Chair,99,,\n')
+
+    response = post_import(seller_client, listings, images=photos)
+    assert queue.drain(10)
+
+    assert response.get_json() == {'imported': 4, 'errors': [
+        {'row': 4, 'error': "Title is missing."},
+        {'row': 5, 'error': "bad.jpg: That file is not a valid image."},
+        {'row': 6, 'error': "nope.jpg is not in the image archive."},
+    ]}
+    one_name, two_name = hustl.upload_base_name(one), hustl.upload_base_name(two)
+    rows = listings_of(conn, seller)
+    assert [(row['title'], row['brand'], row['price_value'], row['image'], row['image_status']) for row in rows] == [
+        ('Lamp', seller['display_name'], 450, one_name, 'ready'),
+        ('Desk', 'IKEA', 1200, two_name, 'ready'),
+        ('Same lamp', seller['display_name'], 460, one_name, 'ready'),
+        ('Chair', seller['display_name'], 99, 'default.png', 'ready'),
+    ]
+    # Two photos, each decoded and uploaded once, at every size
+    assert set(storage.objects) == set(hustl.image_object_names(one_name) + hustl.image_object_names(two_name))
+    assert [kind for kind, _ in storage.calls].count('upload') == 2 * len(hustl.IMAGE_VARIANTS)
+    for name, uses in ((one_name, 2), (two_name, 1)):
+        row = hustl.safe_execute(conn, 'SELECT status, refcount, phash FROM images WHERE name = %s', (name,),
+                                 fetchone=True)
+        assert (row['status'], row['refcount']) == ('ready', uses) and row['phash'] is not None
+    conn.commit()
+
+
+def test_reimporting_a_stored_photo_skips_the_upload(conn, seller, seller_client, queue, storage):
+    data = photo(uuid.uuid4().hex)
+    photos = archive({'a.jpg': data})
+    post_import(seller_client, 'title,price,image\nFirst,10,a.jpg\n', images=photos)
+    assert queue.drain(10)
+    uploads = len(storage.calls)
+
+    response = post_import(seller_client, 'title,price,image\nSecond,20,a.jpg\n', images=photos)
+
+    assert response.get_json() == {'imported': 1, 'errors': []}
+    assert queue.pending() == 0 and len(storage.calls) == uploads
+    assert [row['image_status'] for row in listings_of(conn, seller)] == ['ready', 'ready']
+
+
+def test_a_failed_insert_spools_and_counts_nothing(conn, seller, seller_client, queue, tmp_path, monkeypatch):
+    data = photo(uuid.uuid4().hex)
+
+    def failing_insert(conn, listings, page_size=100):
+        conn.rollback()  # as safe_execute does when a statement fails
+        return None
+    monkeypatch.setattr(hustl.repo.market, 'create_many', failing_insert)
+    response = post_import(seller_client, 'title,price,image\nLamp,10,a.jpg\n', images=archive({'a.jpg': data}))
+
+    assert response.get_json() == {'imported': 0, 'errors': [
+        {'row': None, 'error': "The listings could not be saved; nothing was imported."}]}
+    assert hustl.repo.images.status(conn, hustl.upload_base_name(data)) is None
+    conn.commit()
+    assert not [files for _, _, files in os.walk(tmp_path) if files]
+    assert listings_of(conn, seller) == []
+
+
+def test_stops_at_the_row_limit(conn, seller, seller_client, monkeypatch):
+    monkeypatch.setattr(hustl, 'LISTING_IMPORT_MAX_ROWS', 2)
+
+    response = post_import(seller_client, 'title,price\nA,1\nB,2\nC,3\nD,4\n', json_response=False)
+
+    page = response.get_data(as_text=True)
+    assert response.status_code == 200 and 'Skipped Rows' in page and 'Row 4' in page
+    assert [row['title'] for row in listings_of(conn, seller)] == ['A', 'B']
+
+
+def test_only_verified_sellers_can_import(conn, client):
+    email = f'buyer-{uuid.uuid4().hex[:12]}@test.example'
+    hustl.repo.users.create(conn, email, 'x')
+    conn.commit()
+    with client.session_transaction() as session:
+        session['email'] = email
+
+    response = post_import(client, 'title,price\nLamp,1\n')
+
+    assert response.status_code == 302 and response.headers['Location'].endswith('/seller-dash')
+
+
+@pytest.mark.parametrize('value, cell', [
+    ('=HYPERLINK("http://evil.test","open")', '\'=HYPERLINK("http://evil.test","open")'),
+    ('+1+1', "'+1+1"),
+    ('-1+1', "'-1+1"),
+    ('@SUM(A1)', "'@SUM(A1)"),
+    ('Desk lamp', 'Desk lamp'),
+    ('', ''),
+    (42, 42),
+    (None, None),
+])
+def test_csv_cell_defuses_formulas(value, cell):
+    assert hustl.csv_cell(value) == cell
+
+
+def test_imported_formulas_are_exported_as_text(seller, seller_client, admin_client):
+    titles = ['=cmd|" /C calc"!A0', '@SUM(1+1)']
+    listings = json.dumps([{'title': title, 'price': 5, 'brand': '+brand'} for title in titles])
+    assert post_import(seller_client, listings, filename='l.json').get_json()['imported'] == 2
+
+    response = admin_client.get('/admin/manage-items.csv')
+
+    rows = [row for row in csv.DictReader(io.StringIO(response.get_data(as_text=True)))
+            if row['user_id'] == str(seller['id'])]
+    assert sorted((row['title'], row['brand']) for row in rows) == sorted(("'" + title, "'+brand") for title in titles)
@@ -0,0 +1,117 @@
+import pytest
+
+import app as hustl
+
+
+def stats(conn):
+    values = {row['name']: row['value'] for row in hustl.repo.stats.all(conn)}
+    conn.commit()
+    return values
+
+
+def failing(conn, *args, **kwargs):
+    """A repository step whose statement fails, as safe_execute reports it (rolled back, None)."""
+    return hustl.safe_execute(conn, 'SELECT * FROM no_such_table')
+
+
+def lost_report_with_claim(conn, image_name):
+    image = image_name()
+    item_id = hustl.repo.lost.create(conn, 'Blue bottle', 'Steel', 'Library', 'Front desk', image)
+    hustl.repo.images.acquire(conn, image, None)
+    hustl.repo.claims.create(conn, item_id, 'owner@test.example', 'Has my name on it')
+    claim = hustl.safe_execute(conn, 'SELECT id FROM claim_requests WHERE item_id = %s', (item_id,), fetchone=True)
+    hustl.bump_stats(conn, commit=True, active_reports=1)
+    return item_id, claim['id'], image
+
+
+def lost_row(conn, item_id):
+    row = hustl.safe_execute(conn, '''SELECT lost_items.image, lost_items.is_recovered, claim_requests.status
+                                      FROM lost_items JOIN claim_requests ON claim_requests.item_id = lost_items.id
+                                      WHERE lost_items.id = %s''', (item_id,), fetchone=True)
+    conn.commit()
+    return dict(row)
+
+
+def test_approving_a_claim_recovers_the_item_and_counts_it(conn, image_name):
+    item_id, claim_id, image = lost_report_with_claim(conn, image_name)
+    before = stats(conn)
+
+    assert hustl.approve_claims(conn, [claim_id]) == 1
+
+    assert lost_row(conn, item_id) == {'image': None, 'is_recovered': 1, 'status': 'approved'}
+    after = stats(conn)
+    assert after['verified_returns'] == before.get('verified_returns', 0) + 1
+    assert after['active_reports'] == before['active_reports'] - 1
+    assert after['recovered_week'] == before['recovered_week'] + 1
+    assert hustl.safe_execute(conn, 'SELECT name FROM storage_deletions WHERE name = %s', (image,), fetchone=True)
+    conn.commit()
+
+
+def test_recovered_reports_are_no_longer_listed(conn, image_name):
+    item_id, claim_id, _ = lost_report_with_claim(conn, image_name)
+    assert item_id in [row['id'] for row in hustl.repo.lost.latest(conn, 4)]
+
+    hustl.approve_claims(conn, [claim_id])
+
+    assert item_id not in [row['id'] for row in hustl.repo.lost.latest(conn, 100)]
+    assert item_id not in [row['id'] for row in hustl.repo.lost.page(conn, None, 100)]
+    conn.commit()
+
+
+@pytest.mark.parametrize('step', [
+    (lambda repo: repo.lost, 'mark_recovered_many'),
+    (lambda repo: repo.images, 'release'),
+    (lambda repo: repo.storage, 'enqueue'),
+    (lambda repo: repo.stats, 'record_claim_approvals'),
+    (lambda repo: repo.stats, 'bump'),
+])
+def test_approving_claims_is_all_or_nothing(conn, image_name, monkeypatch, step):
+    item_id, claim_id, image = lost_report_with_claim(conn, image_name)
+    before = stats(conn)
+    namespace, method = step
+    monkeypatch.setattr(namespace(hustl.repo), method, failing)
+
+    assert hustl.approve_claims(conn, [claim_id]) == 0
+
+    assert lost_row(conn, item_id) == {'image': image, 'is_recovered': 0, 'status': 'pending'}
+    assert stats(conn) == before
+
+
+def test_deleting_listings_releases_their_images_and_counts_it(conn, image_name):
+    image = image_name()
+    item_id = hustl.repo.market.create(conn, 'Lamp', 'Brand', '100', '919', image, 'Shop', None)
+    hustl.repo.images.acquire(conn, image, None)
+    hustl.bump_stats(conn, commit=True, market_listings=1)
+    before = stats(conn)
+
+    assert hustl.delete_market_items(conn, [item_id]) == 1
+
+    assert hustl.repo.market.get(conn, item_id) is None
+    assert stats(conn)['market_listings'] == before['market_listings'] - 1
+    assert hustl.safe_execute(conn, 'SELECT refcount FROM images WHERE name = %s', (image,),
+                              fetchone=True)['refcount'] == 0
+    conn.commit()
+
+
+@pytest.mark.parametrize('step', [
+    (lambda repo: repo.images, 'release'),
+    (lambda repo: repo.storage, 'enqueue'),
+    (lambda repo: repo.stats, 'bump'),
+])
+def test_deleting_listings_is_all_or_nothing(conn, image_name, monkeypatch, step):
+    image = image_name()
+    item_id = hustl.repo.market.create(conn, 'Lamp', 'Brand', '100', '919', image, 'Shop', None)
+    hustl.repo.images.acquire(conn, image, None)
+    hustl.bump_stats(conn, commit=True, market_listings=1)
+    before = stats(conn)
+    namespace, method = step
+    monkeypatch.setattr(namespace(hustl.repo), method, failing)
+
+    assert hustl.delete_market_items(conn, [item_id]) == 0
+
+    assert hustl.repo.market.get(conn, item_id)['image'] == image
+    conn.commit()
+    assert stats(conn) == before
+    assert hustl.safe_execute(conn, 'SELECT refcount FROM images WHERE name = %s', (image,),
+                              fetchone=True)['refcount'] == 1
+    conn.commit()
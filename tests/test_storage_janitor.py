@@ -0,0 +1,138 @@
+import time
+
+import pytest
+
+import app as hustl
+from app import StorageJanitor
+
+
+@pytest.fixture
+def janitor(storage):
+    return StorageJanitor(storage, poll_interval=60, sweep_interval=3600, sweep_grace=600)
+
+
+def store_image(storage, name, created=0):
+    for obj in hustl.image_object_names(name):
+        storage.objects[obj] = (b'x', 'image/webp')
+        storage.created[obj] = created
+
+
+def queued(conn, names):
+    rows = hustl.safe_execute(conn, 'SELECT name, attempts, next_attempt_at, last_error FROM storage_deletions '
+                                    'WHERE name = ANY(%s)', (list(names),), fetchall=True)
+    conn.commit()
+    return {row['name']: row for row in rows}
+
+
+def listing(conn, image):
+    item_id = hustl.repo.market.create(conn, 'Lamp', 'Brand', '100', '919', image, 'Shop', None)
+    hustl.repo.images.acquire(conn, image, None)
+    conn.commit()
+    return item_id
+
+
+def test_removes_every_object_of_a_deleted_listings_image(conn, storage, janitor, image_name):
+    name = image_name()
+    store_image(storage, name)
+    item_id = listing(conn, name)
+
+    assert hustl.delete_market_items(conn, [item_id]) == 1
+    assert name in queued(conn, [name])
+    janitor.process_batch(conn)
+
+    assert not any(obj.startswith(name[:32]) for obj in storage.objects)
+    [(kind, removed)] = [call for call in storage.calls if call[0] == 'remove']
+    assert set(hustl.image_object_names(name)) <= set(removed)
+    assert queued(conn, [name]) == {}
+    assert hustl.repo.images.status(conn, name) is None
+
+
+def test_keeps_images_another_row_still_shows(conn, storage, janitor, image_name):
+    name = image_name()
+    store_image(storage, name)
+    first, second = listing(conn, name), listing(conn, name)
+
+    hustl.delete_market_items(conn, [first])
+    janitor.process_batch(conn)
+
+    assert set(hustl.image_object_names(name)) <= set(storage.objects)
+    assert queued(conn, [name]) == {}
+    assert hustl.repo.images.status(conn, name) == 'pending'
+    hustl.delete_market_items(conn, [second])
+    janitor.process_batch(conn)
+    assert not set(hustl.image_object_names(name)) & set(storage.objects)
+
+
+def test_failed_removals_back_off(conn, storage, janitor, image_name):
+    name = image_name()
+    store_image(storage, name)
+    hustl.repo.storage.enqueue(conn, [name], commit=True)
+    storage.fail = 1
+
+    before = time.time()
+    janitor.process_batch(conn)
+
+    entry = queued(conn, [name])[name]
+    assert entry['attempts'] == 1 and 'storage is unavailable' in entry['last_error']
+    delay = hustl.STORAGE_DELETE_BASE_DELAY
+    assert before + delay * 0.8 - 1 <= entry['next_attempt_at'] <= time.time() + delay * 1.2
+    assert set(hustl.image_object_names(name)) <= set(storage.objects)
+    # Not due again until then; the next failure waits twice as long
+    assert name not in {row['name'] for row in hustl.repo.storage.due(conn, time.time(), 1000)}
+    conn.rollback()
+    hustl.safe_execute(conn, 'UPDATE storage_deletions SET next_attempt_at = 0 WHERE name = %s', (name,), commit=True)
+    storage.fail = 1
+    before = time.time()
+    janitor.process_batch(conn)
+    entry = queued(conn, [name])[name]
+    assert entry['attempts'] == 2 and entry['next_attempt_at'] >= before + 2 * delay * 0.8 - 1
+
+    janitor.process_batch(conn)  # not due yet: nothing happens
+    assert set(hustl.image_object_names(name)) <= set(storage.objects)
+
+
+def test_sweep_queues_only_old_unreferenced_images(conn, storage, janitor, image_name):
+    orphan, young, used = image_name(), image_name(), image_name()
+    long_ago = time.time() - janitor.sweep_grace - 60
+    store_image(storage, orphan, long_ago)
+    store_image(storage, young, time.time())
+    store_image(storage, used, long_ago)
+    listing(conn, used)
+
+    assert janitor.sweep(conn) >= 1
+
+    assert set(queued(conn, [orphan, young, used])) == {orphan}
+
+
+def test_sweep_lease_is_taken_once_per_interval(conn):
+    hustl.safe_execute(conn, "DELETE FROM site_stats WHERE name = 'storage_swept_at'", commit=True)
+    now = time.time()
+
+    assert hustl.repo.storage.claim_sweep(conn, now, 3600)
+    assert not hustl.repo.storage.claim_sweep(conn, now + 10, 3600)
+    assert hustl.repo.storage.claim_sweep(conn, now + 3600, 3600)
+
+
+@pytest.mark.postgres
+def test_two_janitors_never_take_the_same_entries(conn, storage, janitor, image_name):
+    names = [image_name() for _ in range(3)]
+    for name in names:
+        store_image(storage, name)
+    hustl.repo.storage.enqueue(conn, names, commit=True)
+    other = hustl.get_db_pool().getconn()
+    try:
+        taken = {row['name'] for row in hustl.repo.storage.due(conn, time.time(), 1000)}
+        assert set(names) <= taken
+
+        # While the first janitor holds them, a second one skips them instead of waiting
+        assert not set(names) & {row['name'] for row in hustl.repo.storage.due(other, time.time(), 1000)}
+        other.rollback()
+        janitor.process_batch(other)
+        assert all(set(hustl.image_object_names(name)) <= set(storage.objects) for name in names)
+
+        conn.rollback()
+        janitor.process_batch(other)
+        assert not any(set(hustl.image_object_names(name)) & set(storage.objects) for name in names)
+    finally:
+        other.rollback()
+        hustl.get_db_pool().putconn(other)
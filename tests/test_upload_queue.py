@@ -0,0 +1,232 @@
+import json
+import os
+import time
+
+import pytest
+
+import app as hustl
+from app import UploadQueue
+
+
+class Recorder:
+    """on_finish callback that remembers each (job, ok)."""
+
+    def __init__(self):
+        self.results = []
+
+    def __call__(self, job, ok):
+        self.results.append((dict(job), ok))
+
+
+def upload_times(storage, name):
+    return [at for kind, path, at in storage.timed if kind == 'upload' and path == name]
+
+
+@pytest.fixture
+def timed_storage(storage):
+    """FakeStorage that also records when each call was made."""
+    storage.timed = []
+    upload = storage.upload
+
+    def timed_upload(path, data, content_type):
+        storage.timed.append(('upload', path, time.monotonic()))
+        upload(path, data, content_type)
+    storage.upload = timed_upload
+    return storage
+
+
+def spool_files(spool_dir):
+    return {sub: sorted(os.listdir(os.path.join(spool_dir, sub)))
+            for sub in ('objects', 'jobs', 'sources') if os.path.isdir(os.path.join(spool_dir, sub))}
+
+
+def test_retries_with_backoff_until_the_upload_lands(tmp_path, timed_storage):
+    timed_storage.fail = 2
+    finished = Recorder()
+    queue = UploadQueue(timed_storage, str(tmp_path), workers=1, max_attempts=5, base_delay=0.05,
+                        on_finish=finished)
+    job = queue.spool({'a_grid.webp': (b'grid', 'image/webp')})
+    queue.submit(job, 'market_items', 1)
+    assert queue.drain(10)
+
+    assert timed_storage.objects == {'a_grid.webp': (b'grid', 'image/webp')}
+    [(done, ok)] = finished.results
+    assert ok and done['attempt'] == 3
+    # base_delay, then twice that, each with at most 20% jitter taken off
+    first, second, third = upload_times(timed_storage, 'a_grid.webp')
+    assert second - first >= 0.05 * 0.8
+    assert third - second >= 0.1 * 0.8
+    assert spool_files(tmp_path) == {'objects': [], 'jobs': []}
+
+
+def test_gives_up_after_max_attempts(tmp_path, storage):
+    storage.fail = 100
+    finished = Recorder()
+    queue = UploadQueue(storage, str(tmp_path), workers=1, max_attempts=3, base_delay=0.01, on_finish=finished)
+    queue.submit(queue.spool({'b_grid.webp': (b'grid', 'image/webp')}), 'market_items', 2)
+    assert queue.drain(10)
+
+    [(done, ok)] = finished.results
+    assert not ok and done['attempt'] == 3
+    assert [kind for kind, _ in storage.calls] == ['upload'] * 3
+    assert spool_files(tmp_path) == {'objects': [], 'jobs': []}
+
+
+def test_keeps_the_spool_when_the_result_cannot_be_recorded(tmp_path, storage):
+    def on_finish(job, ok):
+        raise RuntimeError("database is down")
+
+    queue = UploadQueue(storage, str(tmp_path), workers=1, on_finish=on_finish)
+    job = queue.spool({'c_grid.webp': (b'grid', 'image/webp')})
+    queue.submit(job, 'market_items', 3)
+    assert queue.drain(10)
+
+    # A recovering worker finds the job and its objects and records the result then
+    assert spool_files(tmp_path) == {'objects': ['c_grid.webp'], 'jobs': [f"{job['id']}.json"]}
+
+
+def test_adopts_only_stale_jobs_left_by_a_dead_worker(tmp_path, storage):
+    dead = UploadQueue(storage, str(tmp_path))  # never started, like a worker killed before its threads ran
+    stale = dead.spool({'d_grid.webp': (b'stale', 'image/webp')})
+    fresh = dead.spool({'e_grid.webp': (b'fresh', 'image/webp')})
+    for job, row_id in ((stale, 4), (fresh, 5)):
+        job.update(table='market_items', row_id=row_id)
+        dead._save(job)
+    long_ago = time.time() - hustl.UPLOAD_RECOVER_AFTER - 60
+    os.utime(dead._job_path(stale['id']), (long_ago, long_ago))
+
+    finished = Recorder()
+    queue = UploadQueue(storage, str(tmp_path), workers=1, on_finish=finished)
+    queue.start()
+    assert queue.drain(10)
+
+    assert list(storage.objects) == ['d_grid.webp']
+    assert [(job['id'], job['row_id'], ok) for job, ok in finished.results] == [(stale['id'], 4, True)]
+    # The fresh job may still belong to a live worker, so it is left alone
+    assert spool_files(tmp_path) == {'objects': ['e_grid.webp'], 'jobs': [f"{fresh['id']}.json"]}
+    with open(dead._job_path(fresh['id'])) as f:
+        assert json.load(f)['row_id'] == 5
+
+
+def test_keeps_looking_for_stale_jobs_after_starting(tmp_path, storage, monkeypatch):
+    monkeypatch.setattr(hustl, 'UPLOAD_RECOVER_INTERVAL', 0.05)
+    finished = Recorder()
+    queue = UploadQueue(storage, str(tmp_path), workers=1, on_finish=finished)
+    queue.start()
+
+    dead = UploadQueue(storage, str(tmp_path))
+    job = dead.spool({'h_grid.webp': (b'late', 'image/webp')})
+    job.update(table='market_items', row_id=9)
+    dead._save(job)
+    long_ago = time.time() - hustl.UPLOAD_RECOVER_AFTER - 60
+    os.utime(dead._job_path(job['id']), (long_ago, long_ago))
+
+    deadline = time.monotonic() + 10
+    while not finished.results and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.drain(10)
+    assert [(done['id'], ok) for done, ok in finished.results] == [(job['id'], True)]
+    assert list(storage.objects) == ['h_grid.webp']
+
+
+def test_touches_the_jobs_it_holds_so_no_one_adopts_them(tmp_path, storage, monkeypatch):
+    monkeypatch.setattr(hustl, 'UPLOAD_RECOVER_INTERVAL', 0.05)
+    storage.fail = 1
+    queue = UploadQueue(storage, str(tmp_path), workers=1, base_delay=60)  # waits a long time to retry
+    job = queue.spool({'i_grid.webp': (b'slow', 'image/webp')})
+    queue.submit(job, 'market_items', 10)
+    path = queue._job_path(job['id'])
+    deadline = time.monotonic() + 10
+    while not (job['attempt'] and queue.pending() == 1 and not queue._running) and time.monotonic() < deadline:
+        time.sleep(0.01)  # until the first attempt has failed and its retry is queued
+    long_ago = time.time() - hustl.UPLOAD_RECOVER_AFTER - 60
+    os.utime(path, (long_ago, long_ago))
+
+    deadline = time.monotonic() + 10
+    while os.path.getmtime(path) < time.time() - 60 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert os.path.getmtime(path) > time.time() - 60
+    # Touched rather than adopted: the job is queued once, for its retry
+    assert queue.pending() == 1
+
+
+def test_source_jobs_are_processed_by_the_worker(tmp_path, storage):
+    def process(data):
+        if data == b'junk':
+            raise hustl.InvalidImage("That file is not a valid image.")
+        return {'f_grid.webp': (data.upper(), 'image/webp')}, {'phash': 42}
+
+    finished = Recorder()
+    queue = UploadQueue(storage, str(tmp_path), workers=1, max_attempts=5, base_delay=0.01,
+                        on_finish=finished, process=process)
+    good = queue.spool_source(b'photo', image='f.webp')
+    bad = queue.spool_source(b'junk', image='g.webp')
+    queue.submit(good, 'market_items', [6, 7])
+    queue.submit(bad, 'market_items', [8])
+    assert queue.drain(10)
+
+    results = {job['image']: (job, ok) for job, ok in finished.results}
+    job, ok = results['f.webp']
+    assert ok and job['phash'] == 42 and job['objects'] == {'f_grid.webp': 'image/webp'} and job['row_id'] == [6, 7]
+    assert storage.objects == {'f_grid.webp': (b'PHOTO', 'image/webp')}
+    # A source that can't be processed fails at once rather than being retried
+    job, ok = results['g.webp']
+    assert not ok and job['attempt'] == 1
+    assert spool_files(tmp_path) == {'objects': [], 'jobs': [], 'sources': []}
+
+
+def pending_listing(conn, seller, image):
+    item_id = hustl.repo.market.create(conn, 'Lamp', 'Brand', '100', '919', image, 'Shop', seller['id'],
+                                       image_status='pending')
+    hustl.repo.images.acquire(conn, image, None)
+    conn.commit()
+    return item_id
+
+
+def image_row(conn, name):
+    return hustl.safe_execute(conn, 'SELECT status, phash, refcount FROM images WHERE name = %s', (name,),
+                              fetchone=True)
+
+
+def image_statuses(conn, item_ids):
+    rows = hustl.safe_execute(conn, 'SELECT id, image_status FROM market_items WHERE id = ANY(%s)',
+                              (list(item_ids),), fetchall=True)
+    conn.commit()
+    return {row['id']: row['image_status'] for row in rows}
+
+
+def test_record_upload_result_marks_the_rows_and_image_ready(conn, seller, image_name):
+    name = image_name()
+    item_id = pending_listing(conn, seller, name)
+    objects = {hustl.image_variant_name(name, variant): 'image/webp' for variant in hustl.IMAGE_VARIANTS}
+
+    hustl.record_upload_result({'table': 'market_items', 'row_id': item_id, 'objects': objects}, True)
+
+    assert image_statuses(conn, [item_id]) == {item_id: 'ready'}
+    assert image_row(conn, name)['status'] == 'ready'
+
+
+def test_record_upload_result_for_a_source_job(conn, seller, image_name):
+    name = image_name()
+    first, second = pending_listing(conn, seller, name), pending_listing(conn, seller, name)
+
+    hustl.record_upload_result({'table': 'market_items', 'row_id': [first, second], 'image': name,
+                                'phash': -12345, 'objects': {}}, True)
+
+    assert image_statuses(conn, [first, second]) == {first: 'ready', second: 'ready'}
+    assert dict(image_row(conn, name)) == {'status': 'ready', 'phash': -12345, 'refcount': 2}
+
+
+def test_record_upload_result_after_giving_up(conn, seller, image_name):
+    name = image_name()
+    item_id = pending_listing(conn, seller, name)
+
+    hustl.record_upload_result({'table': 'market_items', 'row_id': item_id, 'image': name, 'objects': {}}, False)
+
+    assert image_statuses(conn, [item_id]) == {item_id: 'failed'}
+    assert image_row(conn, name)['status'] == 'pending'
+
+
+def test_record_upload_result_rejects_unknown_tables():
+    with pytest.raises(ValueError):
+        hustl.record_upload_result({'table': 'users', 'row_id': 1, 'objects': {}}, True)